@@ -3,10 +3,16 @@ from auth import User, CustomLoginManager
 from flask import Flask, render_template, session, request, \
     redirect, url_for, flash, jsonify
 from flask_socketio import SocketIO, emit
+import json
 from functools import wraps
+from collections import deque
 from datetime import timedelta
-from time import strptime
-from gps import *
+from time import strptime, monotonic
+from gpsdclient import GpsdClient
+from satdelta import SatTable
+from emitter import Emitter
+from demand import Demand
+from hwdaemon import ManagerProxy, split_mode
 
 # Дата не может быть старше, чем 19.01.2038
 if time.time() > mktime(strptime("2038-01-19 00:00:00", "%Y-%m-%d %H:%M:%S")):
@@ -20,14 +26,30 @@ flask_app.config.update(SECRET_KEY=secret_key,
                         SESSION_REFRESH_EACH_REQUEST=True,
                         )
 socketio_app = SocketIO(flask_app, async_mode=None, cookie=None, logger=False, engineio_logger=False)
-manager = Manager(logger=flask_app.logger, args=sys.argv)
+# обмен с УПШ выполняется в этом процессе или в отдельном процессе hwdaemon
+if split_mode():
+    manager = ManagerProxy(logger=flask_app.logger, args=sys.argv)
+    flask_app.before_request(manager.sync)
+else:
+    manager = Manager(logger=flask_app.logger, args=sys.argv)
 user = User(1, u"name")     # создаем пользователя с дефолтным именем, при подключении клиента именем станет ip
 login_manager = CustomLoginManager()
 login_manager.init(flask_app)
+# ход выполнения фоновых заданий передается веб-интерфейсу
+finished_jobs = deque(maxlen=20)
+
+sat_table = SatTable()
+# потоки данных веб страниц: не чаще 2 раз в секунду, неизмененные данные не передаются
+emitter = Emitter(socketio_app.emit, rates={'/gps': 2.0, '/time': 2.0},
+                  sleep=socketio_app.sleep, start=socketio_app.start_background_task)
+# подключенные веб страницы: без подписчиков потоки работают с пониженной частотой
+demand = Demand()
 
 thread_gps = None
-thread_time = None
-thread_control = None
+# время gpsd при предыдущей проверке и момент проверки (monotonic)
+saved_gps_time = (None, 0.0)
+# период проверки обновления данных ГНСС, с
+gps_timeout = 3
 # lock = Lock()
 
 
@@ -43,6 +65,58 @@ def flash_message(msg: str, category=None) -> None:
     flash(msg, category)
 
 
+def save_lan(lan: str, ip: str, netmask: str, gateway: str, listen: str) -> str:
+    """
+    Изменяет сетевые настройки, выполняется в фоновом задании
+
+    :return: сообщение об успешности изменения
+    """
+    err_msg = manager.change_net_cfg(lan, ip, netmask, gateway, listen)
+    if err_msg != '':
+        raise ValueError(err_msg + " Настройки %s не сохранены!" % settings.net[lan]['label'])
+    return "Настройки %s изменены!" % settings.net[lan]['label']
+
+
+def flash_job(job) -> None:
+    """
+    Сообщает о постановке действия в очередь фоновых заданий
+
+    :param job: задание
+    :return: None
+    """
+    if job.merged:
+        flash(u"Задание %d обновлено, выполняется..." % job.id)
+    else:
+        flash(u"Задание %d выполняется..." % job.id)
+
+
+def on_job_change(job) -> None:
+    """
+    Передает состояние задания веб-интерфейсу, сохраняет результаты
+    завершенных заданий для вывода при следующей загрузке страницы
+
+    :param job: задание
+    :return: None
+    """
+    socketio_app.emit('job_event', job.as_dict(), namespace='/jobs')
+    if job.key[0] == 'web' and job.state in ('done', 'error'):
+        finished_jobs.append(job)
+
+
+def flash_finished_jobs() -> None:
+    """
+    Выводит на экран результаты завершенных фоновых заданий
+
+    :return: None
+    """
+    while finished_jobs:
+        job = finished_jobs.popleft()
+        if job.state == 'error':
+            flash_message(u"%s" % job.error, 'warning')
+        elif job.result:
+            flash_message(u"%s" % job.result)
+
+
 @flask_app.before_request
 def make_session_permanent() -> None:
     """
@@ -91,6 +165,7 @@ def login() -> str:
     :return: функция формирования шаблона веб страницы
     """
     if manager.reset_webserver:
+        restarter.flush()
         run_cmd("systemctl restart webserver")
     if request.method == "POST":
         if user.check_password(request.form.get("hash")):
@@ -143,6 +218,18 @@ def reauth():
     return jsonify(response)
 
 
+@flask_app.route("/timing", methods=["GET"])
+@authenticated_only
+def timing():
+    """
+    Возвращает статистику задержек передачи структуры времени в УПШ
+
+    :return: словарь с перцентилями задержек по этапам
+    """
+    return jsonify(dict(manager.timing_stats(), sat_table=sat_table.stats(), emitter=emitter.stats(),
+                        demand=demand.stats()))
+
+
 @flask_app.route('/', methods=['GET', 'POST'])
 @flask_app.route('/main.html', methods=['GET', 'POST'])
 @authenticated_only
@@ -156,27 +243,33 @@ def main() -> str:
 
         action = request.form.get('btn')
         msg = None
+        job = None
 
         if action == 'set_sync':
-            msg = manager.set_sync_source(request.form.get('sync_src'))
+            job = manager.submit(('web', 'set_sync_source'), manager.set_sync_source, request.form.get('sync_src'))
         elif action == 'set_ext_sync':
-            msg = manager.set_ext_sync_source(request.form.get('ext_sync_src'))
+            job = manager.submit(('web', 'set_ext_sync_source'), manager.set_ext_sync_source, request.form.get('ext_sync_src'))
         elif action == 'save_time':
             msg = manager.save_time(request.form.get('date'), request.form.get('time'))
         elif action == 'save_time_settings':
-            msg = manager.save_time_settings(request.form.get('timejump'),
-                                             request.form.get('tz'),
-                                             request.form.get('tz_kv'),
-                                             request.form.get('tz_rs'), )
+            job = manager.submit(('web', action), manager.save_time_settings,
+                                 request.form.get('timejump'),
+                                 request.form.get('tz'),
+                                 request.form.get('tz_kv'),
+                                 request.form.get('tz_rs'), )
         elif action == 'save_gnss':
-            msg = manager.save_gnss(request.form.get('ext_sync_src'),
-                                    request.form.get('speed'),
-                                    request.form.get('sat_system'),
-                                    request.form.get('reciever'))
-
+            job = manager.submit(('web', action), manager.save_gnss,
+                                 request.form.get('ext_sync_src'),
+                                 request.form.get('speed'),
+                                 request.form.get('sat_system'),
+                                 request.form.get('reciever'))
+
+        if job:
+            flash_job(job)
         if msg:
             flash_message(u"%s" % msg)
 
+    flash_finished_jobs()
     return render_template('main.html',
                            main=manager.get_main(),
                            header=settings.header)
@@ -191,20 +284,19 @@ def net() -> str:
     :return: функция формирования шаблона веб страницы
     """
     if request.method == 'POST' and request.form.get('btn') == 'save_lan':
-        err_msg = manager.change_net_cfg(request.form.get('lan'),
-                                         request.form.get('ip'),
-                                         request.form.get('netmask'),
-                                         request.form.get('gateway'),
-                                         request.form.get('listen'),
-                                         )
-        if err_msg == '':
-            msg = "Настройки %s изменены!" % settings.net[request.form.get('lan')]['label']
-            flash(u"%s" % msg)
-        else:
-            msg = err_msg + " Настройки %s не сохранены!" % settings.net[request.form.get('lan')]['label']
-            flash_message(u"%s" % msg, 'warning')
+        lan = request.form.get('lan')
+        flash_job(manager.submit(('web', 'save_lan', lan), save_lan,
+                                 lan,
+                                 request.form.get('ip'),
+                                 request.form.get('netmask'),
+                                 request.form.get('gateway'),
+                                 request.form.get('listen'),
+                                 ))
+    flash_finished_jobs()
+    # пока задание изменения сети не выполнено, страница выводит сохраненные
+    # настройки: чтение системы и запись ntp.conf - после завершения задания
     return render_template('net.html',
-                           net=manager.get_net_cfg(),
+                           net=settings.net if manager.jobs.busy('ntp') else manager.get_net_cfg(),
                            header=settings.header)
 
 
@@ -264,7 +356,7 @@ def conf():
         msg = None
 
         if action == 'reset':
-            if not settings.reset():
+            if not manager.reset_settings():
                 flash_message(u"%s" % "Ошибка, сброс к заводским настройкам не выполнен!", 'warning')
             else:
                 flash_message(u"%s" % "Выполнен сброс к заводским настройкам!")
@@ -283,106 +375,56 @@ def conf():
     return render_template('conf.html', config=config, header=settings.header)
 
 
-def time_worker() -> None:
+def time_job() -> None:
     """
-    Программный поток, посылает запросы к службе времени, получает данные о
+    Задание планировщика, посылает запросы к службе времени, получает данные о
     текущих источниках синхронизации времени, секундной метки, текущей дате и времени,
     выполняет отправку полученных данных на веб страницу
 
     :return: None
     """
-    while True:
-        dt = {
-            'time': 'Нет данных',
-            'date': 'Нет данных',
-            'synctime': 'Нет данных',
-            'syncpps': 'Нет данных',
-            'peers': {}
-        }
-        # get peers from ntp service
-        peers = ntp_peers()
-        # print(peers)
-        if peers:
-            for refid in peers:
-                if peers[refid]['status_id'] == '*':
-
-                    peers[refid]['status'] = 'источник времени'
-                    dt['synctime'] = peers[refid]['name'].split()[0]
-
-                    if refid == '.GPPS.':
-                        if peers['.NMEA.']['status_id'] != 'x':
-                            peers['.NMEA.']['status'] = 'источник времени'
-                            dt['synctime'] = 'ГНСС'
-                        elif peers['.LCL.']['status_id'] != 'x':
-                            peers['.LCL.']['status'] = 'источник времени'
-                            dt['synctime'] = 'Внутренний'
-                        peers['.GPPS.']['status'] = 'источник секундной метки'
-                        dt['syncpps'] = 'ГНСС'
-
-                    if refid == '.LPPS.':
-                        if peers['.LCL.']['status_id'] != 'x':
-                            peers['.LCL.']['status'] = 'источник времени'
-                            dt['synctime'] = 'Внутренний'
-                        elif peers['.NMEA.']['status_id'] != 'x':
-                            peers['.NMEA.']['status'] = 'источник времени'
-                            dt['synctime'] = 'ГНСС'
-                        peers['.LPPS.']['status'] = 'источник секундной метки'
-                        dt['syncpps'] = 'Внутренний'
-
-                elif peers[refid]['status_id'] == 'o':
-                    if dt['syncpps'] == 'Нет данных':
-                        dt['syncpps'] = peers[refid]['name'].split()[0]
-
-        # save sources of time and pps
-        time_src, pps_src = TIME_SRC_NONE, PPS_SRC_NONE
-        if dt['synctime'] == 'ГНСС':
-            time_src = TIME_SRC_GNSS
-        elif dt['synctime'] == 'Внутренний':
-            time_src = TIME_SRC_INTERNAL
-
-        if dt['syncpps'] == 'ГНСС':
-            pps_src = PPS_SRC_GNSS
-        elif dt['syncpps'] == 'Внутренний':
-            pps_src = PPS_SRC_INTERNAL
-
-        settings.time_src = time_src
-        settings.pps_src = pps_src
-
-        # get local time
-        local_struct = localtime()
-        date_str = strftime("%d.%m.%Y", local_struct)
-        time_str = strftime('%T', local_struct)
-
-        # save data for emitting
-        dt['peers'] = peers
-        if date_str and time_str:
-            dt['date'] = date_str
-            dt['time'] = time_str
-
-        # print(date_str, time_str)
-        # print(settings.gpsd_data.get('date'), settings.gpsd_data.get('time'))
-        # print(dt, '\n')
-        socketio_app.emit('datetime_event', dt, namespace='/time')
-        socketio_app.sleep(0.25)
+    # источники синхронизации: в раздельном режиме - из состояния процесса УПШ
+    dt = dict(manager.time_sources(), time='Нет данных', date='Нет данных')
+
+    # get local time
+    local_struct = localtime()
+    date_str = strftime("%d.%m.%Y", local_struct)
+    time_str = strftime('%T', local_struct)
+
+    # save data for emitting
+    if date_str and time_str:
+        dt['date'] = date_str
+        dt['time'] = time_str
+
+    # print(date_str, time_str)
+    # print(settings.gpsd_data.get('date'), settings.gpsd_data.get('time'))
+    # print(dt, '\n')
+    demand.wakeup('time')
+    watched = demand.watched('/time')
+    if watched:
+        emitter.publish('datetime_event', dt, '/time')
+    # без подписчиков обновляются только источники синхронизации для УПШ и LCD
+    manager.scheduler.set_interval('time', 0.25 if watched else 2.0)
 
 
 @socketio_app.on('connect', namespace='/time')
 def time_connect() -> None:
     """
     Callback функция, вызывается при получении запроса от веб страницы и
-    запускает программный поток 'time_worker'
+    запускает задание 'time'
 
     :return: None
     """
-    global thread_time
-    if thread_time is None:
-        thread_time = socketio_app.start_background_task(time_worker)
+    start_jobs()
     emit('my_response', {'data': 'Connected', 'count': 0})
+    # задание передаст текущие данные сразу после подключения
+    demand.join('/time', request.sid)
+    manager.scheduler.wake('time')
 
 
 @socketio_app.on('disconnect', namespace='/time')
 def time_disconnect() -> None:
-    pass
+    demand.leave('/time', request.sid)
 
 
 # gps_default = dict(time='-',
@@ -406,150 +448,105 @@ def time_disconnect() -> None:
 #     settings.gpsd_data = settings.gps_default.copy()
 
 
-def control_worker() -> None:
-    saved_value = None
-    while True:
-        new_value = settings.gpsd_data.get('time')
-        if new_value != '-' and new_value == saved_value:
-            settings.reset_gpsd_data()
-            socketio_app.emit('my_response', settings.gpsd_data, namespace='/gps')
-        saved_value = new_value
-        sleep(3)
+def control_job() -> None:
+    """
+    Задание планировщика, сбрасывает данные ГНСС, если время от gpsd не
+    обновлялось с предыдущего запуска
+
+    :return: None
+    """
+    global saved_gps_time
+    new_value = settings.gpsd_data.get('time')
+    saved_value, saved_at = saved_gps_time
+    now = monotonic()
+    # внеочередной запуск раньше периода не считается пропуском обновления
+    if new_value != '-' and new_value == saved_value and now - saved_at >= gps_timeout:
+        settings.reset_gpsd_data()
+        emitter.publish('my_response', settings.gpsd_data, '/gps')
+    saved_gps_time = (new_value, now)
+
+
+def start_jobs() -> None:
+    """
+    Ставит задания веб сервера в планировщик, если они еще не запущены
+
+    :return: None
+    """
+    if 'time' not in manager.scheduler.jobs:
+        # ntp_peers() выполняет блокирующий обмен со службой ntp
+        manager.scheduler.every('time', 0.25, time_job, offload=True)
+    if 'control' not in manager.scheduler.jobs:
+        manager.scheduler.every('control', gps_timeout, control_job, delay=gps_timeout)
+
+
+gps_classes = frozenset(('TPV', 'SKY', 'DEVICE'))
+gps_idle_classes = frozenset(('TPV', 'DEVICE'))
 
 
 def gps_worker() -> None:
     """
-    Программный поток, посылает запросы к службе gpsd, получает данные
-    ГНСС приемника, а также информацию об используемых спутниках,
-    выполняет отправку полученных данных на веб страницу
+    Программный поток, получает от службы gpsd данные ГНСС приемника,
+    а также информацию об используемых спутниках, выполняет отправку
+    полученных данных на веб страницу
 
     :return: None
     """
-    connection = None
-    # gps_dict = settings.gpsd_data = {}
-
-    # gps_default = dict(time='-',
-    #                    date='-',
-    #                    latitude='-',
-    #                    longitude='-',
-    #                    speed='-',
-    #                    altitude='-',
-    #                    mode=-1,
-    #                    status=-1,
-    #                    sats_change=True,
-    #                    sat_list=[],
-    #                    sats='-',
-    #                    sats_valid='-',
-    #                    dt=''
-    #                    )
+    client = GpsdClient(sleep=socketio_app.sleep)
+    fix = fix_data({})
+    was_watched = True
 
     manager.logger.error('Подключение к службе GPSD...')
 
-    while True:
-        try:
-            if connection is None:
-                try:
-                    connection = gps(mode=WATCH_ENABLE)
-                except ConnectionRefusedError:
-                    manager.logger.error('Ожидание сообщений от службы GPSD...')
-                    settings.reset_gpsd_data()
-                    socketio_app.emit('my_response', settings.gpsd_data, namespace='/gps')
-                    systemctl(action='restart', service='gpsd.socket')
-                    socketio_app.sleep(5)
-                    continue
-
-            for dataset in connection:
-                gps_fix = vars(connection.fix).copy()
-                # print(gps_fix)
-                # gps_dict = gps_default.copy()
-
-                # gps data
-                mode = gps_fix['mode']
-                if str(mode) == 'nan':
-                    mode = -1
-                settings.gpsd_data['mode'] = mode
-
-                status = gps_fix['status']
-                if str(status) == 'nan':
-                    status = 0
-                if mode < 3:
-                    status = 0
-
-                settings.gpsd_data['status'] = status
-                # print(status, mode)
-
-                # при первой успешной синхронизации со спутником - разрешить
-                # раздачу времени по сети
-                if manager.gnss_synced is False and status > 0:
-                    manager.gnss_synced = True
-                    for lan in ('lan1', 'lan2'):
-                        add_listen_ntp(lan,
-                                       listen=settings.net[lan]['listen'],
-                                       ip=settings.net[lan]['ip'],
-                                       sync_src=settings.main['sync_src'],
-                                       gnss_synced=True)
-
-                if not status:
-                    for idx in ('date', 'time', 'latitude', 'longitude', 'speed', 'altitude'):
-                        settings.gpsd_data[idx] = '-'
-                else:
-                    # date and time
-                    t = gps_fix['time']
-                    if isinstance(t, str):
-                        utc_struct = strptime(t, '%Y-%m-%dT%X.%fZ')
-                        local_struct = localtime(timegm(utc_struct))
-                        settings.gpsd_data['dt'] = local_struct
-                        settings.gpsd_data['time'] = strftime('%T', local_struct)
-                        settings.gpsd_data['date'] = strftime('%d.%m.%y', local_struct)
-                    else:
-                        settings.gpsd_data['date'] = '-'
-                        settings.gpsd_data['time'] = '-'
-
-                    for idx in ['latitude', 'longitude', 'speed', 'altitude']:
-                        value = gps_fix[idx]
-                        if settings.gpsd_data['mode'] == 3 and str(value) != 'nan':
-
-                            if idx in ('latitude', 'longitude'):
-                                minute = value % 1 * 60
-                                sec = minute % 1 * 60
-                                deg = "%d° %d' %d\"" % (int(value), int(minute), int(sec))
-                                if idx == 'latitude':
-                                    settings.gpsd_data[idx] = deg + ' N'
-                                else:
-                                    settings.gpsd_data[idx] = deg + ' E'
-                            else:
-                                settings.gpsd_data[idx] = int(value)
-
-                        else:
-                            settings.gpsd_data[idx] = '-'
-
-                # satellites data
-                sat_list = []
-                settings.gpsd_data['sat_list'] = []
-                settings.gpsd_data['sats_change'] = False
-                if "satellites" in connection.data:
-                    for sat in connection.data['satellites']:
-                        sat_list.append(dict(sat))
-                    settings.gpsd_data['sat_list'] = sat_list
-                    settings.gpsd_data['sats'] = len(sat_list)
-                    settings.gpsd_data['sats_valid'] = connection.satellites_used
-                    settings.gpsd_data['sats_change'] = True
-
-                # manager.logger.error(settings.gpsd_data)
-                socketio_app.emit('my_response', settings.gpsd_data, namespace='/gps')
-
-            dataset = connection.next()
-            if dataset['class'] == 'DEVICE':
-                connection.close()
-                connection = None
-
-        except StopIteration:
-            manager.logger.error('Выполняется подключение к службе GPSD..')
-            connection = None
-            # TODO: when gpsd is off - show time&date on stat.html
+    for report in client.reports():
+        report_class = report['class']
+        demand.wakeup('gps')
+        # без подписчиков отчеты SKY не декодируются, обрабатывается только
+        # решение, нужное УПШ и LCD
+        watched = demand.watched('/gps')
+        client.classes = gps_classes if watched else gps_idle_classes
+        if was_watched and not watched:
+            # без отчетов SKY таблица и число спутников устаревают: таблица
+            # очищается, подключившаяся страница получит пустой ключевой кадр,
+            # первый отчет SKY передаст спутники изменением
+            sat_table.update([])
+            settings.store.update('gpsd_data', dict(sats='-', sats_valid='-', sats_change=True))
+        was_watched = watched
+
+        if report_class == 'DISCONNECTED':
+            manager.logger.error('Ожидание сообщений от службы GPSD...')
+            fix = fix_data({})
             settings.reset_gpsd_data()
-            socketio_app.emit('my_response', settings.gpsd_data, namespace='/gps')
-            socketio_app.sleep(5)
+            emitter.publish('my_response', settings.gpsd_data, '/gps')
+            emitter.send('sat_table', sat_table.update([]), '/gps')
+            if client.backoff.attempts == 0:
+                restarter.request('gpsd.socket')
+            continue
+
+        if report_class == 'DEVICE':
+            # приемник подключен или отключен от gpsd, соединение сохраняется
+            manager.logger.error('GPSD: устройство %s %s', report.get('path'),
+                                 'отключено' if report.get('activated') == 0 else 'подключено')
+            continue
+
+        if report_class == 'TPV':
+            fix = fix_data(report)
+            manager.on_fix(fix)
+
+        gpsd_data = dict(fix, sats_change=False)
+
+        # satellites data: передаются только изменения таблицы спутников
+        if report_class == 'SKY' and 'satellites' in report:
+            sat_list = report['satellites']
+            gpsd_data['sats'] = len(sat_list)
+            gpsd_data['sats_valid'] = sum(1 for sat in sat_list if sat.get('used'))
+            gpsd_data['sats_change'] = True
+            # изменения таблицы не объединяются: каждое должно быть доставлено
+            data = emitter.send('sat_table', sat_table.update(sat_list), '/gps')
+            sat_table.account(len(json.dumps(sat_list)), len(data))
+
+        settings.store.update('gpsd_data', gpsd_data)
+        if watched:
+            emitter.publish('my_response', settings.gpsd_data, '/gps')
 
 
 @socketio_app.on('connect', namespace='/gps')
@@ -565,16 +562,51 @@ def gps_connect() -> None:
     global thread_gps
     if thread_gps is None:
         thread_gps = socketio_app.start_background_task(gps_worker)
+    start_jobs()
     emit('my_response', {'data': 'Connected', 'count': 0})
+    # новый клиент получает таблицу спутников целиком, далее - изменения
+    emit('sat_table', sat_table.keyframe())
+    emit('my_response', settings.gpsd_data)
+    demand.join('/gps', request.sid)
 
 
 @socketio_app.on('disconnect', namespace='/gps')
 def gps_disconnect() -> None:
-    pass
+    demand.leave('/gps', request.sid)
+
+
+@flask_app.route("/jobs/<int:job_id>", methods=["GET"])
+@authenticated_only
+def job_state(job_id: int):
+    """
+    Возвращает состояние фонового задания
+
+    :param job_id: id задания
+    :return: словарь с состоянием задания
+    """
+    job = manager.jobs.get(job_id)
+    if job is None:
+        return jsonify({}), 404
+    return jsonify(job.as_dict())
+
+
+@socketio_app.on('connect', namespace='/jobs')
+def jobs_connect() -> None:
+    """
+    Callback функция, передает подключившейся веб странице состояние
+    незавершенных заданий
+
+    :return: None
+    """
+    for job in list(manager.jobs.jobs.values()):
+        if not job.done.is_set():
+            emit('job_event', job.as_dict())
+
+
+manager.jobs.subscribe(on_job_change)
 
 
 if __name__ == '__main__':
-    thread_time = socketio_app.start_background_task(time_worker)
+    start_jobs()
     thread_gps = socketio_app.start_background_task(gps_worker)
-    thread_control = socketio_app.start_background_task(control_worker)
     socketio_app.run(flask_app, debug=False, host='0.0.0.0', port='5001')
@@ -0,0 +1,95 @@
+from functools import wraps
+from threading import Lock
+from time import monotonic
+
+
+class TTLCache:
+    """
+    Кэш результатов запросов к системе с временем жизни записей.
+    Ключ записи - кортеж (группа, аргументы запроса), сброс выполняется по группам
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.entries = {}
+        self.loading = {}
+        self.counters = {}
+        self.generations = {}   # {группа: число сбросов}, загрузка во время сброса не сохраняется
+
+    def get(self, key: tuple, ttl: float, loader):
+        """
+        Возвращает значение из кэша или выполняет запрос. Одновременные
+        запросы одного ключа ожидают единственного выполнения загрузки
+
+        :param key: ключ записи, первый элемент - имя группы
+        :param ttl: время жизни записи в секундах
+        :param loader: функция запроса значения
+        :return: значение
+        """
+        group = key[0]
+        with self.lock:
+            counter = self.counters.setdefault(group, dict(hits=0, misses=0, invalidations=0))
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                counter['hits'] += 1
+                return entry[1]
+            counter['misses'] += 1
+            key_lock = self.loading.setdefault(key, Lock())
+
+        with key_lock:
+            # значение могло быть загружено другим потоком, пока ожидали блокировку
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] > monotonic():
+                    return entry[1]
+                generation = self.generations.get(group, 0)
+            value = loader()
+            with self.lock:
+                # при сбросе группы во время загрузки значение может быть устаревшим
+                if self.generations.get(group, 0) == generation:
+                    self.entries[key] = (monotonic() + ttl, value)
+        return value
+
+    def invalidate(self, *groups) -> None:
+        """
+        Удаляет из кэша все записи указанных групп
+
+        :param groups: имена групп
+        :return: None
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] in groups]:
+                del self.entries[key]
+            for group in groups:
+                self.generations[group] = self.generations.get(group, 0) + 1
+                if group in self.counters:
+                    self.counters[group]['invalidations'] += 1
+
+    def cached(self, group: str, ttl: float):
+        """
+        Декоратор, кэширует результат функции по ее аргументам
+
+        :param group: имя группы записей
+        :param ttl: время жизни записи в секундах
+        :return: декоратор
+        """
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                key = (group, args, tuple(sorted(kwargs.items())))
+                return self.get(key, ttl, lambda: func(*args, **kwargs))
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> dict:
+        """
+        Счетчики попаданий и промахов по группам
+
+        :return: словарь {группа: счетчики}
+        """
+        with self.lock:
+            return {group: dict(counter, size=sum(1 for key in self.entries if key[0] == group))
+                    for group, counter in self.counters.items()}
@@ -0,0 +1,136 @@
+import logging
+from threading import Lock
+from time import monotonic, process_time
+
+
+class Demand:
+    """
+    Учет подключенных веб страниц по пространствам имен socket.io. Фоновые
+    задания без подписчиков работают с пониженной частотой и поддерживают
+    только данные, нужные УПШ и LCD. Немедленный запуск задания при
+    подключении страницы выполняет планировщик (Scheduler.wake)
+    """
+
+    def __init__(self, window: float = 60.0) -> None:
+        """
+        Инициализация
+
+        :param window: интервал подсчета пробуждений и загрузки процессора, с
+        """
+        self.logger = logging.getLogger(__name__)
+        self.window = window
+        self.lock = Lock()
+        self.clients = {}       # {namespace: множество sid}
+        self.wakeups = {}       # {поток: число пробуждений за интервал}
+        self.joins = 0
+        self.window_start = monotonic()
+        self.window_cpu = process_time()
+        self.window_idle = True         # за интервал не было подписчиков
+        self.rates = dict(wakeups_per_s={}, cpu_percent=0.0, idle=True)
+
+    def join(self, namespace: str, sid: str) -> bool:
+        """
+        Регистрирует подключение страницы
+
+        :param namespace: пространство имен
+        :param sid: id клиента socket.io
+        :return: True - первый подписчик пространства имен
+        """
+        with self.lock:
+            clients = self.clients.setdefault(namespace, set())
+            first = not clients
+            clients.add(sid)
+            self.joins += 1
+            self.window_idle = False
+        if first:
+            self.logger.error('%s: есть подписчики, полная частота обновления', namespace)
+        return first
+
+    def leave(self, namespace: str, sid: str) -> None:
+        """
+        Регистрирует отключение страницы
+
+        :param namespace: пространство имен
+        :param sid: id клиента socket.io
+        :return: None
+        """
+        with self.lock:
+            clients = self.clients.get(namespace, set())
+            if sid not in clients:
+                return
+            clients.discard(sid)
+            last = not clients
+        if last:
+            self.logger.error('%s: нет подписчиков, пониженная частота обновления', namespace)
+
+    def watched(self, namespace: str) -> bool:
+        """
+        :param namespace: пространство имен
+        :return: True - есть подключенные страницы
+        """
+        return bool(self.clients.get(namespace))
+
+    def wakeup(self, name: str) -> None:
+        """
+        Учитывает пробуждение потока, раз в интервал вычисляет частоту
+        пробуждений и загрузку процессора
+
+        :param name: имя потока
+        :return: None
+        """
+        with self.lock:
+            self.wakeups[name] = self.wakeups.get(name, 0) + 1
+            now = monotonic()
+            elapsed = now - self.window_start
+            if elapsed < self.window:
+                return
+            cpu = process_time()
+            idle = self.window_idle and not any(self.clients.values())
+            self.rates = dict(wakeups_per_s={key: round(value / elapsed, 2) for key, value in self.wakeups.items()},
+                              cpu_percent=round((cpu - self.window_cpu) * 100 / elapsed, 2),
+                              idle=idle)
+            self.window_start, self.window_cpu = now, cpu
+            self.window_idle = not any(self.clients.values())
+            self.wakeups = {}
+        if idle:
+            self.logger.debug('Без подписчиков: %.2f%% процессора, пробуждений в секунду: %s',
+                              self.rates['cpu_percent'], self.rates['wakeups_per_s'])
+
+    def stats(self) -> dict:
+        """
+        :return: число подписчиков по пространствам имен, пробуждения потоков
+        и загрузка процессора за последний интервал
+        """
+        with self.lock:
+            return dict(self.rates,
+                        subscribers={namespace: len(clients) for namespace, clients in self.clients.items()},
+                        joins=self.joins)
+
+
+if __name__ == "__main__":
+    from threading import Thread
+    from time import sleep
+
+    demand = Demand(window=2.0)
+
+    # задание с периодом 0.05 с при подписчиках и 1 с без них
+    def worker():
+        while True:
+            demand.wakeup('time')
+            sleep(0.05 if demand.watched('/time') else 1.0)
+
+    Thread(target=worker, daemon=True).start()
+    sleep(2.1)
+    demand.wakeup('main')
+    idle = demand.stats()
+    assert demand.join('/time', 'sid1') and not demand.join('/time', 'sid2')
+    sleep(2.0)
+    demand.wakeup('main')
+    active = demand.stats()
+    demand.leave('/time', 'sid1')
+    demand.leave('/time', 'sid2')
+    print('без подписчиков:', idle)
+    print('с подписчиком:  ', active)
+    assert idle['idle'] and idle['wakeups_per_s']['time'] <= 1.5
+    assert not active['idle'] and active['wakeups_per_s']['time'] > 10
+    assert not demand.watched('/time')
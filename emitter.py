@@ -0,0 +1,200 @@
+import json
+import logging
+from threading import Lock
+from time import monotonic, sleep
+
+
+def serialize(payload) -> str:
+    """
+    Сериализация сообщения для веб страницы: JSON без пробелов
+
+    :param payload: сообщение
+    :return: текст JSON
+    """
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class Emitter:
+    """
+    Передача потоков сообщений веб страницам с ограничением частоты по
+    пространствам имен socket.io. Сообщение сериализуется один раз для
+    сравнения с переданным: неизмененные сообщения не передаются, из
+    сообщений, поступивших чаще допустимого, передается последнее.
+    Страницам передается само сообщение, как и без ограничения частоты
+    """
+
+    def __init__(self, emit, rates: dict = None, default_rate: float = 4.0, sleep=sleep, start=None) -> None:
+        """
+        Инициализация
+
+        :param emit: функция рассылки emit(event, data, namespace=...)
+        :param rates: максимальная частота сообщений по пространствам имен {namespace: Гц}
+        :param default_rate: максимальная частота для остальных пространств имен, Гц
+        :param sleep: функция задержки потока передачи отложенных сообщений
+        :param start: функция запуска потока start(target), по умолчанию - threading
+        """
+        self.logger = logging.getLogger(__name__)
+        self.emit = emit
+        self.rates = dict(rates or {})
+        self.default_rate = default_rate
+        self.sleep = sleep
+        self.lock = Lock()
+        self.last = {}          # {(namespace, event): (текст, сообщение) переданного}
+        self.sent = {}          # {(namespace, event): время передачи}
+        self.pending = {}       # {(namespace, event): (текст, сообщение) отложенного}
+        self.counters = {}      # {namespace: {'published', 'emitted', 'coalesced', 'suppressed'}}
+        if start is None:
+            from threading import Thread
+            Thread(name='Thread emitter', target=self.flusher, daemon=True).start()
+        else:
+            start(self.flusher)
+
+    def interval(self, namespace: str) -> float:
+        """
+        :param namespace: пространство имен
+        :return: минимальный интервал между сообщениями одного события, с
+        """
+        return 1 / self.rates.get(namespace, self.default_rate)
+
+    def count(self, namespace: str, name: str) -> None:
+        counters = self.counters.get(namespace)
+        if counters is None:
+            counters = self.counters[namespace] = dict(published=0, emitted=0, coalesced=0, suppressed=0)
+        counters[name] += 1
+
+    def publish(self, event: str, payload, namespace: str) -> None:
+        """
+        Передает текущее значение потока: неизмененное значение не передается,
+        при превышении частоты значение откладывается и заменяется следующим
+
+        :param event: событие
+        :param payload: сообщение
+        :param namespace: пространство имен
+        :return: None
+        """
+        data = serialize(payload)
+        key = (namespace, event)
+        now = monotonic()
+        with self.lock:
+            self.count(namespace, 'published')
+            if key in self.pending:
+                if self.pending[key][0] == data:
+                    self.count(namespace, 'suppressed')
+                else:
+                    self.pending[key] = (data, payload)
+                    self.count(namespace, 'coalesced')
+                return
+            if key in self.last and self.last[key][0] == data:
+                self.count(namespace, 'suppressed')
+                return
+            if now - self.sent.get(key, -1e9) < self.interval(namespace):
+                self.pending[key] = (data, payload)
+                return
+            self.last[key] = (data, payload)
+            self.sent[key] = now
+            self.count(namespace, 'emitted')
+        self.emit(event, payload, namespace=namespace)
+
+    def send(self, event: str, payload, namespace: str) -> str:
+        """
+        Передает сообщение сразу, без объединения и ограничения частоты,
+        например изменения таблицы, каждое из которых должно быть доставлено
+
+        :param event: событие
+        :param payload: сообщение
+        :param namespace: пространство имен
+        :return: текст JSON сообщения (для учета объема)
+        """
+        data = serialize(payload)
+        with self.lock:
+            self.count(namespace, 'published')
+            self.count(namespace, 'emitted')
+        self.emit(event, payload, namespace=namespace)
+        return data
+
+    def current(self, namespace: str) -> list:
+        """
+        Последние значения потоков пространства имен, для подключившегося клиента
+
+        :param namespace: пространство имен
+        :return: лист (событие, сообщение)
+        """
+        with self.lock:
+            return [(event, self.pending.get((ns, event), item)[1])
+                    for (ns, event), item in self.last.items() if ns == namespace]
+
+    def flush(self) -> float:
+        """
+        Передает отложенные сообщения, интервал которых истек
+
+        :return: время до следующего отложенного сообщения, с; None - нет отложенных
+        """
+        now = monotonic()
+        ready, wait = [], None
+        with self.lock:
+            for key, item in list(self.pending.items()):
+                namespace, event = key
+                remain = self.sent.get(key, -1e9) + self.interval(namespace) - now
+                if remain > 0:
+                    wait = remain if wait is None else min(wait, remain)
+                    continue
+                del self.pending[key]
+                if key in self.last and self.last[key][0] == item[0]:
+                    self.count(namespace, 'suppressed')
+                    continue
+                self.last[key] = item
+                self.sent[key] = now
+                self.count(namespace, 'emitted')
+                ready.append((event, item[1], namespace))
+        for event, payload, namespace in ready:
+            try:
+                self.emit(event, payload, namespace=namespace)
+            except Exception as err:
+                self.logger.error('Ошибка передачи %s %s: %s', namespace, event, err)
+        return wait
+
+    def flusher(self) -> None:
+        """
+        Поток передачи отложенных сообщений
+
+        :return: None
+        """
+        tick = min([1 / rate for rate in self.rates.values()] + [1 / self.default_rate]) / 2
+        while True:
+            wait = self.flush()
+            self.sleep(tick if wait is None else min(wait, tick))
+
+    def stats(self) -> dict:
+        """
+        :return: счетчики по пространствам имен
+        """
+        with self.lock:
+            return {namespace: dict(counters) for namespace, counters in self.counters.items()}
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+
+    # приемник 10 Гц, время 4 раза в секунду, 3 вкладки: частота ограничена 2 Гц и 1 Гц
+    sent = []
+
+    def emit(event, data, namespace=None):
+        for tab in range(3):
+            sent.append((namespace, event, len(serialize(data))))
+
+    emitter = Emitter(emit, rates={'/gps': 2.0, '/time': 1.0})
+    start = perf_counter()
+    for n in range(40):
+        fix = dict(time='12:00:%02d' % (n // 10), latitude='55.75%02d' % n, sats=12 + n // 20)
+        emitter.publish('my_response', fix, '/gps')
+        if n % 2 == 0:
+            emitter.publish('datetime_event', dict(time='12:00:%02d' % (n // 10)), '/time')
+        sleep(0.1)
+    sleep(1.1)
+    elapsed = perf_counter() - start
+    stats = emitter.stats()
+    print('%.1f с, сообщений клиентам: %d' % (elapsed, len(sent)), stats)
+    assert stats['/gps']['emitted'] <= elapsed * 2 + 1, stats
+    # последнее значение доставлено после окончания потока
+    assert dict(emitter.current('/gps'))['my_response'] == fix
+    assert emitter.pending == {}
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import shlex
+import signal
+import subprocess
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+from time import perf_counter
+
+# границы интервалов гистограммы времени выполнения, мс
+histogram_bounds = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """
+    Гистограмма времени выполнения команды
+    """
+
+    def __init__(self, bounds: tuple = histogram_bounds) -> None:
+        """
+        :param bounds: границы интервалов гистограммы, мс
+        """
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+
+    def add(self, ms: float) -> None:
+        """
+        Добавляет замер в гистограмму
+
+        :param ms: время выполнения в мс
+        :return: None
+        """
+        self.buckets[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def as_dict(self) -> dict:
+        """
+        :return: словарь с параметрами гистограммы
+        """
+        labels = ['<=%g' % bound for bound in self.bounds] + ['>%g' % self.bounds[-1]]
+        return dict(count=self.count,
+                    avg_ms=round(self.total / self.count, 3) if self.count else 0,
+                    max_ms=round(self.max, 3),
+                    timeouts=self.timeouts,
+                    histogram={label: n for label, n in zip(labels, self.buckets) if n})
+
+
+def command_key(command) -> str:
+    """
+    Имя команды для статистики: первые два слова команды
+
+    :param command: текст команды или лист аргументов
+    :return: имя команды
+    """
+    if isinstance(command, str):
+        command = command.split(maxsplit=2)
+    return ' '.join(command[:2])
+
+
+class CommandExecutor:
+    """
+    Пул выполнения системных команд с таймаутами и статистикой времени выполнения
+    """
+
+    def __init__(self, workers: int = 4, timeout: float = 30.0) -> None:
+        """
+        Инициализация пула
+
+        :param workers: максимальное число одновременно выполняемых команд
+        :param timeout: таймаут команды по умолчанию в секундах
+        """
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Thread cmd')
+        self.timeout = timeout
+        self.lock = Lock()
+        self.histograms = {}
+
+    def submit(self, command, timeout: float = None) -> Future:
+        """
+        Ставит команду в очередь на выполнение
+
+        :param command: текст команды (выполняется в shell) или лист аргументов (без shell)
+        :param timeout: таймаут в секундах, None - таймаут по умолчанию
+        :return: Future с выводом команды
+        """
+        return self.pool.submit(self.execute, command, self.timeout if timeout is None else timeout)
+
+    def run(self, command, timeout: float = None) -> str:
+        """
+        Выполняет команду и ожидает результат
+
+        :param command: текст команды или лист аргументов
+        :param timeout: таймаут в секундах
+        :return: вывод команды
+        """
+        return self.submit(command, timeout).result()
+
+    async def run_async(self, command, timeout: float = None) -> str:
+        """
+        Выполняет команду без блокировки цикла asyncio
+
+        :param command: текст команды или лист аргументов
+        :param timeout: таймаут в секундах
+        :return: вывод команды
+        """
+        return await asyncio.wrap_future(self.submit(command, timeout))
+
+    def execute(self, command, timeout: float) -> str:
+        """
+        Выполняет команду в текущем потоке, при превышении таймаута
+        завершает всю группу процессов команды
+
+        :param command: текст команды или лист аргументов
+        :param timeout: таймаут в секундах
+        :return: вывод команды (stdout и stderr)
+        """
+        start = perf_counter()
+        timed_out = False
+        try:
+            process = subprocess.Popen(command,
+                                       shell=isinstance(command, str),
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT,
+                                       start_new_session=True, )
+        except OSError as err:
+            # исполняемый файл не найден
+            self.record(command, (perf_counter() - start) * 1000)
+            return str(err)
+        try:
+            stdout, _ = process.communicate(timeout=timeout)
+            output = stdout.decode('utf-8')
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process.communicate()
+            output = 'Превышено время ожидания (%s с) команды: %s' % (
+                timeout, command if isinstance(command, str) else shlex.join(command))
+        finally:
+            self.record(command, (perf_counter() - start) * 1000, timed_out)
+        return output
+
+    def record(self, command, ms: float, timed_out: bool = False) -> None:
+        """
+        Сохраняет время выполнения команды
+
+        :return: None
+        """
+        key = command_key(command)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(ms)
+            histogram.timeouts += timed_out
+
+    def stats(self) -> dict:
+        """
+        Статистика выполнения команд, отсортированная по суммарному времени
+
+        :return: словарь {имя команды: параметры гистограммы}
+        """
+        with self.lock:
+            ordered = sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True)
+            return {key: histogram.as_dict() for key, histogram in ordered}
+
+
+if __name__ == "__main__":
+    executor = CommandExecutor()
+    print(executor.run(['echo', 'argv']), executor.run('echo shell | tr a-z A-Z'))
+    print(executor.run(['sleep', '5'], timeout=0.2))
+    futures = [executor.submit(['sleep', '0.1']) for _ in range(8)]
+    print(asyncio.run(executor.run_async('true')) == '', [f.result() for f in futures])
+    print(executor.stats())
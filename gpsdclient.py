@@ -0,0 +1,253 @@
+import json
+import logging
+import socket
+from time import sleep
+from transport import Backoff
+
+GPSD_HOST = '127.0.0.1'
+GPSD_PORT = 2947
+WATCH = b'?WATCH={"enable":true,"json":true}\n'
+
+
+class GpsdClient:
+    """
+    Клиент службы gpsd: постоянное соединение, разбор JSON отчетов по строкам
+    из повторно используемого буфера, переподключение с нарастающей задержкой
+    """
+
+    def __init__(self, host: str = GPSD_HOST, port: int = GPSD_PORT, bufsize: int = 65536,
+                 classes: tuple = ('TPV', 'SKY', 'DEVICE'), sleep=sleep) -> None:
+        """
+        Инициализация
+
+        :param host: адрес gpsd
+        :param port: порт gpsd
+        :param bufsize: начальный размер буфера приема
+        :param classes: классы передаваемых отчетов, может изменяться при работе
+        (отчеты остальных классов не декодируются)
+        :param sleep: функция задержки переподключения
+        """
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.classes = frozenset(classes)
+        self.buffer = bytearray(bufsize)
+        self.view = memoryview(self.buffer)
+        self.start = self.end = 0       # необработанные данные буфера
+        self.sock = None
+        self.backoff = Backoff(initial=0.5, maximum=10.0, sleep=sleep)
+        self.counters = dict(reports=0, skipped=0, errors=0, connects=0)
+
+    def connect(self) -> None:
+        """
+        Подключается к gpsd и включает передачу отчетов JSON
+
+        :return: None
+        """
+        self.close()
+        self.sock = socket.create_connection((self.host, self.port), timeout=10)
+        self.sock.settimeout(None)
+        self.sock.sendall(WATCH)
+        self.start = self.end = 0
+        self.counters['connects'] += 1
+
+    def close(self) -> None:
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def fill(self) -> None:
+        """
+        Принимает данные в свободную часть буфера, при необходимости
+        сдвигает необработанные данные в начало или увеличивает буфер
+
+        :return: None
+        """
+        if self.end == len(self.buffer):
+            self.view.release()
+            if self.start == 0:
+                # строка длиннее буфера
+                self.buffer.extend(bytes(len(self.buffer)))
+            else:
+                self.buffer[:self.end - self.start] = self.buffer[self.start:self.end]
+                self.end -= self.start
+                self.start = 0
+            self.view = memoryview(self.buffer)
+        received = self.sock.recv_into(self.view[self.end:])
+        if not received:
+            raise ConnectionError('gpsd закрыл соединение')
+        self.end += received
+
+    def read(self):
+        """
+        Генератор отчетов текущего соединения
+
+        :return: словари отчетов выбранных классов
+        """
+        buffer, classes, counters, loads = self.buffer, self.classes, self.counters, json.loads
+        while True:
+            self.fill()
+            if buffer is not self.buffer:
+                buffer = self.buffer
+            # набор классов может быть изменен между отчетами
+            classes = self.classes
+            start, end = self.start, self.end
+            while True:
+                newline = buffer.find(b'\n', start, end)
+                if newline < 0:
+                    break
+                line = buffer[start:newline]
+                start = newline + 1
+                # класс проверяется до разбора JSON: лишние отчеты не декодируются
+                position = line.find(b'"class":"', 0, 32)
+                if position >= 0 and line[position + 9:line.find(b'"', position + 9)].decode() not in classes:
+                    counters['skipped'] += 1
+                    continue
+                try:
+                    report = loads(line)
+                except ValueError:
+                    counters['errors'] += 1
+                    continue
+                if report.get('class') not in classes:
+                    counters['skipped'] += 1
+                    continue
+                counters['reports'] += 1
+                self.start = start
+                yield report
+            self.start = start
+            if self.start == self.end:
+                self.start = self.end = 0
+
+    def reports(self):
+        """
+        Бесконечный генератор отчетов с переподключением. При потере
+        соединения возвращает отчет {'class': 'DISCONNECTED', 'error': текст}
+
+        :return: словари отчетов
+        """
+        while True:
+            try:
+                if self.sock is None:
+                    self.connect()
+                for report in self.read():
+                    self.backoff.reset()
+                    yield report
+            except OSError as err:
+                self.close()
+                self.logger.debug('gpsd: %s', err)
+                yield dict({'class': 'DISCONNECTED'}, error=str(err))
+                self.backoff.wait()
+
+
+class FakeGpsd:
+    """
+    Имитация службы gpsd для проверок: TCP сервер, после ?WATCH передает
+    пары отчетов TPV и SKY с заданной частотой
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, rate: float = 1.0, sats: int = 32,
+                 count: int = None) -> None:
+        """
+        :param host: адрес
+        :param port: порт, 0 - любой свободный
+        :param rate: число пар отчетов в секунду, 0 - без ограничения
+        :param sats: число спутников в отчете SKY
+        :param count: число пар отчетов до закрытия соединения, None - без ограничения
+        """
+        self.rate = rate
+        self.count = count
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(4)
+        self.host, self.port = self.server.getsockname()
+        self.thread = None
+        self.satellites = [dict(PRN=n + 1, el=10 + n % 70, az=n * 11 % 360, ss=20 + n % 30,
+                                used=n % 3 != 0, gnssid=0 if n < 16 else 6) for n in range(sats)]
+        self.payloads = [self.payload(n) for n in range(60)]
+
+    def start(self) -> 'FakeGpsd':
+        from threading import Thread
+        self.thread = Thread(name='Thread fake gpsd', target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.close()
+
+    def payload(self, n: int) -> bytes:
+        tpv = {'class': 'TPV', 'device': '/dev/ttyS1', 'mode': 3,
+               'time': '2024-01-01T00:%02d:%02d.000Z' % (n // 60 % 60, n % 60),
+               'lat': 55.75 + n * 1e-6, 'lon': 37.61, 'alt': 150.0, 'speed': 0.01}
+        sky = {'class': 'SKY', 'device': '/dev/ttyS1', 'satellites': self.satellites}
+        # gpsd передает JSON без пробелов
+        return (json.dumps(tpv, separators=(',', ':')) + '\n' +
+                json.dumps(sky, separators=(',', ':')) + '\n').encode()
+
+    def serve(self) -> None:
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            try:
+                conn.sendall(b'{"class":"VERSION","release":"3.22","proto_major":3,"proto_minor":14}\n')
+                conn.recv(1024)     # ?WATCH
+                conn.sendall(b'{"class":"DEVICES","devices":[{"class":"DEVICE","path":"/dev/ttyS1"}]}\n'
+                             b'{"class":"WATCH","enable":true,"json":true}\n')
+                n = 0
+                while self.count is None or n < self.count:
+                    conn.sendall(self.payloads[n % len(self.payloads)])
+                    n += 1
+                    if self.rate:
+                        sleep(1 / self.rate)
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+
+    # проверка разбора и переподключения
+    server = FakeGpsd(rate=0, count=3).start()
+    client = GpsdClient(server.host, server.port, bufsize=256)
+    classes = []
+    for report in client.reports():
+        classes.append(report['class'])
+        if len(classes) == 14:
+            break
+    assert classes[:7] == ['TPV', 'SKY'] * 3 + ['DISCONNECTED'], classes
+    assert classes[7:13] == ['TPV', 'SKY'] * 3, classes
+    print('разбор и переподключение: OK', client.counters)
+    client.close()
+    server.stop()
+
+    # пропускная способность: клиент против чтения строк через makefile
+    count = 20000
+    for label in ('GpsdClient', 'makefile'):
+        server = FakeGpsd(rate=0, count=count).start()
+        start = perf_counter()
+        if label == 'GpsdClient':
+            client = GpsdClient(server.host, server.port)
+            client.connect()
+            n = sum(1 for _ in zip(range(count * 2), client.read()))
+            client.close()
+        else:
+            sock = socket.create_connection((server.host, server.port))
+            sock.sendall(WATCH)
+            n = 0
+            for line in sock.makefile('rb'):
+                report = json.loads(line)
+                if report.get('class') in ('TPV', 'SKY', 'DEVICE'):
+                    n += 1
+                    if n == count * 2:
+                        break
+            sock.close()
+        elapsed = perf_counter() - start
+        print('%-10s %8.0f отчетов/с' % (label, n / elapsed))
+        server.stop()
@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+from itertools import count
+from threading import Thread, Lock, local
+from manager import *
+from gpsdclient import GpsdClient
+from jobs import JobQueue
+from scheduler import Scheduler
+from shmstate import SharedState, StateUnavailable, SEGMENT_PATH
+
+SOCKET_PATH = '/run/ntp-station-hw.sock'
+# время ожидания команды в очереди заданий процесса УПШ, с: меньше времени
+# ожидания ответа клиентом, чтобы клиент получил ошибку, а не таймаут
+JOB_TIMEOUT = 50.0
+
+# команды веб сервера: изменяющие настройки выполняются в очереди заданий
+# процесса УПШ, остальные - сразу
+commands = {
+    'set_sync_source': True,
+    'set_ext_sync_source': True,
+    'save_time_settings': True,
+    'save_gnss': True,
+    'change_net_cfg': True,
+    'save_time': True,
+    'set_devname': True,
+    'set_lifetime': True,
+    'reset_settings': True,
+    'get_main': False,
+    'get_net_cfg': False,
+    'timing_stats': False,
+}
+
+# разделы настроек, которые веб сервер получает из процесса УПШ. Данные ГНСС
+# для страниц веб сервер получает от gpsd сам, вместе с таблицей спутников
+mirrored_sections = ('main', 'net', 'config', 'header', 'pps_info')
+
+
+class CommandError(Exception):
+    """
+    Ошибка выполнения команды процессом УПШ
+    """
+    pass
+
+
+def split_mode() -> bool:
+    """
+    Режим работы веб сервера. Переменная окружения HW_DAEMON имеет
+    приоритет над параметром hw_daemon файла настроек
+
+    :return: true - обмен с УПШ выполняет отдельный процесс hwdaemon
+    """
+    value = os.environ.get('HW_DAEMON') or read_ini_file().get('hw_daemon') or '0'
+    return value not in ('0', 'no', 'false')
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Соединение веб сервера: строка JSON {"method", "args"} на команду,
+    ответ - строка JSON {"result"} или {"error"}
+    """
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = dict(result=self.server.hw.call(request['method'], request.get('args', [])))
+            except Exception as err:
+                response = dict(error=str(err))
+            self.wfile.write(json.dumps(response, ensure_ascii=False, default=str).encode() + b'\n')
+
+
+class CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class HwDaemon:
+    """
+    Процесс обмена с УПШ: потоки USB, передача времени, LCD, отчеты TPV
+    службы gpsd. Состояние публикуется в сегмент разделяемой памяти, команды
+    веб сервера принимаются через локальный сокет
+    """
+
+    def __init__(self, logger: logging.Logger, args: list,
+                 socket_path: str = SOCKET_PATH, segment_path: str = SEGMENT_PATH) -> None:
+        """
+        Инициализация и запуск
+
+        :param logger: логгер
+        :param args: аргументы командной строки
+        :param socket_path: путь сокета команд
+        :param segment_path: файл сегмента состояния
+        """
+        self.logger = logger
+        self.manager = Manager(logger=logger, args=args)
+        self.lock = Lock()
+        self.state = SharedState(segment_path, writer=True)
+        self.sources = {}
+        self.ids = count(1)
+        self.saved_time = None
+        settings.store.subscribe(self.on_change)
+        self.publish()
+
+        scheduler = self.manager.scheduler
+        scheduler.every('sources', 1.0, self.update_sources, offload=True)
+        scheduler.every('control', 3, self.check_fix, delay=3)
+        Thread(name='Thread gnss', target=self.gnss_worker, daemon=True).start()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.server = CommandServer(socket_path, CommandHandler)
+        os.chmod(socket_path, 0o600)
+        self.server.hw = self
+
+    def publish(self) -> None:
+        """
+        Записывает состояние в сегмент разделяемой памяти
+
+        :return: None
+        """
+        with self.lock:
+            version, sections = settings.store.snapshot()
+            self.state.publish(dict(sections,
+                                    version=version,
+                                    sources=self.sources,
+                                    time_src=settings.time_src,
+                                    pps_src=settings.pps_src,
+                                    usb=usb.device is not None))
+
+    def on_change(self, section: str, old, new, version: int) -> None:
+        self.publish()
+
+    def update_sources(self) -> None:
+        """
+        Задание планировщика: источники синхронизации для структуры статуса УПШ
+
+        :return: None
+        """
+        sources = self.manager.time_sources()
+        if sources != self.sources:
+            self.sources = sources
+            self.publish()
+
+    def check_fix(self) -> None:
+        """
+        Задание планировщика: сбрасывает данные ГНСС, если время от gpsd не
+        обновлялось с предыдущего запуска
+
+        :return: None
+        """
+        new_value = settings.gpsd_data.get('time')
+        if new_value != '-' and new_value == self.saved_time:
+            settings.reset_gpsd_data()
+        self.saved_time = new_value
+
+    def gnss_worker(self) -> None:
+        """
+        Поток, получает от gpsd отчеты TPV для структуры статуса УПШ и LCD
+
+        :return: None
+        """
+        client = GpsdClient(classes=('TPV', 'DEVICE'))
+        for report in client.reports():
+            if report['class'] == 'DISCONNECTED':
+                settings.reset_gpsd_data()
+            elif report['class'] == 'TPV':
+                fix = fix_data(report)
+                self.manager.on_fix(fix)
+                settings.store.update('gpsd_data', dict(fix, sats_change=False))
+
+    def call(self, method: str, args: list):
+        """
+        Выполняет команду веб сервера
+
+        :param method: имя метода Manager
+        :param args: аргументы
+        :return: результат метода
+        """
+        if method not in commands:
+            raise CommandError('Неизвестная команда: %s' % method)
+        func = getattr(self.manager, method)
+        if not commands[method]:
+            return func(*args)
+        # ключ уникален: повторные запросы объединяет очередь веб сервера
+        job = self.manager.submit(('web', method, next(self.ids)), func, *args)
+        result = job.wait(JOB_TIMEOUT)
+        if not job.done.is_set():
+            raise CommandError('Команда %s не выполнена за %d с, задание %d продолжает выполняться'
+                               % (method, JOB_TIMEOUT, job.id))
+        if job.error is not None:
+            raise CommandError(job.error)
+        return result
+
+    def serve_forever(self) -> None:
+        self.logger.error('Процесс УПШ: команды принимаются через %s', self.server.server_address)
+        self.server.serve_forever()
+
+
+class CommandClient:
+    """
+    Клиент команд процесса УПШ: у каждого потока веб сервера свое постоянное
+    соединение, чтобы долгая команда не задерживала остальные
+    """
+
+    def __init__(self, path: str = SOCKET_PATH, timeout: float = 60.0) -> None:
+        """
+        :param path: путь сокета команд
+        :param timeout: время ожидания ответа, с
+        """
+        self.path = path
+        self.timeout = timeout
+        self.local = local()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.local.sock, self.local.file = sock, sock.makefile('rb')
+        return sock
+
+    def close(self) -> None:
+        sock = getattr(self.local, 'sock', None)
+        if sock is not None:
+            self.local.file.close()
+            sock.close()
+            self.local.sock = self.local.file = None
+
+    def call(self, method: str, *args):
+        """
+        Выполняет команду в процессе УПШ. Команда повторяется только если
+        ее не удалось передать по ранее открытому соединению (процесс УПШ
+        перезапущен). После передачи команда не повторяется: при таймауте
+        или обрыве соединения она могла быть выполнена
+
+        :param method: имя метода Manager
+        :param args: аргументы
+        :return: результат
+        """
+        request = json.dumps(dict(method=method, args=args), ensure_ascii=False).encode() + b'\n'
+        while True:
+            sock = getattr(self.local, 'sock', None)
+            reused = sock is not None
+            try:
+                if sock is None:
+                    sock = self.connect()
+                sock.sendall(request)
+                break
+            except OSError as err:
+                self.close()
+                if not reused or not isinstance(err, (BrokenPipeError, ConnectionResetError)):
+                    raise CommandError('Нет связи с процессом УПШ: %s' % err)
+        try:
+            line = self.local.file.readline()
+        except socket.timeout:
+            self.close()
+            raise CommandError('Нет ответа процесса УПШ на команду %s за %s с' % (method, self.timeout))
+        except OSError as err:
+            self.close()
+            raise CommandError('Нет связи с процессом УПШ: %s' % err)
+        if not line:
+            self.close()
+            raise CommandError('Процесс УПШ закрыл соединение, команда %s могла быть выполнена' % method)
+        response = json.loads(line)
+        if 'error' in response:
+            raise CommandError(response['error'])
+        return response['result']
+
+
+class ManagerProxy:
+    """
+    Замена Manager в веб сервере при обмене с УПШ в отдельном процессе:
+    состояние читается из сегмента разделяемой памяти, команды передаются
+    через локальный сокет, фоновые задания веб сервера выполняются локально
+    """
+    reset_webserver = False
+    gnss_synced = None          # первую синхронизацию ГНСС обрабатывает процесс УПШ
+    submit = Manager.submit
+    config_logger = Manager.config_logger
+
+    def __init__(self, logger: logging.Logger, args: list,
+                 socket_path: str = SOCKET_PATH, segment_path: str = SEGMENT_PATH) -> None:
+        """
+        :param logger: логгер
+        :param args: аргументы командной строки
+        :param socket_path: путь сокета команд
+        :param segment_path: файл сегмента состояния
+        """
+        self.logger = logger
+        for obj in (settings, restarter):
+            obj.logger = logger
+        self.config_logger(args)
+        self.client = CommandClient(socket_path)
+        self.segment_path = segment_path
+        self.state = None
+        self.synced = None
+        self.jobs = JobQueue(workers=2)
+        self.jobs.logger = logger
+        self.scheduler = Scheduler(workers=1)
+        self.scheduler.logger = logger
+
+    def __getattr__(self, name: str):
+        if name not in commands:
+            raise AttributeError(name)
+
+        def command(*args):
+            return self.client.call(name, *args)
+        command.__name__ = name
+        return command
+
+    def read(self) -> dict:
+        """
+        :return: состояние процесса УПШ
+        """
+        if self.state is None:
+            self.state = SharedState(self.segment_path)
+        return self.state.read()[1]
+
+    def sync(self) -> None:
+        """
+        Обновляет локальные разделы настроек из состояния процесса УПШ,
+        если состояние изменилось
+
+        :return: None
+        """
+        try:
+            state = self.read()
+        except StateUnavailable as err:
+            self.logger.debug(str(err))
+            return
+        if state is self.synced:
+            return
+        self.synced = state
+        for section in mirrored_sections:
+            settings.store.replace(section, state[section])
+        settings.time_src, settings.pps_src = state['time_src'], state['pps_src']
+
+    def time_sources(self) -> dict:
+        """
+        :return: источники синхронизации, определенные процессом УПШ
+        """
+        self.sync()
+        if not self.synced or not self.synced['sources']:
+            return dict(synctime='Нет данных', syncpps='Нет данных', peers={})
+        return dict(self.synced['sources'])
+
+    def on_fix(self, fix: dict) -> None:
+        pass
+
+
+if __name__ == "__main__":
+    import sys
+
+    HwDaemon(logger=logging.getLogger('hwdaemon'), args=sys.argv).serve_forever()
@@ -0,0 +1,252 @@
+import logging
+from collections import OrderedDict
+from itertools import count
+from threading import Thread, Condition, Event, local
+from time import monotonic
+
+# задание, выполняемое текущим потоком
+current = local()
+
+
+def report(message: str) -> None:
+    """
+    Сообщает о ходе выполнения текущего задания. Вне задания ничего не делает
+
+    :param message: текст сообщения
+    :return: None
+    """
+    job = getattr(current, 'job', None)
+    if job is not None:
+        job.queue.update(job, progress=message)
+
+
+class Job:
+    """
+    Задание на выполнение функции в фоновом потоке
+    """
+    __slots__ = ('id', 'key', 'resource', 'func', 'args', 'kwargs', 'state', 'progress', 'result',
+                 'error', 'merged', 'submitted', 'started', 'finished', 'done', 'queue')
+
+    def __init__(self, job_id: int, key, resource, func, args: tuple, kwargs: dict, queue) -> None:
+        self.id = job_id
+        self.key = key
+        self.resource = resource
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.state = 'queued'       # queued, running, done, error
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.merged = 0             # число объединенных повторных запросов
+        self.submitted = monotonic()
+        self.started = None
+        self.finished = None
+        self.done = Event()
+        self.queue = queue
+
+    def resources(self) -> tuple:
+        """
+        :return: ресурсы задания
+        """
+        return self.resource if isinstance(self.resource, tuple) else (self.resource,)
+
+    def wait(self, timeout: float = None):
+        """
+        Ожидает завершения задания
+
+        :param timeout: время ожидания, с
+        :return: результат задания
+        """
+        self.done.wait(timeout)
+        return self.result
+
+    def as_dict(self) -> dict:
+        """
+        :return: словарь с состоянием задания
+        """
+        return dict(id=self.id,
+                    key=str(self.key),
+                    state=self.state,
+                    progress=self.progress,
+                    result=self.result if isinstance(self.result, (str, int, float, bool, type(None))) else str(self.result),
+                    error=self.error,
+                    merged=self.merged)
+
+
+class JobQueue:
+    """
+    Очередь фоновых заданий. Повторные задания с тем же ключом, еще не
+    начавшие выполнение, объединяются (выполняется последнее). Задания
+    одного ресурса выполняются последовательно
+    """
+
+    def __init__(self, workers: int = 1, history: int = 100, name: str = 'Thread job') -> None:
+        """
+        Инициализация
+
+        :param workers: число потоков выполнения
+        :param history: число хранимых завершенных заданий
+        :param name: имя потоков выполнения
+        """
+        self.logger = logging.getLogger(__name__)
+        self.condition = Condition()
+        self.pending = OrderedDict()    # {ключ: задание}
+        self.running = set()            # ресурсы выполняемых заданий
+        self.jobs = OrderedDict()       # {id: задание}
+        self.history = history
+        self.ids = count(1)
+        self.listeners = []
+        self.counters = dict(submitted=0, merged=0, done=0, errors=0)
+        self.threads = [Thread(name='%s %d' % (name, n), target=self.worker, daemon=True)
+                        for n in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, func, args: tuple = (), kwargs: dict = None, resource=None) -> Job:
+        """
+        Ставит задание в очередь
+
+        :param key: ключ объединения повторных заданий
+        :param func: функция
+        :param args: позиционные аргументы функции
+        :param kwargs: именованные аргументы функции
+        :param resource: ресурс или кортеж ресурсов, задания которых выполняются
+        последовательно, по умолчанию - ключ
+        :return: задание
+        """
+        with self.condition:
+            self.counters['submitted'] += 1
+            job = self.pending.get(key)
+            if job is not None:
+                # задание еще не начато: выполняется с последними аргументами
+                job.func, job.args, job.kwargs = func, args, kwargs or {}
+                job.merged += 1
+                self.counters['merged'] += 1
+            else:
+                job = Job(next(self.ids), key, key if resource is None else resource, func, args, kwargs or {}, self)
+                self.pending[key] = job
+                self.jobs[job.id] = job
+                while len(self.jobs) > self.history:
+                    oldest = next(iter(self.jobs.values()))
+                    if not oldest.done.is_set():
+                        break
+                    self.jobs.popitem(last=False)
+            self.condition.notify_all()
+        self.notify(job)
+        return job
+
+    def get(self, job_id: int) -> Job:
+        """
+        :param job_id: id задания
+        :return: задание или None
+        """
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def busy(self, resource) -> bool:
+        """
+        :param resource: ресурс
+        :return: True - задание ресурса ожидает или выполняется
+        """
+        with self.condition:
+            return resource in self.running or any(resource in job.resources() for job in self.pending.values())
+
+    def subscribe(self, listener) -> None:
+        """
+        Подписывает обработчик на изменения состояния заданий: listener(job).
+        Обработчик вызывается в потоке, изменившем состояние
+
+        :param listener: обработчик
+        :return: None
+        """
+        self.listeners.append(listener)
+
+    def update(self, job: Job, **changes) -> None:
+        with self.condition:
+            for name, value in changes.items():
+                setattr(job, name, value)
+        self.notify(job)
+
+    def notify(self, job: Job) -> None:
+        for listener in self.listeners:
+            try:
+                listener(job)
+            except Exception as err:
+                self.logger.error('Ошибка обработчика задания %s: %s', job.key, err)
+
+    def next_job(self) -> Job:
+        # первое ожидающее задание, ресурсы которого свободны и не ожидаются
+        # более ранними заданиями: задания каждого ресурса выполняются по порядку
+        blocked = set(self.running)
+        for key, job in self.pending.items():
+            if blocked.isdisjoint(job.resources()):
+                del self.pending[key]
+                self.running.update(job.resources())
+                return job
+            blocked.update(job.resources())
+        return None
+
+    def worker(self) -> None:
+        """
+        Поток выполнения заданий
+
+        :return: None
+        """
+        while True:
+            with self.condition:
+                job = None
+                while job is None:
+                    job = self.next_job()
+                    if job is None:
+                        self.condition.wait()
+                job.state = 'running'
+                job.started = monotonic()
+            self.notify(job)
+
+            current.job = job
+            try:
+                result, error = job.func(*job.args, **job.kwargs), None
+            except Exception as err:
+                result, error = None, str(err)
+                self.logger.error('Ошибка выполнения задания %s: %s', job.key, err)
+            current.job = None
+
+            with self.condition:
+                job.result, job.error = result, error
+                job.state = 'done' if error is None else 'error'
+                job.finished = monotonic()
+                self.counters['done' if error is None else 'errors'] += 1
+                self.running.difference_update(job.resources())
+                self.condition.notify_all()
+            job.done.set()
+            self.notify(job)
+
+    def stats(self) -> dict:
+        """
+        :return: счетчики заданий и число ожидающих заданий
+        """
+        with self.condition:
+            return dict(self.counters, pending=len(self.pending), running=len(self.running))
+
+
+if __name__ == "__main__":
+    from time import sleep
+
+    events = []
+    queue = JobQueue(workers=2)
+    queue.subscribe(lambda job: events.append((job.id, job.state, job.progress)))
+
+    def apply(name, value):
+        report('применение %s' % name)
+        sleep(0.1)
+        return '%s=%s' % (name, value)
+
+    # повторные задания одного ключа объединяются, задания одного ресурса последовательны
+    first = queue.submit('net', apply, ('lan1', 1), resource='config')
+    jobs = [queue.submit('time', apply, ('tz', n), resource='config') for n in range(5)]
+    other = queue.submit('gnss', apply, ('speed', 9600))
+    start = monotonic()
+    print([job.wait() for job in (first, jobs[-1], other)], '%.2f с' % (monotonic() - start))
+    assert len({job.id for job in jobs}) == 1 and jobs[-1].result == 'tz=4'
+    print(queue.stats())
@@ -0,0 +1,128 @@
+import logging
+from threading import Lock
+from time import monotonic
+
+# кадр LCD 122x32: 4 страницы по 8 строк, 122 байта на страницу
+LCD_PAGES = 4
+LCD_PAGE_SIZE = 122
+
+
+class FrameDiff:
+    """
+    Сравнение кадра LCD с последним переданным в УПШ по страницам.
+    Одинаковые кадры не передаются, измененные страницы могут
+    передаваться отдельно
+    """
+
+    def __init__(self, pages: int = LCD_PAGES, page_size: int = LCD_PAGE_SIZE, window: float = 60.0) -> None:
+        """
+        Инициализация
+
+        :param pages: число страниц кадра
+        :param page_size: размер страницы, байт
+        :param window: интервал подсчета сэкономленных байт, с
+        """
+        self.logger = logging.getLogger(__name__)
+        self.pages = pages
+        self.page_size = page_size
+        self.window = window
+        self.lock = Lock()
+        self.last = None            # последний переданный кадр
+        self.counters = dict(frames=0, skipped=0, full=0, partial=0, bytes_sent=0, bytes_saved=0)
+        self.window_start = monotonic()
+        self.window_saved = 0
+        self.saved_per_min = 0
+
+    def page(self, frame: bytes, index: int) -> bytes:
+        """
+        :param frame: кадр
+        :param index: номер страницы
+        :return: данные страницы
+        """
+        return frame[index * self.page_size:(index + 1) * self.page_size]
+
+    def diff(self, frame: bytes) -> list:
+        """
+        Номера страниц кадра, отличающихся от последнего переданного кадра
+
+        :param frame: новый кадр
+        :return: лист номеров страниц, пустой - кадр не изменился
+        """
+        with self.lock:
+            last = self.last
+        if last is None or len(last) != len(frame):
+            return list(range(self.pages))
+        if last == frame:
+            self.account(0, len(frame), skipped=True)
+            return []
+        return [index for index in range(self.pages) if self.page(last, index) != self.page(frame, index)]
+
+    def commit(self, frame: bytes, sent: int, partial: bool) -> None:
+        """
+        Запоминает переданный кадр
+
+        :param frame: переданный кадр
+        :param sent: число переданных байт
+        :param partial: переданы только измененные страницы
+        :return: None
+        """
+        with self.lock:
+            self.last = bytes(frame)
+            self.counters['partial' if partial else 'full'] += 1
+        self.account(sent, max(len(frame) - sent, 0))
+
+    def account(self, sent: int, saved: int, skipped: bool = False) -> None:
+        with self.lock:
+            self.counters['frames'] += 1
+            self.counters['skipped'] += skipped
+            self.counters['bytes_sent'] += sent
+            self.counters['bytes_saved'] += saved
+            now = monotonic()
+            if now - self.window_start >= self.window:
+                # байты, сэкономленные за последний завершенный интервал
+                self.saved_per_min = round(self.window_saved * 60 / (now - self.window_start))
+                self.logger.error('LCD: сэкономлено %d байт/мин, пропущено кадров: %d из %d',
+                                  self.saved_per_min, self.counters['skipped'], self.counters['frames'])
+                self.window_start = now
+                self.window_saved = 0
+            self.window_saved += saved
+
+    def reset(self) -> None:
+        """
+        Забывает последний переданный кадр, следующий кадр передается целиком
+        (после подключения или сброса УПШ)
+
+        :return: None
+        """
+        with self.lock:
+            self.last = None
+
+    def stats(self) -> dict:
+        """
+        :return: счетчики кадров и байт, сэкономлено байт в минуту
+        """
+        with self.lock:
+            return dict(self.counters, saved_per_min=self.saved_per_min)
+
+
+if __name__ == "__main__":
+    from random import Random
+
+    # имитация навигации по меню: кадр меняется в одной-двух страницах,
+    # часть нажатий не меняет экран
+    rnd = Random(0)
+    frames = FrameDiff()
+    frame = bytearray(LCD_PAGES * LCD_PAGE_SIZE)
+    for _ in range(1000):
+        if rnd.random() < 0.7:
+            for page in rnd.sample(range(LCD_PAGES), rnd.choice((1, 1, 2))):
+                start = page * LCD_PAGE_SIZE + rnd.randrange(LCD_PAGE_SIZE - 16)
+                frame[start:start + 16] = bytes(rnd.getrandbits(8) for _ in range(16))
+        dirty = frames.diff(bytes(frame))
+        if dirty:
+            partial = len(dirty) < LCD_PAGES
+            sent = len(dirty) * (LCD_PAGE_SIZE + 4) if partial else len(frame) + 2
+            frames.commit(bytes(frame), sent, partial)
+    stats = frames.stats()
+    total = stats['bytes_sent'] + stats['bytes_saved']
+    print(stats, 'передано %.1f%% байт' % (stats['bytes_sent'] * 100 / total))
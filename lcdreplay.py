@@ -0,0 +1,150 @@
+import os
+from threading import Lock
+from time import perf_counter, monotonic
+from timing import percentile
+
+# запись нажатий кнопок для воспроизведения: путь к файлу в LCD_RECORD
+record_path = os.environ.get('LCD_RECORD')
+record_lock = Lock()
+record_start = monotonic()
+
+
+def record_buttons(rising: int, falling: int, clamping: int, timers: int) -> None:
+    """
+    Дописывает событие кнопок в файл записи, если запись включена
+
+    :return: None
+    """
+    if not record_path:
+        return
+    with record_lock, open(record_path, 'a') as file:
+        file.write('%.3f %#x %#x %#x %#x\n' % (monotonic() - record_start, rising, falling, clamping, timers))
+
+
+def load_events(path: str) -> list:
+    """
+    Читает последовательность событий кнопок. Строка файла:
+    '[время] rising falling clamping timers' или 'press маска' (нажатие и
+    отпускание), '#' - комментарий
+
+    :param path: путь к файлу
+    :return: лист кортежей (rising, falling, clamping, timers)
+    """
+    events = []
+    with open(path) as file:
+        for line in file:
+            words = line.split('#', 1)[0].split()
+            if not words:
+                continue
+            if words[0] == 'press':
+                mask = int(words[1], 0)
+                events += [(mask, 0, 0, 0), (0, mask, 0, 0)]
+                continue
+            values = [int(word, 0) for word in words if '.' not in word]
+            events.append(tuple(values[-4:]))
+    return events
+
+
+class ReplayHarness:
+    """
+    Воспроизведение событий кнопок через обработку экранов LCD без УПШ.
+    Для каждого события отдельно измеряется время смены и отрисовки экрана
+    и время применения введенных параметров
+    """
+
+    def __init__(self, lcd, apply) -> None:
+        """
+        :param lcd: экран LCD (change_screen, show_screen, get_unsaved_params, get_screen_label)
+        :param apply: функция применения параметров apply(label, params),
+        например Manager.apply_lcd_params
+        """
+        self.lcd = lcd
+        self.apply = apply
+        self.records = []
+
+    def step(self, rising: int, falling: int, clamping: int, timers: int) -> dict:
+        """
+        Обрабатывает одно событие кнопок
+
+        :return: словарь с экраном и временем этапов, мс
+        """
+        lcd = self.lcd
+        start = perf_counter()
+        changes = lcd.change_screen(rising, falling, clamping, timers)
+        if changes:
+            lcd.show_screen()
+        rendered = perf_counter()
+        params = lcd.get_unsaved_params()
+        label = lcd.get_screen_label()
+        if params:
+            self.apply(label, params)
+        applied = perf_counter()
+        record = dict(label=label,
+                      render_ms=(rendered - start) * 1000,
+                      apply_ms=(applied - rendered) * 1000,
+                      applied=bool(params))
+        self.records.append(record)
+        return record
+
+    def run(self, events) -> list:
+        """
+        :param events: лист кортежей (rising, falling, clamping, timers)
+        :return: лист результатов по событиям
+        """
+        return [self.step(*event) for event in events]
+
+    def report(self) -> list:
+        """
+        Сводка по экранам, отсортированная по суммарному времени обработки
+
+        :return: лист словарей {'label', 'events', 'render_p50', 'render_max', 'apply_p50', 'apply_max', 'total_ms'}
+        """
+        screens = {}
+        for record in self.records:
+            screens.setdefault(record['label'], []).append(record)
+        report = []
+        for label, records in screens.items():
+            render = sorted(record['render_ms'] for record in records)
+            apply = sorted(record['apply_ms'] for record in records if record['applied'])
+            report.append(dict(label=label,
+                               events=len(records),
+                               render_p50=round(percentile(render, 50), 3),
+                               render_max=round(render[-1], 3),
+                               apply_p50=round(percentile(apply, 50), 3),
+                               apply_max=round(apply[-1], 3) if apply else 0.0,
+                               total_ms=round(sum(render) + sum(apply), 3)))
+        return sorted(report, key=lambda item: item['total_ms'], reverse=True)
+
+    def format(self) -> str:
+        lines = ['%-20s %6s %10s %10s %10s %10s' % ('экран', 'событ.', 'отрис.p50', 'отрис.max',
+                                                    'примен.p50', 'примен.max')]
+        for item in self.report():
+            lines.append('%-20s %6d %10.3f %10.3f %10.3f %10.3f' % (
+                item['label'], item['events'], item['render_p50'], item['render_max'],
+                item['apply_p50'], item['apply_max']))
+        return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description='Воспроизведение нажатий кнопок LCD')
+    parser.add_argument('events', help='файл с событиями кнопок')
+    parser.add_argument('--apply', action='store_true',
+                        help='применять параметры (изменяет настройки системы), иначе параметры только выводятся')
+    args = parser.parse_args()
+
+    from manager import lcd, Manager
+
+    manager = Manager.__new__(Manager)
+    manager.logger = logging.getLogger('manager')
+    if args.apply:
+        apply = manager.apply_lcd_params
+    else:
+        def apply(label, params):
+            print('ПАРАМЕТРЫ %s: %s' % (label, params))
+
+    harness = ReplayHarness(lcd, apply)
+    harness.run(load_events(args.events))
+    print(harness.format())
@@ -1,12 +1,23 @@
 import sys
 import subprocess
-from copy import deepcopy
+from functools import wraps
 from os import path, remove
 from configparser import ConfigParser
+from ntpctl import NtpControlClient, NtpControlError
+import netinfo
+from executor import CommandExecutor
+from cache import TTLCache
+from ntpconf import NtpConf, replace_in_line
+from restarter import RestartCoordinator
 
 WORKING_DIR = path.dirname(path.abspath(__file__))
+SETTINGS_FILE = '%s/settings.json' % WORKING_DIR
 sys.path.insert(1, "%s/site-packages" % WORKING_DIR)
 
+executor = CommandExecutor(workers=4, timeout=30)
+cache = TTLCache()
+restarter = RestartCoordinator(restart=lambda service: systemctl('restart', service))
+
 from werkzeug.datastructures import ImmutableDict
 
 TIME_SRC_NONE = 0
@@ -149,15 +160,17 @@ timezones = {
 
 def restart_ntp(func):
     """
-    Декоратор, делает перезапуск службы ntp после выполнения функции
+    Декоратор, запрашивает перезапуск службы ntp после выполнения функции.
+    Повторные запросы объединяются координатором перезапусков
 
     :param func: декорируемая функция, после которой требуется перезапуск
     :return: результат выполнения функции
     """
 
+    @wraps(func)
     def wrapper(*args, **kwargs):
         result = func(*args, **kwargs)
-        systemctl('restart', 'ntp')
+        restarter.request('ntp')
         return result
 
     return wrapper
@@ -205,50 +218,109 @@ def save_optime() -> None:
     write_ini_file({'optime': old_uptime + uptime})
 
 
+@cache.cached('network', ttl=5)
+def get_networks(devices: tuple) -> dict:
+    """
+    Запрашивает у системы параметры сетевых интерфейсов через sysfs и rtnetlink,
+    без запуска внешних команд
+
+    :param devices: имена сетевых интерфейсов
+    :return: словарь {имя интерфейса: кортеж с настройками сети или None}
+    """
+    try:
+        links = netinfo.interfaces(devices)
+    except OSError as e:
+        print(e)
+        return {device: get_network_cmd(device) for device in devices}
+
+    networks = {}
+    for device in devices:
+        link = links.get(device)
+        if link and link['status'] == 'UP':
+            inet4 = link['inet4']
+            gateway_list = [link['gateway']] if link['gateway'] else []
+            networks[device] = network_tuple(inet4, gateway_list, link['mac'], link['status'], link['speed'])
+        else:
+            networks[device] = read_network_file(device, link['status'] if link else '')
+    return networks
+
+
 def get_network(device: str):
     """
     Запрашивает у системы параметры сетевого интерфейса
 
+    :param device: имя сетевого интерфейса
+    :return: кортеж с настройками сети
+    """
+    return get_networks((device,))[device]
+
+
+def get_network_cmd(device: str):
+    """
+    Запрашивает параметры сетевого интерфейса командами "ip"
+
     :param device: имя сетевого интерфейса
     :return: кортеж с настройками сети
     """
     status = run_cmd(command="ip -br a show %s |" % device + "awk '{print $2}'").rstrip('\n')
 
-    if status == 'UP':
-        inet4 = run_cmd(command="ip -br a show %s |" % device + "awk '{print $3}'").rstrip('\n')
-        gateway_list = run_cmd(
-            command="ip route | awk '/%s/'" % device + " | awk '/default via/{print $3}'").splitlines()
-        mac = run_cmd(
-            command="ip a show %s |" % device + " grep ether | awk '{print $2}'").rstrip('\n')
-        speed = run_cmd(command='cat /sys/class/net/%s/speed' % device).rstrip('\n')
+    if status != 'UP':
+        return read_network_file(device, status)
 
-    else:
-        try:
-            with open('/etc/systemd/network/{}.network'.format(device), 'r') as file:
-                inet4 = None
-                gateway_list = []
-                for line in file:
-                    if 'Address=' in line:
-                        inet4 = line[len('Address='):]
-                    if 'Gateway=' in line:
-                        gateway_list.append(line[len('Gateway='):])
-                mac = '00:00:00:00:00:00'
-                speed = '0'
-        except FileNotFoundError as e:
-            # print('set default: ', default_settings['net'][lan])
-            # self.change_net_cfg(lan,
-            #                     default_settings['net'][lan]['ip'],
-            #                     default_settings['net'][lan]['netmask'],
-            #                     default_settings['net'][lan]['gateway'],
-            #                     default_settings['net'][lan]['listen']
-            #                     )
-            # continue
-            print(e)
-            return None
-        except Exception as e:
-            print(e)
-            return None
+    inet4 = run_cmd(command="ip -br a show %s |" % device + "awk '{print $3}'").rstrip('\n')
+    gateway_list = run_cmd(
+        command="ip route | awk '/%s/'" % device + " | awk '/default via/{print $3}'").splitlines()
+    mac = run_cmd(
+        command="ip a show %s |" % device + " grep ether | awk '{print $2}'").rstrip('\n')
+    speed = run_cmd(command='cat /sys/class/net/%s/speed' % device).rstrip('\n')
+    return network_tuple(inet4, gateway_list, mac, status, speed)
+
+
+def read_network_file(device: str, status: str):
+    """
+    Читает настройки сетевого интерфейса из файла systemd-networkd
 
+    :param device: имя сетевого интерфейса
+    :param status: состояние интерфейса
+    :return: кортеж с настройками сети
+    """
+    try:
+        with open('/etc/systemd/network/{}.network'.format(device), 'r') as file:
+            inet4 = None
+            gateway_list = []
+            for line in file:
+                if 'Address=' in line:
+                    inet4 = line[len('Address='):]
+                if 'Gateway=' in line:
+                    gateway_list.append(line[len('Gateway='):])
+    except FileNotFoundError as e:
+        # print('set default: ', default_settings['net'][lan])
+        # self.change_net_cfg(lan,
+        #                     default_settings['net'][lan]['ip'],
+        #                     default_settings['net'][lan]['netmask'],
+        #                     default_settings['net'][lan]['gateway'],
+        #                     default_settings['net'][lan]['listen']
+        #                     )
+        # continue
+        print(e)
+        return None
+    except Exception as e:
+        print(e)
+        return None
+    return network_tuple(inet4, gateway_list, '00:00:00:00:00:00', status, '0')
+
+
+def network_tuple(inet4: str, gateway_list: list, mac: str, status: str, speed: str):
+    """
+    Формирует кортеж с настройками сети
+
+    :param inet4: адрес в формате 'ip/cidr'
+    :param gateway_list: лист шлюзов
+    :param mac: mac адрес
+    :param status: состояние интерфейса
+    :param speed: скорость интерфейса
+    :return: кортеж с настройками сети или None, если нет адреса или шлюза
+    """
     if not inet4 or not gateway_list:
         return None
 
@@ -267,7 +339,9 @@ def set_timezone(tz: str) -> str:
     :param tz: часовой пояс в текстовом формате
     :return: результат выполнения
     """
-    return run_cmd(command='timedatectl set-timezone "%s"' % timezones[tz])
+    result = run_cmd(command=['timedatectl', 'set-timezone', timezones[tz]])
+    cache.invalidate('systemctl')
+    return result
 
 
 def reset_webserver_config() -> bool:
@@ -276,43 +350,40 @@ def reset_webserver_config() -> bool:
 
     :return:
     """
-    for file in ('%s/settings.json' % WORKING_DIR,
+    for file in (SETTINGS_FILE,
                  '%s/hashsum' % WORKING_DIR):
         if path.exists(file):
-            run_cmd('rm %s' % file)
-    for lan in ('lan1', 'lan2'):
-        add_network(name=default_settings['net'][lan]['name'],
-                    ip=default_settings['net'][lan]['ip'],
-                    netmask=default_settings['net'][lan]['netmask'],
-                    gateway=default_settings['net'][lan]['gateway'],
-                    )
-        add_listen_ntp(lan=lan,
-                       listen=default_settings['net'][lan]['listen'],
-                       ip=default_settings['net'][lan]['ip'],
-                       sync_src=default_settings['main']['sync_src'],
-                       gnss_synced=False
-                       )
-
-    run_cmd('bash %s/cfg/services_config.sh' % WORKING_DIR)
-
-    run_cmd('systemctl restart systemd-networkd')
-    run_cmd('systemctl restart ntp')
+            run_cmd(['rm', file])
+    with NtpConf() as conf:
+        for lan in ('lan1', 'lan2'):
+            add_network(name=default_settings['net'][lan]['name'],
+                        ip=default_settings['net'][lan]['ip'],
+                        netmask=default_settings['net'][lan]['netmask'],
+                        gateway=default_settings['net'][lan]['gateway'],
+                        )
+            add_listen_ntp(lan=lan,
+                           listen=default_settings['net'][lan]['listen'],
+                           ip=default_settings['net'][lan]['ip'],
+                           sync_src=default_settings['main']['sync_src'],
+                           gnss_synced=False,
+                           conf=conf
+                           )
+
+    run_cmd(['bash', '%s/cfg/services_config.sh' % WORKING_DIR])
+
+    restarter.request('systemd-networkd', 'ntp')
     return True
 
 
-def run_cmd(command: str) -> str:
+def run_cmd(command, timeout: float = None) -> str:
     """
-    Выполняет команду в консоли linux
+    Выполняет команду в консоли linux через пул выполнения команд
 
-    :param command: текст команды
+    :param command: текст команды (выполняется в shell) или лист аргументов (без shell)
+    :param timeout: таймаут в секундах, None - таймаут по умолчанию
     :return: результат выполнения
     """
-    cmdout = subprocess.Popen(command,
-                              shell=True,
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.STDOUT, )
-    stdout, stderr = cmdout.communicate()
-    return stdout.decode('utf-8')
+    return executor.run(command, timeout)
 
 
 def add_network(name: str,
@@ -345,6 +416,7 @@ def add_network(name: str,
                 'Address=%s/%s\n' % (ip, cidr) +
                 'Gateway=%s\n' % gateway
             )
+        cache.invalidate('network')
         return True
     except Exception:
         return False
@@ -354,7 +426,8 @@ def add_listen_ntp(lan: str,
                    listen: str,
                    ip: str,
                    sync_src: str,
-                   gnss_synced: bool) -> bool:
+                   gnss_synced: bool,
+                   conf: NtpConf = None) -> bool:
     """
     Редактирует строки с параметрами 'listen' в конфигурационном файле ntp.conf
 
@@ -363,69 +436,59 @@ def add_listen_ntp(lan: str,
     :param ip: адрес сетевого интерфейса
     :param sync_src: '0' - внутренний, '1' - внешний источник синхронизации
     :param gnss_synced: True - если была успешная синхронизация со спутником
+    :param conf: модель ntp.conf для накопления изменений, None - изменения
+    записываются сразу
     :return: true, false
     """
-    # print(lan, listen, ip)
-    # set listen ip adr
-    if not do_with_file(path="/etc/ntp.conf",
-                        action='replace',
-                        labels=[lan],
-                        inserts=[ip],
-                        positions=[2]
-                        ):
-        return False
-
     if listen == '1':
-        if sync_src == '0' or gnss_synced is True:  # разрешить раздачу времени при внутреннем источнике
-            action = 'uncomment'  # синхронизации. при внешнем источнике - разрешить,
-        else:  # только если была успешная синхронизация со спутником.
-            action = 'comment'
-
+        # разрешить раздачу времени при внутреннем источнике синхронизации.
+        # при внешнем источнике - только если была успешная синхронизация со спутником.
+        enabled = sync_src == '0' or gnss_synced is True
     elif listen == '0':
-        action = 'comment'
+        enabled = False
     else:
         return False
 
-    if not do_with_file(path="/etc/ntp.conf",
-                        action=action,
-                        labels=[lan]
-                        ):
+    if conf is None:
+        with NtpConf() as document:
+            return add_listen_ntp(lan, listen, ip, sync_src, gnss_synced, conf=document) and \
+                (document.commit() or document.ok)
+    if not conf.set_listen_address(lan, ip) or not conf.set_listen_enabled(lan, enabled):
         return False
-
-    return True
+    return conf.ok
 
 
 def stty(device='/dev/ttyS1', speed='115200', size='8', stopbit='1', parity='N') -> str:
-    cmd = "stty -F "
+    cmd = ['stty', '-F']
 
     if device in ('/dev/ttyS0', '/dev/ttyS1'):
-        cmd += device + ' '
+        cmd.append(device)
     else:
         return 'Ошибка параметра device'
 
     if speed in ('9600', '19200', '38400', '57600', '115200'):
-        cmd += speed
+        cmd.append(speed)
     else:
         return 'Ошибка параметра speed'
 
     if int(size) in range(5, 9):
-        cmd += ' cs' + size
+        cmd.append('cs' + size)
     else:
         return 'Ошибка параметра size'
 
     if stopbit == '1':
-        cmd += ' -cstopb'
+        cmd.append('-cstopb')
     elif stopbit == '2':
-        cmd += ' cstopb'
+        cmd.append('cstopb')
     else:
         return 'Ошибка параметра stopbit'
 
     if parity == 'N':
-        cmd += ' -parenb'
+        cmd.append('-parenb')
     elif parity == 'E':
-        cmd += ' -parodd'
+        cmd.append('-parodd')
     elif parity == 'O':
-        cmd += ' parodd'
+        cmd.append('parodd')
     else:
         return 'Ошибка параметра parity'
 
@@ -469,7 +532,7 @@ def read_journalctl(output='short', since='yesterday', until='now', services: li
     """
     if not services:
         return ''
-    cmd = 'journalctl --no-pager'
+    cmd = ['journalctl', '--no-pager']
     units = []
     for srv in services:
         if srv == 'all':
@@ -482,9 +545,9 @@ def read_journalctl(output='short', since='yesterday', until='now', services: li
         if srv == 'ntpd':
             units.append('ntp')
     for unit in units:
-        cmd += ' -u ' + unit
-    cmd = ' '.join([cmd, '-o', output, '--since', since, '--until', until])
-    return run_cmd(command=cmd)
+        cmd += ['-u', unit]
+    cmd += ['-o', output, '--since', since, '--until', until]
+    return run_cmd(command=cmd, timeout=60)
 
 
 def systemctl(action: str, service: str):
@@ -498,19 +561,19 @@ def systemctl(action: str, service: str):
     """
     if service == 'gpsd':
         if action == 'start':
-            run_cmd(command='systemctl start gpsd.socket')
+            run_cmd(command=['systemctl', 'start', 'gpsd.socket'])
         elif action == 'stop':
-            run_cmd(command='systemctl stop gpsd.socket')
-            run_cmd(command='systemctl stop gpsd')
+            run_cmd(command=['systemctl', 'stop', 'gpsd.socket', 'gpsd'])
         elif action == 'restart':
-            run_cmd(command='systemctl stop gpsd.socket')
-            run_cmd(command='systemctl stop gpsd')
-            run_cmd(command='systemctl start gpsd.socket')
-            run_cmd(command='systemctl start gpsd')
+            run_cmd(command=['systemctl', 'stop', 'gpsd.socket', 'gpsd'])
+            run_cmd(command=['systemctl', 'start', 'gpsd.socket', 'gpsd'])
     elif action == 'status':
-        return run_cmd(command='systemctl status {s}'.format(s=service))
+        return cache.get(('systemctl', service), 2, lambda: run_cmd(command=['systemctl', 'status', service]))
     else:
-        run_cmd(command='systemctl {} {}'.format(action, service))
+        run_cmd(command=['systemctl', action, service])
+    cache.invalidate('systemctl', 'services')
+    if service == 'systemd-networkd':
+        cache.invalidate('network')
     return None
 
 
@@ -522,9 +585,9 @@ def is_service_active(*services) -> bool:
     :param services: имена системных служб
     :return: 'True', 'False'
     """
+    units = cache.get(('services',), 2, lambda: run_cmd(command=['systemctl', 'list-units', '--state', 'active']))
     for service in services:
-        status = run_cmd(command="systemctl list-units --state active | egrep '%s'" % service)
-        if status == '':
+        if service not in units:
             return False
     return True
 
@@ -558,74 +621,77 @@ selection_fields = {
 }
 
 
+ntp_client = NtpControlClient()
+
+
 def ntp_peers():
     """
-    Выполняет команду "ntpq -p" для запроса пиров службы ntp
+    Запрашивает пиры службы ntp по управляющему протоколу (mode 6),
+    при недоступности протокола - выполняет команду "ntpq -p"
 
     :return: словарь с пирами и их параметрами или None в случае ошибки
     """
-    cmdout = run_cmd(command="ntpq -p")
-    peers = deepcopy(peers_default)
-
-    if 'remote' not in cmdout:
-        return peers
+    peers = {refid: dict(fields) for refid, fields in peers_default.items()}
+    try:
+        peer_list = ntp_client.peers()
+    except (OSError, NtpControlError):
+        peer_list = ntpq_peers()
 
-    for line in cmdout.splitlines()[2:]:
-        labels = line.split()
-        if len(labels) < 10:
-            continue
-        refid = labels[1]
+    for peer in peer_list:
+        refid = peer['refid']
         if refid in peers:
-            peers[refid]['stratum'] = labels[2]
-            peers[refid]['offset'] = labels[8]
-            peers[refid]['jitter'] = labels[9]
-            status_id = labels[0][0]
+            peers[refid]['stratum'] = peer['stratum']
+            peers[refid]['offset'] = peer['offset']
+            peers[refid]['jitter'] = peer['jitter']
+            status_id = peer['status_id']
             if status_id in selection_fields:
                 peers[refid]['status_id'] = status_id
                 peers[refid]['status'] = selection_fields[status_id]
-    #         print(peers[refid])
-    # print('\n')
     return peers
 
 
-def ntp_config(sync: int):
+def ntpq_peers() -> list:
     """
-    Изменение конфиг. файла службы ntp, в зависимости от выбранного источника синхр.
+    Выполняет команду "ntpq -p" и разбирает таблицу пиров
 
-    :param sync: источник синхронизации
-    :return: наименование выбранного источника синхр. или None в случае ошибки
+    :return: лист словарей с полями refid, stratum, offset, jitter, status_id
     """
-    if sync == 0:
-        action = 'comment'
-    else:
-        action = 'uncomment'
+    cmdout = run_cmd(command="ntpq -p")
+    if 'remote' not in cmdout:
+        return []
 
-    if do_with_file(path="/etc/ntp.conf",
-                    action=action,
-                    labels=['GPS_server', 'GPS_fudge', 'PPS_server', 'PPS_fudge'],
-                    ):
-        # run_cmd('systemctl restart ntp')
-        return ['Внутренний', 'Внешний (ГНСС)'][sync]
-    return None
+    peer_list = []
+    for line in cmdout.splitlines()[2:]:
+        labels = line.split()
+        if len(labels) < 10:
+            continue
+        peer_list.append(dict(refid=labels[1],
+                              stratum=labels[2],
+                              offset=labels[8],
+                              jitter=labels[9],
+                              status_id=labels[0][0]))
+    return peer_list
 
 
-def replace_in_line(line: str, string: str, position: int) -> str:
+def ntp_config(sync: int, conf: NtpConf = None):
     """
-    Замена текста в строке
+    Изменение конфиг. файла службы ntp, в зависимости от выбранного источника синхр.
 
-    :param line: строка
-    :param string: текст для замены
-    :param position: позиция замены
-    :return: новая строка
+    :param sync: источник синхронизации
+    :param conf: модель ntp.conf для накопления изменений, None - изменения
+    записываются сразу
+    :return: наименование выбранного источника синхр. или None в случае ошибки
     """
-    # remove line if string is None
-    if not string:
-        return ''
-
-    lst = line.split()
-    lst.pop(position)
-    lst.insert(position, string)
-    return ' '.join(lst) + '\n'
+    if conf is None:
+        with NtpConf() as document:
+            source = ntp_config(sync, conf=document)
+            document.commit()
+            return source if document.ok else None
+    if not conf.set_refclocks(enabled=sync != 0):
+        return None
+    if conf.ok:
+        return ['Внутренний', 'Внешний (ГНСС)'][sync]
+    return None
 
 
 # TODO: rename to file_operation
@@ -644,38 +710,14 @@ def do_with_file(path: str,
     :param positions: лист позиций для вставки значений
     :return: 'True' - если действие успешно, 'False' - если нет
     """
-    try:
-        with open(path, mode='r+') as file:
-            newtext = []
-            for line in file.readlines():
-                for label in labels:
-                    if label in line:
-                        idx = labels.index(label)
-
-                        if action == 'comment':
-                            if not line.startswith('#'):
-                                line = '#' + line
-                        elif action == 'uncomment':
-                            line = line.strip('# ')
-                        elif action == 'remove':
-                            line = ''
-                        elif action == 'replace':
-                            line = replace_in_line(line, inserts.pop(idx), positions.pop(idx))
-
-                        labels.pop(idx)
-                        break
-                newtext.append(line)
-
-            # write new text to file
-            file.truncate(0)
-            file.seek(0)
-            file.writelines(newtext)
-            return True
-    except Exception as e:
-        # logging.getLogger('app').debug(e)
+    document = NtpConf(path)
+    if not document.apply(action, labels, inserts, positions):
         return False
+    document.commit()
+    return document.ok
 
 
+@cache.cached('ini', ttl=10)
 def read_ini_file() -> dict:
     """
     Читает 'ini' файл
@@ -711,11 +753,22 @@ def write_ini_file(dictionary: dict) -> bool:
     config['DEFAULT'].update(dictionary)
     with open('./AfterInstallConfig.ini', 'w') as configfile:
         config.write(configfile)
+    cache.invalidate('ini')
     return True
 
 
 if __name__ == "__main__":
-    print(get_network('lan2'))
+    from time import perf_counter
+
+    count = 20
+    lans = ('lan1', 'lan2')
+    for name, query in (('ip | awk', lambda: [get_network_cmd(lan) for lan in lans]),
+                        ('sysfs + rtnetlink', lambda: get_networks(lans))):
+        start = perf_counter()
+        for _ in range(count):
+            networks = query()
+        print('%s: %.2f мс на %s' % (name, (perf_counter() - start) * 1000 / count, lans))
+    print(get_networks(lans))
     # d = dict(Uptime=1)
     # write_ini_file(d)
     # WORKING_DIR = read_ini_file('Uptime')
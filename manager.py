@@ -1,118 +1,68 @@
 import logging
 from eeprom.eeprom import SystemInfo
-import usb as usblib
 from calendar import timegm
-from time import time, gmtime, localtime, strftime, sleep, mktime, clock_settime, CLOCK_REALTIME
-from struct import *
+from time import time, gmtime, localtime, strftime, strptime, sleep, mktime, clock_settime, CLOCK_REALTIME
 from threading import Thread, Lock, Event
-from queue import Queue
+from functools import wraps
 from linuxtools import *
 import nmea
 from utils import validate_ipv4, validate_mac, config_loggers
-from copy import deepcopy
 from glcd_py.screen import *
 import json
 from datetime import timedelta
-from collections import OrderedDict
+from persist import SettingsWriter
+from store import SettingsStore
+from usbqueue import UsbScheduler
+from protocol import outbound, inbound
+from transport import make_transport, Backoff, TransportError, TransportTimeout, DeviceLost, EP_IN, EP_OUT, READ_TIMEOUT
+from ticker import SecondTicker
+from timing import TimingRing, log_interval
+from lcdframe import FrameDiff, LCD_PAGES, LCD_PAGE_SIZE
+from lcdreplay import record_buttons
+from jobs import JobQueue, report
+from scheduler import Scheduler
+
+
+def store_section(name: str) -> property:
+    """
+    Свойство класса настроек, связанное с разделом хранилища. Чтение возвращает
+    неизменяемый снимок, присваивание заменяет раздел целиком
+
+    :param name: имя раздела хранилища
+    :return: свойство
+    """
+    return property(lambda self: self.store.get(name),
+                    lambda self, value: self.store.replace(name, value))
 
 
 class Settings:
     """
     Класс для хранения настроек вебсервера
     """
+    sections = ('main', 'net', 'config', 'header', 'gpsd_data', 'pps_info')
+    main = store_section('main')
+    net = store_section('net')
+    config = store_section('config')
+    header = store_section('header')
+    gpsd_data = store_section('gpsd_data')
+    pps_info = store_section('pps_info')
+
     time_src = 0
     pps_src = 0
     # watchdog = 3600 * 24 * 30 * 12  # 1 year
     logger = None
 
-    gpsd_data = {}
     eeprom = None
     # pps_sync_src = 0
     # time_sync_src = 0
-    main = {
-        'sync_src': '1',
-        'date': 'n/a',
-        'time': 'n/a',
-        'timejump': '15',
-        'tz': '+3',
-        'tz_kv': '+0',
-        'tz_rs': '+0',
-        'sat_system': 'gnss',
-        'ext_sync_src': 'gnss422',
-        'reciever': 'irz7',
-        'internal': dict(name='ГНСС внутренний',
-                         speed='115200',
-                         size='8',
-                         parity='N',
-                         stopbit='1'),
-        'gnss422': dict(name='ГНСС RS-422',
-                        speed='115200',
-                        size='8',
-                        parity='N',
-                        stopbit='1'),
-        'gnss232': dict(name='ГНСС RS-232',
-                        speed='115200',
-                        size='8',
-                        parity='N',
-                        stopbit='1'),
-    }
-    net = {
-        'lan1': dict(name='lan1',
-                     label='ЛВС 1',
-                     ip='192.168.0.101',
-                     netmask='255.255.255.0',
-                     gateway='192.168.0.1',
-                     status='DOWN',
-                     mac='00:00:00:00:00:00',
-                     listen='1',
-                     speed='0'),
-        'lan2': dict(name='lan2',
-                     label='ЛВС 2',
-                     ip='192.168.0.102',
-                     netmask='255.255.255.0',
-                     gateway='192.168.0.1',
-                     status='DOWN',
-                     mac='00:00:00:00:00:00',
-                     listen='1',
-                     speed='0'),
-    }
-    config = {
-        'lifetime': 60,
-        'password': '',
-        'new_password': '',
-        'confirm_password': '',
-        'devid': '',
-        'devsn': '',
-        'devfd': '',
-        'mcufw': '',
-        'devhv': '',
-        'uptime': ['0', '0', '0', '0'],
-        'optime': ['0', '0']
-    }
-    journal = [
-        'all',
-        'gpsd',
-        'ntpd',
-    ]
-    header = {
-        'serial': '',
-        'devname': 'Часовая станция',
-    }
     mcu = {
         'pps_timeout': 5,
         'connect_timeout': 1800,
         'reset_hold': 1,
         'gps_reset': 0,
         'pps_reset': 0,
-        'mcu_reset': 0
-    }
-    pps_info = {
-        'aif_state': 0,
-        'aop_state': 0,
-        'aop_delta': '',
-        'aif_delta': 0,
-        'aif_sum': 0,
-        'dac': 0
+        'mcu_reset': 0,
+        'lcd_partial': 0,       # 1 - УПШ принимает структуру lcd_page
     }
     gps_default = dict(time='-',
                        date='-',
@@ -133,17 +83,19 @@ class Settings:
         """
         Инициализация настроек дефолтными значениями
         """
+        self.writer = SettingsWriter(SETTINGS_FILE)
+        self.store = SettingsStore(**{name: default_settings[name] for name in self.sections})
         self.update(default_settings)
 
     def read_eeprom(self):
         self.eeprom = SystemInfo(self.logger).eeprom_parsing().copy()
 
-        self.header['serial'] = self.eeprom['CarrierSerialNumber']
-        self.config['devid'] = 'БС 683'
-        self.config['devsn'] = self.eeprom['CarrierSerialNumber']
-        self.config['devfd'] = self.eeprom['CarrierDate']
-        self.config['mcufw'] = '1.0'
-        self.config['devhv'] = self.eeprom['CarrierVersion']
+        self.store.update('header', {'serial': self.eeprom['CarrierSerialNumber']})
+        self.store.update('config', {'devid': 'БС 683',
+                                     'devsn': self.eeprom['CarrierSerialNumber'],
+                                     'devfd': self.eeprom['CarrierDate'],
+                                     'mcufw': '1.0',
+                                     'devhv': self.eeprom['CarrierVersion']})
 
         self.logger.error(str(self.eeprom))
 
@@ -164,35 +116,37 @@ class Settings:
         days = '0'
         if len(delta_list) == 3:
             days = delta_list[0]
-        self.config['uptime'] = list(days) + hhmmss_list  # ['5', '18','34','21'] or ['0', '12','23','34']
+        uptime = list(days) + hhmmss_list  # ['5', '18','34','21'] or ['0', '12','23','34']
 
         optimesec = read_ini_file().get('optime') or 0
         optimesec = int(optimesec) + uptimesec
         hh = optimesec // 3600  # 452
         mm = (optimesec % 3600) // 60  # 6
-        self.config['optime'] = ['%d' % hh, '%02d' % mm]  # ['452', '06']
+        optime = ['%d' % hh, '%02d' % mm]  # ['452', '06']
 
+        self.store.update('config', {'uptime': uptime, 'optime': optime})
         return self.config
 
     def save_to_file(self, func):
         """
         Декоратор, сохраняет текущие значения настроек в файл settings.json,
-        после выполнения функции
+        после выполнения функции. Файл записывается в фоне и только при
+        изменении настроек
 
         :param func: декорируемая функция
         :return: результат выполнения функции
         """
 
+        @wraps(func)
         def wrapper(*args, **kwargs):
             result = func(*args, **kwargs)
-            obj = dict(main=deepcopy(settings.main),
-                       net=deepcopy(settings.net),
-                       config=deepcopy(settings.config),
-                       header=deepcopy(settings.header)
+            obj = dict(main=settings.main,
+                       net=settings.net,
+                       config=settings.config,
+                       header=settings.header
                        )
             try:
-                with open(linuxtools.SETTINGS_FILE, 'w') as file:
-                    json.dump(obj, file)
+                self.writer.save(obj)
             except Exception as err:
                 self.logger.error('Не удалось сохранить настройки!')
                 self.logger.debug(err)
@@ -218,7 +172,11 @@ class Settings:
         :param obj: словарь с новыми значенями
         :return: None
         """
-        self.__dict__.update(obj)
+        for key, value in obj.items():
+            if key in self.sections:
+                self.store.replace(key, value)
+            else:
+                self.__dict__[key] = value
 
     def reset(self) -> bool:
         """
@@ -229,12 +187,13 @@ class Settings:
         self.logger.error('Сброс к заводским настройкам...')
 
         # reset
-        obj = dict(main=deepcopy(default_settings['main']),
-                   config=deepcopy(default_settings['config']),
-                   header=deepcopy(default_settings['header']),
+        obj = dict(main=default_settings['main'],
+                   config=default_settings['config'],
+                   header=default_settings['header'],
                    )
-        settings.__dict__.update(obj)
+        self.update(obj)
         self.logger.debug(settings)
+        self.writer.discard()
 
         self.logger.error('Перезапуск веб-сервера...')
         if not reset_webserver_config():
@@ -253,10 +212,17 @@ class USB:
         Инициализация класса
         """
         self.logger = None
-        self.device = None
-        self.queue = Queue()
+        self.transport = make_transport(read_ini_file().get('usb_transport'))
+        self.device = None      # канал обмена, если устройство готово к работе
+        self.queue = UsbScheduler()
         self.lock = Lock()
-        self.event = Event()
+        self.event = Event()    # установлено, пока устройство готово к работе
+        # задержки повторов у каждого потока свои: поток чтения открывает
+        # устройство, поток записи только ждет его готовности
+        self.backoff = Backoff(initial=0.1, maximum=10.0)
+        self.write_backoff = Backoff(initial=0.1, maximum=10.0)
+        self.stale = None       # потерянный канал, закрывается потоком чтения
+        self.frames = FrameDiff()
         self.handle = None
 
     def init(self) -> bool:
@@ -266,50 +232,42 @@ class USB:
         :return: false - если устройство не найдено или при ошибке
         конфигурации, true - если устройство готово к работе
         """
-        self.device = usblib.core.find(idVendor=0x0483,
-                                       idProduct=0x572B,
-                                       )
-        if not self.device:
-            self.logger.error("Устройство USB не обнаружено")
-            sleep(5)
-            return False
-        self.logger.debug(self.device)
-
-        driver_list = []
-        try:
-            for interface in (0, 1, 2):
-                if self.device.is_kernel_driver_active(interface=interface):
-                    self.device.detach_kernel_driver(interface=interface)
-                    driver_list.append(interface)
-                    self.logger.debug("Деактивация USB интерфейса %s", str(interface))
-        except usblib.core.USBError as err:
-            self.logger.debug("Ошибка деактивации: %s", str(err))
-
-        try:
-            self.device.set_configuration()
-        except usblib.core.USBError as err:
-            self.logger.error("Ошибка конфигурации USB: %s", str(err))
-            usblib.util.dispose_resources(self.device)  # release usb device
-            sleep(1)
+        if self.stale is not None:
+            self.stale.close()
+            self.stale = None
+        if not self.transport.open():
+            self.backoff.wait()
             return False
+        self.device = self.transport
+        self.frames.reset()
+        self.event.set()
 
-        try:
-            for interface in driver_list:
-                self.device.attach_kernel_driver(interface=interface)
-                self.logger.debug("Активация USB интерфейса %s", str(interface))
-        except usblib.core.USBError as err:
-            self.logger.debug("Ошибка конфигурации USB: %s", str(err))
-
-        # self.get_net_cfg()
-        # self.queue.put('lan1')  # first ACK unblock logo timeout
-        # self.queue.put('lan2')
-        # self.queue.put('tz')
-        # self.queue.put('sysinfo')
-        # self.queue.put('modinfo')
-        # self.queue.put('carinfo')
         self.logger.error("Обнаружено устройство USB!")
         return True
 
+    def lost(self, err: TransportError, endpoint: int) -> None:
+        """
+        Обрабатывает ошибку обмена: при потере устройства канал помечается
+        для повторного открытия, повторные ошибки увеличивают задержку.
+        Закрывает и открывает канал только поток чтения, поток записи не
+        закрывает канал под ожидающим чтением
+
+        :param err: ошибка обмена
+        :param endpoint: конечная точка, на которой произошла ошибка
+        :return: None
+        """
+        device = self.device
+        if device is None:
+            return
+        if isinstance(err, DeviceLost) or not device.recover(endpoint):
+            self.device = None
+            self.event.clear()
+            self.stale = device
+        if endpoint == EP_IN:
+            self.backoff.wait()
+        else:
+            self.write_backoff.wait()
+
     @staticmethod
     def send_gps_mux(func):
         """
@@ -320,6 +278,7 @@ class USB:
         :return: результат выполнения функции
         """
 
+        @wraps(func)
         def wrapper(*args, **kwargs):
             result = func(*args, **kwargs)
             usb.queue.put('gps_mux')
@@ -333,6 +292,71 @@ lcd = LCD(settings=settings)
 usb = USB()
 
 
+# ресурс фонового задания по имени действия (второй элемент ключа задания):
+# действия одного ресурса выполняются последовательно. 'ntp' - ntp.conf и
+# сетевые настройки, 'gnss' - gpsd и приемник ГНСС
+job_resources = {
+    'set_sync_source': 'ntp',
+    'change_net_cfg': 'ntp',
+    'save_lan': 'ntp',
+    'save_time_settings': 'ntp',
+    'apply_lcd_params': ('ntp', 'gnss'),
+    'save_gnss': 'gnss',
+    'set_ext_sync_source': 'gnss',
+}
+
+
+def fix_data(tpv: dict) -> dict:
+    """
+    Данные местоположения и времени из отчета TPV службы gpsd
+
+    :param tpv: отчет TPV
+    :return: словарь с полями для веб страницы
+    """
+    gpsd_data = {}
+    mode = tpv.get('mode', -1)
+    gpsd_data['mode'] = mode
+
+    # gpsd не передает статус для обычного решения
+    status = tpv.get('status', 1 if mode >= 2 else 0)
+    if mode < 3:
+        status = 0
+    gpsd_data['status'] = status
+
+    if not status:
+        for idx in ('date', 'time', 'latitude', 'longitude', 'speed', 'altitude'):
+            gpsd_data[idx] = '-'
+        return gpsd_data
+
+    # date and time
+    t = tpv.get('time')
+    if isinstance(t, str):
+        utc_struct = strptime(t, '%Y-%m-%dT%X.%fZ' if '.' in t else '%Y-%m-%dT%XZ')
+        local_struct = localtime(timegm(utc_struct))
+        gpsd_data['dt'] = local_struct
+        gpsd_data['time'] = strftime('%T', local_struct)
+        gpsd_data['date'] = strftime('%d.%m.%y', local_struct)
+    else:
+        gpsd_data['date'] = '-'
+        gpsd_data['time'] = '-'
+
+    for idx, key in (('latitude', 'lat'), ('longitude', 'lon'), ('speed', 'speed'), ('altitude', 'alt')):
+        value = tpv.get(key)
+        if value is None:
+            gpsd_data[idx] = '-'
+        elif idx in ('latitude', 'longitude'):
+            minute = value % 1 * 60
+            sec = minute % 1 * 60
+            deg = "%d° %d' %d\"" % (int(value), int(minute), int(sec))
+            if idx == 'latitude':
+                gpsd_data[idx] = deg + ' N'
+            else:
+                gpsd_data[idx] = deg + ' E'
+        else:
+            gpsd_data[idx] = int(value)
+    return gpsd_data
+
+
 class Manager(object):
     """
     Класс для управления вебсервером
@@ -357,7 +381,7 @@ class Manager(object):
         :param logger: ссылка на базовый логгер
         :param args: лист с аргументами командной строки (при запуске из командной строки)
         """
-        for obj in (self, settings, usb, lcd):
+        for obj in (self, settings, settings.writer, usb, usb.frames, lcd, restarter):
             obj.logger = logger
 
         self.config_logger(args)
@@ -365,9 +389,11 @@ class Manager(object):
         usb.init()
 
         try:
-            with open(SETTINGS_FILE, 'r') as file:
-                saved_settings = json.load(file, object_hook=dict)
+            with open(SETTINGS_FILE, 'rb') as file:
+                data = file.read()
+                saved_settings = json.loads(data, object_hook=dict)
                 settings.update(saved_settings)
+                settings.writer.loaded(data)
                 self.logger.error('Загружены сохраненные настройки')
         except Exception as e:
             self.logger.error('Не удалось загрузить сохраненные настройки!')
@@ -375,6 +401,14 @@ class Manager(object):
 
         set_timezone(settings.main['tz'])
 
+        # статус ГНСС и источник синхронизации передаются в УПШ при изменении
+        settings.store.subscribe(self.on_settings_change, 'gpsd_data', 'main')
+
+        # применение настроек выполняется в фоне, результат возвращается на экран LCD
+        self.jobs = JobQueue(workers=4)
+        self.jobs.logger = logger
+        self.jobs.subscribe(self.on_job_change)
+
         # LAN init
         self.get_net_cfg()
         # get eeprom data, optime, uptime
@@ -393,12 +427,16 @@ class Manager(object):
         thread_rd.start()
         thread_wr.start()
 
-        thread_uptime = Thread(name="Thread uptime",
-                               target=self.uptime_worker,
-                               daemon=True,
-                               )
-        thread_uptime.start()
+        # периодические задания выполняются в одном потоке планировщика,
+        # блокирующие (time, uptime, sources) - в одном потоке пула
+        self.scheduler = Scheduler(workers=1)
+        self.scheduler.logger = logger
+        self.scheduler.every('uptime', 3600, self.update_uptime, offload=True, delay=3600)
 
+        # структура времени передается на границах секунд отдельным потоком:
+        # запись USB под блокировкой не задерживает задания планировщика
+        self.ticker = SecondTicker()
+        self.timing = TimingRing()
         thread_tz = Thread(name="Thread send TZ",
                            target=self.tz_worker,
                            daemon=True,
@@ -422,17 +460,66 @@ class Manager(object):
         usb.queue.put('get')
 
     @staticmethod
-    def uptime_worker() -> None:
+    def on_settings_change(section: str, old, new, version: int) -> None:
         """
-        Поток, каждые timeout секунд копирует в рабочую директорию файл /proc/uptime
+        Обработчик изменения настроек, ставит в очередь УПШ структуру статуса
+        при изменении статуса ГНСС или источника синхронизации
 
+        :param section: имя раздела настроек
+        :param old: старое значение раздела
+        :param new: новое значение раздела
+        :param version: версия хранилища настроек
         :return: None
         """
-        event = Event()
-        while True:
-            event.wait(timeout=3600)
-            run_cmd("cp /proc/uptime %s/uptime" % WORKING_DIR)
-            settings.get_config()   # read and save uptime, optime to settings.config
+        key = 'status' if section == 'gpsd_data' else 'sync_src'
+        if old is None or old.get(key) != new.get(key):
+            usb.queue.put('status')
+
+    def submit(self, key: tuple, func, *args, resource=None):
+        """
+        Ставит действие в очередь фоновых заданий. Действия, изменяющие
+        одни и те же файлы и службы, выполняются последовательно
+
+        :param key: ключ задания, первый элемент - источник ('lcd', 'web'),
+        второй - имя действия или экрана
+        :param func: функция действия
+        :param args: аргументы функции
+        :param resource: ресурс задания, по умолчанию - по имени действия из job_resources
+        :return: задание
+        """
+        if resource is None:
+            resource = job_resources.get(key[1], 'ntp')
+        return self.jobs.submit(key, func, args, resource=resource)
+
+    def on_job_change(self, job) -> None:
+        """
+        Обработчик изменения состояния задания, по завершении применения
+        параметров экрана LCD обновляет экран. Ошибка применения отмечается
+        на экране инверсией нижней строки на время lcd_error_show
+
+        :param job: задание
+        :return: None
+        """
+        if job.key[0] != 'lcd' or job.state not in ('done', 'error'):
+            return
+        message = job.error or job.result
+        if message:
+            self.logger.error('Экран %s: %s', job.key[1], message)
+        if job.error is not None or str(message or '').startswith('Ошибка'):
+            self.lcd_error_until = time.time() + self.lcd_error_show
+            # обновление экрана после снятия отметки
+            self.scheduler.call(self.scheduler.loop.call_later, self.lcd_error_show, usb.queue.put, 'lcd')
+        usb.queue.put('lcd')
+
+    @staticmethod
+    def update_uptime() -> None:
+        """
+        Задание планировщика, раз в час копирует в рабочую директорию файл /proc/uptime
+
+        :return: None
+        """
+        run_cmd(['cp', '/proc/uptime', '%s/uptime' % WORKING_DIR])
+        settings.get_config()   # read and save uptime, optime to settings.config
 
     def config_logger(self, argv: list) -> None:
         """
@@ -476,28 +563,31 @@ class Manager(object):
 
         dev_id = settings.net[lan]['name']
 
+        report('Запись настроек %s' % settings.net[lan]['label'])
         if not add_network(dev_id, ip, netmask, gateway):
             return 'Ошибка создания сетевого интерфейса!'
 
         self.logger.debug('Изменен файл %s.network' % dev_id)
-        settings.net[lan]['ip'] = ip
-        settings.net[lan]['netmask'] = netmask
-        settings.net[lan]['gateway'] = gateway
-        run_cmd('systemctl restart systemd-networkd')
+        settings.store.update('net', {lan: dict(ip=ip, netmask=netmask, gateway=gateway)})
+        restarter.request('systemd-networkd')
         # TODO: add checking systemd-networkd status
-        sleep(0.3)
 
         # TODO: add option: don't change listen ntp
         if listen is None:
             listen = settings.net[lan]['listen']
 
-        if add_listen_ntp(lan=lan,
-                          listen=listen,
-                          ip=ip,
-                          sync_src=settings.main['sync_src'],
-                          gnss_synced=self.gnss_synced):
-            settings.net[lan]['listen'] = listen
-            self.logger.debug(systemctl('restart', 'ntp'))
+        report('Настройка службы времени на %s' % settings.net[lan]['label'])
+        with NtpConf() as conf:
+            applied = add_listen_ntp(lan=lan,
+                                     listen=listen,
+                                     ip=ip,
+                                     sync_src=settings.main['sync_src'],
+                                     gnss_synced=self.gnss_synced,
+                                     conf=conf) and (conf.commit() or conf.ok)
+        if applied:
+            settings.store.update('net', {lan: dict(listen=listen)})
+            if conf.written:
+                restarter.request('ntp')
             if listen == '1':
                 self.logger.error(
                     'Разрешена работа службы времени на сетевом интерфейсе %s' % settings.net[lan]['label'])
@@ -519,33 +609,46 @@ class Manager(object):
         :param lans: кортеж с именами сетевых интерфейсов
         :return: словарь с настройками сети для всех интерфейсов
         """
-        for lan in lans:
-            try:
-                ip, netmask, gateway, mac, status, speed = get_network(device=settings.net[lan]['name'])
+        networks = get_networks(tuple(settings.net[lan]['name'] for lan in lans))
+        # до перезапуска systemd-networkd ядро сообщает прежние адреса:
+        # адреса берутся из настроек, из системы - только состояние интерфейсов
+        configured = 'systemd-networkd' in restarter.pending()
+        missing = []
+        with NtpConf() as conf:
+            for lan in lans:
+                try:
+                    ip, netmask, gateway, mac, status, speed = networks[settings.net[lan]['name']]
+                except TypeError:
+                    missing.append(lan)
+                    continue
+                if configured:
+                    ip, netmask, gateway = (settings.net[lan][key] for key in ('ip', 'netmask', 'gateway'))
                 add_listen_ntp(lan=lan,
                                listen=settings.net[lan]['listen'],
                                ip=ip,
                                sync_src=settings.main['sync_src'],
-                               gnss_synced=self.gnss_synced)
-            except TypeError:
-                self.logger.error('Ошибка: устройство %s не обнаружено' % settings.net[lan]['label'])
-                self.logger.error('Загружена дефолтная конфигурация %s' % settings.net[lan]['label'])
-                self.logger.debug('Загружены дефолтные настройки: ', default_settings['net'][lan])
-                self.change_net_cfg(lan,
-                                    default_settings['net'][lan]['ip'],
-                                    default_settings['net'][lan]['netmask'],
-                                    default_settings['net'][lan]['gateway'],
-                                    default_settings['net'][lan]['listen']
-                                    )
-                continue
-
-            settings.net[lan]['ip'] = ip
-            settings.net[lan]['netmask'] = netmask
-            settings.net[lan]['gateway'] = gateway
-            settings.net[lan]['mac'] = mac
-            settings.net[lan]['status'] = status
-            settings.net[lan]['speed'] = speed
-
+                               gnss_synced=self.gnss_synced,
+                               conf=conf)
+                settings.store.update('net', {lan: dict(ip=ip,
+                                                        netmask=netmask,
+                                                        gateway=gateway,
+                                                        mac=mac,
+                                                        status=status,
+                                                        speed=speed)})
+        if conf.written:
+            restarter.request('ntp')
+
+        # дефолтная конфигурация записывается отдельной транзакцией ntp.conf
+        for lan in missing:
+            self.logger.error('Ошибка: устройство %s не обнаружено' % settings.net[lan]['label'])
+            self.logger.error('Загружена дефолтная конфигурация %s' % settings.net[lan]['label'])
+            self.logger.debug('Загружены дефолтные настройки: ', default_settings['net'][lan])
+            self.change_net_cfg(lan,
+                                default_settings['net'][lan]['ip'],
+                                default_settings['net'][lan]['netmask'],
+                                default_settings['net'][lan]['gateway'],
+                                default_settings['net'][lan]['listen']
+                                )
         self.logger.debug(settings.net)
         return settings.net
 
@@ -559,9 +662,9 @@ class Manager(object):
         """
         ltime = localtime()
         tz = int(strftime("%z", ltime)[:-2])
-        settings.main['tz'] = '%+d' % tz
-        settings.main['date'] = strftime("%Y-%m-%d", ltime)
-        settings.main['time'] = strftime("%T", ltime)
+        settings.store.update('main', {'tz': '%+d' % tz,
+                                       'date': strftime("%Y-%m-%d", ltime),
+                                       'time': strftime("%T", ltime)})
         return settings.main
 
     def save_time(self, date: str, time: str):
@@ -573,7 +676,7 @@ class Manager(object):
         :return: сообщение об успешности изменения
         """
         if settings.main['sync_src'] == str(GNSS_SRC_NONE) and date and time:
-            cmdout = run_cmd(command='timedatectl set-time "%s %s"' % (date, time))
+            cmdout = run_cmd(command=['timedatectl', 'set-time', '%s %s' % (date, time)])
             if cmdout == '':
                 msg = "Установлены дата и время: %s %s" % (date, time)
             else:
@@ -601,12 +704,10 @@ class Manager(object):
         """
         if timejump:
             seconds = str(int(timejump) * 60)
-            if do_with_file(path='/etc/ntp.conf',
-                            action='replace',
-                            labels=['tinker panic'],
-                            inserts=[seconds],
-                            positions=[2]):
-                settings.main['timejump'] = timejump
+            with NtpConf() as conf:
+                applied = conf.set_tinker_panic(seconds) and (conf.commit() or conf.ok)
+            if applied:
+                settings.store.update('main', {'timejump': timejump})
                 self.logger.error("Установлена макс. перестройка времени %s мин." % timejump)
             else:
                 self.logger.error("Ошибка: макс. перестройка времени не установлена!")
@@ -614,8 +715,7 @@ class Manager(object):
         if tz is None or tz_kv is None or tz_rs is None:
             return "Ошибка настройки часовых поясов!"
 
-        settings.main['tz_kv'] = tz_kv
-        settings.main['tz_rs'] = tz_rs
+        settings.store.update('main', {'tz_kv': tz_kv, 'tz_rs': tz_rs})
 
         result = set_timezone(tz)
         if result == '':
@@ -648,17 +748,20 @@ class Manager(object):
         :return: сообщение об успешности изменения
         """
         if source in ('internal', 'gnss232', 'gnss422'):
+            report('Выбор источника внешней синхронизации')
             self.set_ext_sync_source(source)
         else:
             return 'Ошибка выбора источника внешней синхронизации!'
 
         if new_speed != settings.main[source]['speed']:
+            report('Изменение скорости приемника ГНСС')
             new_speed = nmea.set_speed(device='/dev/ttyS1',
                                        speed=settings.main[source]['speed'],
                                        new_speed=new_speed)
             if new_speed:
-                settings.main[source]['speed'] = new_speed
+                settings.store.update('main', {source: {'speed': new_speed}})
 
+        report('Настройка системы ГНСС')
         sat_sys_changed = self.set_sat_system(device='/dev/ttyS1',
                                               speed=settings.main[source]['speed'],
                                               system=sat_system,
@@ -669,7 +772,6 @@ class Manager(object):
         else:
             return 'Ошибка настройки ГНСС!'
 
-    @restart_ntp
     def set_sync_source(self, sync_src: str):
         """
         Изменяет источник синхронизации в настройках, вызывает функцию конфигурации службы ntp
@@ -678,26 +780,34 @@ class Manager(object):
         :return: сообщение об успешности изменения
         """
         if sync_src in ('0', '1'):
-            source = ntp_config(sync=int(sync_src))
-            if source is None:
-                msg = "Ошибка! Источник синхронизации не изменен"
-            else:
-                msg = "Выбран источник синхронизации: %s" % source
-                settings.main['sync_src'] = sync_src
-
-                # если синхронизации со спутником еще не было, то при переключении
-                # источника синхронизации на внешний - отключаем раздачу времени
-                if not self.gnss_synced:
-                    for lan in ('lan1', 'lan2'):
-                        add_listen_ntp(lan,
-                                       listen=settings.net[lan]['listen'],
-                                       ip=settings.net[lan]['ip'],
-                                       sync_src=settings.main['sync_src'],
-                                       gnss_synced=self.gnss_synced)
-
-                # TODO: при переключении на внешний источник установить время спутника
-                if sync_src == '1' and settings.gpsd_data.get('dt') and settings.gpsd_data.get('dt') != '-':
-                    clock_settime(CLOCK_REALTIME, mktime(settings.gpsd_data['dt']))
+            with NtpConf() as conf:
+                source = ntp_config(sync=int(sync_src), conf=conf)
+                if source is None:
+                    msg = "Ошибка! Источник синхронизации не изменен"
+                else:
+                    msg = "Выбран источник синхронизации: %s" % source
+                    settings.store.update('main', {'sync_src': sync_src})
+
+                    # если синхронизации со спутником еще не было, то при переключении
+                    # источника синхронизации на внешний - отключаем раздачу времени
+                    if not self.gnss_synced:
+                        for lan in ('lan1', 'lan2'):
+                            add_listen_ntp(lan,
+                                           listen=settings.net[lan]['listen'],
+                                           ip=settings.net[lan]['ip'],
+                                           sync_src=settings.main['sync_src'],
+                                           gnss_synced=self.gnss_synced,
+                                           conf=conf)
+
+                    # TODO: при переключении на внешний источник установить время спутника
+                    if sync_src == '1' and settings.gpsd_data.get('dt') and settings.gpsd_data.get('dt') != '-':
+                        clock_settime(CLOCK_REALTIME, mktime(settings.gpsd_data['dt']))
+
+                # все изменения ntp.conf записываются одной операцией,
+                # без изменений перезапуск ntp не требуется
+                written = conf.commit()
+            if written:
+                restarter.request('ntp')
             return msg
         return None
 
@@ -713,7 +823,7 @@ class Manager(object):
         """
         if source:
             msg = "Выбран источник внешней синхронизации: %s" % settings.main[source]['name']
-            settings.main['ext_sync_src'] = source
+            settings.store.update('main', {'ext_sync_src': source})
             # TODO: init sat
         else:
             msg = "Ошибка! Источник внешней синхронизации не изменен"
@@ -743,10 +853,10 @@ class Manager(object):
         if selected_speed:
             source = settings.main['ext_sync_src']
             if selected_speed != settings.main[source]['speed']:
-                settings.main[source]['speed'] = selected_speed
+                settings.store.update('main', {source: {'speed': selected_speed}})
 
         if sat_system:
-            settings.main['sat_system'] = sat_system
+            settings.store.update('main', {'sat_system': sat_system})
 
             self.logger.error("Выбор навигационной системы: %s" % nmea.mode[sat_system])
             return True
@@ -767,7 +877,7 @@ class Manager(object):
         except ValueError:
             return "Ошибка ввода таймаута бездействия: %s" % lifetime
         else:
-            settings.config['lifetime'] = lifetime
+            settings.store.update('config', {'lifetime': lifetime})
             return "Таймаут бездействия равен %s мин." % lifetime
 
     @settings.save_to_file
@@ -779,7 +889,7 @@ class Manager(object):
         :return: сообщение об успешности изменения
         """
         if devname:
-            settings.header['devname'] = devname
+            settings.store.update('header', {'devname': devname})
             return "Название изменено на: %s" % devname
         return None
 
@@ -791,39 +901,26 @@ class Manager(object):
         :return: None
         """
         while True:
-            if not usb.device:
+            device = usb.device
+            if not device:
                 usb.init()
                 continue
             try:
-                # print('READ: ', perf_counter())
-                packet = usb.device.read(endpoint=0x81,
-                                         size_or_buffer=64,
-                                         timeout=100)
-                # print('STOP: ', perf_counter(), '\n')
-                self.logger.debug("READ: %s", str(packet))
+                # таймаут чтения только для проверки потери канала потоком записи
+                packet = device.read(size=64, timeout=READ_TIMEOUT)
+            except TransportTimeout:
+                continue
+            except TransportError as err:
+                self.logger.error("Ошибка чтения USB: %s", str(err))
+                usb.lost(err, EP_IN)
+                continue
+            usb.backoff.reset()
+            try:
+                self.logger.debug("READ: %s", packet)
                 responses = self.unpacking(packet)
                 if responses:
                     for response in responses:
                         usb.queue.put(response)
-            except usblib.core.USBTimeoutError as err:
-                # data not found
-                self.logger.debug("RD timeout")
-            except usblib.core.USBError as err:
-                self.logger.error("Ошибка чтения USB: %s", str(err))
-
-                if '[Errno 19] No such device' in str(err):
-                    usb.device = None
-                else:
-                    try:
-                        status = usblib.control.get_status(usb.device, usb.device[0][0, 0][0])
-                        if status:
-                            usblib.control.clear_feature(usb.device, 0, recipient=0x81)
-                        else:
-                            usb.device = None
-                    except Exception as err:
-                        self.logger.error("Ошибка clear_feature USB: %s", str(err))
-
-                sleep(5)
             except Exception as err:
                 self.logger.debug('USB reader error: %s', str(err))
 
@@ -835,60 +932,102 @@ class Manager(object):
         :return: None
         """
         while True:
-            if not usb.device:
-                usb.init()
-                continue
+            # подключение выполняет поток чтения
+            usb.event.wait()
 
             response = usb.queue.get()
             if not response:
                 continue
 
             name = response
-            if name not in self.pack_fmt:
+            if name not in outbound:
                 usb.queue.task_done()
                 continue
 
             self.logger.debug("SEND: %s", response)
-            packet = self.packing(name=response)
-            if packet is not None:
-                try:
-                    usb.device.write(1, packet)
-                    # if response == 'get':
-                    #     print('send: ', packet)
-                except usblib.core.USBTimeoutError as err:
-                    self.logger.debug('SEND timeout')
-                except usblib.core.USBError as err:
-                    self.logger.error("Ошибка записи USB: %s", str(err))
-
-                    if '[Errno 19] No such device' in str(err):
-                        usb.device = None
-                    else:
-                        try:
-                            status = usblib.control.get_status(usb.device, usb.device[0][0, 0][1])
-                            if status:
-                                usblib.control.clear_feature(usb.device, 0, recipient=0x1)
-                            else:
-                                usb.device = None
-                        except Exception as err:
-                            self.logger.error("Ошибка clear_feature USB: %s", str(err))
-
-                    sleep(5)
-                except Exception as err:
-                    self.logger.debug('USB writer error: %s', str(err))
+            self.send(name)
             usb.queue.task_done()  # queue feature to finish .get()
 
-    # output data struct
-    pack_fmt = OrderedDict()
-    pack_fmt['void'] = ('<H', 0)
-    pack_fmt['get'] = ('<HH', 1)
-    pack_fmt['time'] = ('<HQQQQ', 2)
-    pack_fmt['status'] = ('<HBB', 3)
-    pack_fmt['gps_mux'] = ('<HB', 4)
-    pack_fmt['gps_wdog'] = ('<HLLL', 5)
-    pack_fmt['reset'] = ('<HBBB', 6)
-    pack_fmt['lcd'] = ("<H488s", 7)
+    def send(self, name: str, times: list = None) -> bool:
+        """
+        Формирует пакет и передает его в УПШ
+
+        :param name: имя структуры
+        :param times: лист, в который добавляется время начала передачи
+        и время завершения записи в УПШ
+        :return: true - пакет передан
+        """
+        device = usb.device
+        if not device:
+            return False
+        try:
+            if name in ('lcd', 'lcd_page'):
+                return self.send_lcd(device)
+            # пакет формируется до захвата блокировки: формирование не
+            # задерживает передачу структуры времени другим потоком
+            packet = self.packing(name=name)
+            if packet is None:
+                return False
+            with usb.lock:
+                if times is not None:
+                    times.append(time.time())
+                device.write(packet)
+                if times is not None:
+                    times.append(time.time())
+            usb.write_backoff.reset()
+            return True
+        except TransportTimeout as err:
+            self.logger.debug('SEND timeout')
+        except TransportError as err:
+            self.logger.error("Ошибка записи USB: %s", str(err))
+            usb.lost(err, EP_OUT)
+        except Exception as err:
+            self.logger.debug('USB writer error: %s', str(err))
+        return False
+
+    def send_lcd(self, device) -> bool:
+        """
+        Передает в УПШ кадр LCD, если он отличается от последнего переданного.
+        При включенном mcu['lcd_partial'] передаются только измененные страницы
+
+        :param device: канал обмена
+        :return: true - кадр передан
+        """
+        # отрисовка и сравнение кадра - до захвата usb.lock, под блокировкой
+        # только запись: кадр LCD не задерживает передачу структуры времени
+        frame = self.render_screen()
+        dirty = usb.frames.diff(frame)
+        if not dirty:
+            return False
+        partial = bool(settings.mcu.get('lcd_partial')) and len(dirty) < usb.frames.pages
+        if partial:
+            page = outbound['lcd_page']
+            packets = [page.pack(index, usb.frames.page(frame, index)) for index in dirty]
+        else:
+            packets = [outbound['lcd'].pack(frame)]
+        with usb.lock:
+            for packet in packets:
+                device.write(packet)
+            usb.frames.commit(frame, sum(len(packet) for packet in packets), partial)
+        return True
+
+    def render_screen(self) -> bytes:
+        """
+        Кадр текущего экрана LCD. После ошибки применения параметров нижняя
+        строка выводится инверсно
+
+        :return: кадр
+        """
+        now = time.time()
+        frame = bytes(lcd.show_screen())
+        if now < self.lcd_error_until:
+            start = (LCD_PAGES - 1) * LCD_PAGE_SIZE
+            frame = frame[:start] + bytes(0xFF ^ byte for byte in frame[start:])
+        return frame
 
     get_n_struct = 0
+    lcd_error_until = 0.0       # время снятия отметки ошибки на экране LCD
+    lcd_error_show = 3.0        # длительность отметки ошибки, с
 
     def packing(self, name: str = 'void') -> bytes:
         """
@@ -897,71 +1036,75 @@ class Manager(object):
         :param name: лист с id передаваемой структуры
         :return: пакет в формате bytes
         """
-        if name == 'void':
-            return pack(self.pack_fmt[name][0], self.pack_fmt[name][1])
-
-        elif name == 'get':
-            return pack(self.pack_fmt[name][0], self.pack_fmt[name][1],
-                        self.get_n_struct)
-
-        elif name == 'time':
-            tz = int(settings.main['tz'])
-            tz_kv = int(settings.main['tz_kv'])
-            tz_rs = int(settings.main['tz_rs'])
-            # utc = timegm(gmtime())
-            utc = round(time.time())
-            # print(strftime("%T", localtime()))
-            # self.logger.debug("PACKING time: %d %d %d %d",
-            #                   utc, utc + tz * 3600, utc + tz_kv * 3600, utc + tz_rs * 3600)
-            return pack(self.pack_fmt[name][0], self.pack_fmt[name][1],
-                        utc,
-                        utc + tz * 3600,
-                        utc + tz_kv * 3600,
-                        utc + tz_rs * 3600)
-
-        elif name == 'status':
-            gnss_status = settings.gpsd_data.get('status')  # NMEA: 'V' = 0, 'A' = 1, 'D' = 2
-            if gnss_status not in (-1, 0, 1, 2):
-                gnss_status = -1
-            gnss_status += 1                        # USB : NONE = 0 'V' = 1, 'A' = 2
-            if gnss_status > 2:
-                gnss_status = 2
-
-            # print(gnss_status)
-            ntp_mode = int(settings.main['sync_src'])   # PC:           LOCAL = 0, GNSS = 1
-            ntp_mode += 1                               # USB: NONE = 0, LOCAL = 1, GNSS = 2
-            self.logger.debug("PACKING status: %d", gnss_status)
-            return pack(self.pack_fmt[name][0], self.pack_fmt[name][1],
-                        gnss_status, ntp_mode)
-
-        elif name == 'gps_mux':
-            source = GNSS_SRC_NONE
-            if settings.main['sync_src'] != GNSS_SRC_NONE:
-                if settings.main['ext_sync_src'] == 'internal':
-                    source = GNSS_SRC_INTERNAL
-                elif settings.main['ext_sync_src'] == 'gnss232':
-                    source = GNSS_SRC_EXT_RS232
-                elif settings.main['ext_sync_src'] == 'gnss422':
-                    source = GNSS_SRC_EXT_RS422
-            self.logger.debug("PACKING gps_mux: %d", source)
-            return pack(self.pack_fmt[name][0], self.pack_fmt[name][1],
-                        source)
-
-        elif name == 'gps_wdog':
-            return pack(self.pack_fmt[name][0], self.pack_fmt[name][1],
-                        settings.mcu['pps_timeout'],
-                        settings.mcu['connect_timeout'],
-                        settings.mcu['reset_hold'])
-
-        elif name == 'reset':
-            return pack(self.pack_fmt[name][0], self.pack_fmt[name][1],
-                        settings.mcu['gps_reset'],
-                        settings.mcu['pps_reset'],
-                        settings.mcu['mcu_reset'])
-
-        elif name == 'lcd':
-            return pack(self.pack_fmt[name][0], self.pack_fmt[name][1],
-                        lcd.show_screen())
+        message = outbound.by_name.get(name)
+        if message is None or message.handler is None:
+            return None
+        return message.pack(*message.handler(self))
+
+    @outbound.handler('void')
+    def pack_void(self) -> tuple:
+        return ()
+
+    @outbound.handler('get')
+    def pack_get(self) -> tuple:
+        return self.get_n_struct,
+
+    @outbound.handler('time')
+    def pack_time(self) -> tuple:
+        main = settings.main
+        tz = int(main['tz'])
+        tz_kv = int(main['tz_kv'])
+        tz_rs = int(main['tz_rs'])
+        # utc = timegm(gmtime())
+        utc = round(time.time())
+        return (utc,
+                utc + tz * 3600,
+                utc + tz_kv * 3600,
+                utc + tz_rs * 3600)
+
+    @outbound.handler('status')
+    def pack_status(self) -> tuple:
+        gnss_status = settings.gpsd_data.get('status')  # NMEA: 'V' = 0, 'A' = 1, 'D' = 2
+        if gnss_status not in (-1, 0, 1, 2):
+            gnss_status = -1
+        gnss_status += 1                        # USB : NONE = 0 'V' = 1, 'A' = 2
+        if gnss_status > 2:
+            gnss_status = 2
+
+        ntp_mode = int(settings.main['sync_src'])   # PC:           LOCAL = 0, GNSS = 1
+        ntp_mode += 1                               # USB: NONE = 0, LOCAL = 1, GNSS = 2
+        self.logger.debug("PACKING status: %d", gnss_status)
+        return gnss_status, ntp_mode
+
+    @outbound.handler('gps_mux')
+    def pack_gps_mux(self) -> tuple:
+        main = settings.main
+        source = GNSS_SRC_NONE
+        if main['sync_src'] != GNSS_SRC_NONE:
+            if main['ext_sync_src'] == 'internal':
+                source = GNSS_SRC_INTERNAL
+            elif main['ext_sync_src'] == 'gnss232':
+                source = GNSS_SRC_EXT_RS232
+            elif main['ext_sync_src'] == 'gnss422':
+                source = GNSS_SRC_EXT_RS422
+        self.logger.debug("PACKING gps_mux: %d", source)
+        return source,
+
+    @outbound.handler('gps_wdog')
+    def pack_gps_wdog(self) -> tuple:
+        return (settings.mcu['pps_timeout'],
+                settings.mcu['connect_timeout'],
+                settings.mcu['reset_hold'])
+
+    @outbound.handler('reset')
+    def pack_reset(self) -> tuple:
+        return (settings.mcu['gps_reset'],
+                settings.mcu['pps_reset'],
+                settings.mcu['mcu_reset'])
+
+    @outbound.handler('lcd')
+    def pack_lcd(self) -> tuple:
+        return self.render_screen(),
 
     def unpacking(self, packet):
         """
@@ -971,151 +1114,278 @@ class Manager(object):
         :return: лист с id ответной структуры
         """
         try:
-            idx = list(packet)[0]
+            message = inbound.by_id.get(packet[0])
         except Exception as err:
             return ['']
 
-        response = []
-        if idx == 0:
-            return ['void']
-        elif idx == 1:
-            command, n_struct = list(unpack("<HH", packet))
-            self.logger.debug("UNPACKING get: %s", list(self.pack_fmt)[n_struct])
-            return [list(self.pack_fmt)[n_struct]]
-
-        elif idx == 2:
-            command, aif_state, aop_state, aop_delta, aif_delta, aif_sum, dac = list(unpack("<HiiiiQH", packet))
-            self.logger.error("UNPACKING pps_info: %d %d %d %d %d %d",
-                              aif_state, aop_state, aop_delta, aif_delta, aif_sum, dac)
-            settings.pps_info['aif_state'] = aif_state
-            settings.pps_info['aop_state'] = aop_state
-            settings.pps_info['aop_delta'] = aop_delta
-            settings.pps_info['aif_delta'] = aif_delta
-            settings.pps_info['aif_sum'] = aif_sum
-            settings.pps_info['dac'] = dac
-            return ['']
+        if message is None:
+            return ['err']
+        return message.handler(self, *message.unpack(packet))
 
-        elif idx == 3:
-            command, rising, falling, pressed, clamping, timers = list(unpack("<HHHHHH", packet))
-            self.logger.debug("UNPACKING buttons_info: %d %d %d %d %d\n",
-                              rising, falling, pressed, clamping, timers)
-            changes = lcd.change_screen(rising, falling, clamping, timers)
-
-            params = lcd.get_unsaved_params()
-            if params:
-                print('GET UNSAVED PARAMS')
-                label = lcd.get_screen_label()
-
-                if label == 'Дата и время':
-                    dt = datetime.strptime('-'.join(params[0] + params[1]), '%H-%M-%S-%d-%m-%y')
-                    msg = self.save_time(date=dt.strftime("%Y-%m-%d"), time=dt.strftime("%T"))
-                    print(msg)
-
-                elif label == 'Часовые пояса':
-                    # tz = '%+d' % int(params[0][0])
-                    # tz_kv = '%+d' % int(params[1][0])
-                    # tz_rs = '%+d' % int(params[2][0])
-                    tz, tz_kv, tz_rs = ['%+d' % int(p[0]) for p in params]
-                    msg = self.save_time_settings(None, tz, tz_kv, tz_rs)
-                    print(msg)
-
-                elif label == settings.net['lan1']['label'] or label == settings.net['lan2']['label']:
-                    lan = 'lan1' if label == settings.net['lan1']['label'] else 'lan2'
-                    print(params)
-                    ip, sn, gw, _, (ntp,) = params
-                    listen = '1' if ntp == CP_YES else '0'
-                    err_msg = self.change_net_cfg(lan=lan,
-                                                  ip='.'.join(ip),
-                                                  netmask='.'.join(sn),
-                                                  gateway='.'.join(gw),
-                                                  listen=listen,
-                                                  )
-                    if err_msg:
-                        self.logger.error(err_msg)
-
-                elif label == 'Синхронизация':
-                    sync_src, ext_sync_src, sat_system = [p[0] for p in params]
-                    # sync_src = params[0][0]
-                    if sync_src != settings.main['sync_src']:
-                        msg = self.set_sync_source(sync_src)
-                        if msg:
-                            self.logger.error(msg)
-
-                    # ext_sync_src = params[1][0]
-                    if ext_sync_src != settings.main['ext_sync_src']:
-                        msg = self.set_ext_sync_source(ext_sync_src)
-                        self.logger.error(msg)
-
-                    # sat_system = params[2][0]
-                    if sat_system != settings.main['sat_system']:
-                        source = settings.main['ext_sync_src']
-                        self.set_sat_system(device='/dev/ttyS1',
-                                            system=sat_system,
-                                            speed=settings.main[source]['speed'],
-                                            reciever=settings.main['reciever'])
-
-                elif label == 'Обслуживание':
-                    reset, reboot, poweroff = [p[0] for p in params]
-                    # TODO: включить сброс, перезагрузку и выключение
-                    if reset:
-                        self.logger.error('Перезапуск веб-сервера...')
-                        print('РАСКОММЕНТИРОВАТЬ СБРОС!')
-                        # reset_webserver_config()
-
-                    if reboot:
-                        print('РАСКОММЕНТИРОВАТЬ РЕБУТ!')
-                        self.logger.error('Перезагрузка...')
-                        # run_cmd('reboot')
-
-                    if poweroff:
-                        print('РАСКОММЕНТИРОВАТЬ ВЫКЛ!')
-                        self.logger.error('Выключение...')
-                        # run_cmd('poweroff')
-
-            if not changes:
-                return None
-            else:
-                return ['lcd']
-
-        elif idx == 4:
-            command, model, _range, date, mods = list(unpack("<H16s16s16s2s", packet))
-            self.logger.error("UNPACKING version: %s %s %s %s",
-                              model.decode().rstrip('\x00'),
-                              _range.decode().rstrip('\x00'),
-                              date.decode().rstrip('\x00'),
-                              mods.decode().rstrip('\x00'))
-            return ['']
+    @inbound.handler('void')
+    def unpack_void(self) -> list:
+        return ['void']
 
-        else:
+    @inbound.handler('get')
+    def unpack_get(self, n_struct: int) -> list:
+        message = outbound.by_id.get(n_struct)
+        if message is None:
             return ['err']
+        if message.name == 'lcd':
+            # УПШ запрашивает кадр целиком, например после сброса
+            usb.frames.reset()
+        self.logger.debug("UNPACKING get: %s", message.name)
+        return [message.name]
+
+    @inbound.handler('pps_info')
+    def unpack_pps_info(self, aif_state, aop_state, aop_delta, aif_delta, aif_sum, dac) -> list:
+        self.logger.error("UNPACKING pps_info: %d %d %d %d %d %d",
+                          aif_state, aop_state, aop_delta, aif_delta, aif_sum, dac)
+        settings.store.update('pps_info', dict(aif_state=aif_state,
+                                               aop_state=aop_state,
+                                               aop_delta=aop_delta,
+                                               aif_delta=aif_delta,
+                                               aif_sum=aif_sum,
+                                               dac=dac))
+        return ['']
+
+    @inbound.handler('buttons')
+    def unpack_buttons(self, rising, falling, pressed, clamping, timers):
+        self.logger.debug("UNPACKING buttons_info: %d %d %d %d %d\n",
+                          rising, falling, pressed, clamping, timers)
+        record_buttons(rising, falling, clamping, timers)
+        changes = lcd.change_screen(rising, falling, clamping, timers)
+
+        params = lcd.get_unsaved_params()
+        if params:
+            print('GET UNSAVED PARAMS')
+            # применение выполняется в фоне, чтобы не прерывать прием пакетов УПШ
+            label = lcd.get_screen_label()
+            self.submit(('lcd', label), self.apply_lcd_params, label, params,
+                        resource=job_resources['apply_lcd_params'])
+
+        if not changes:
+            return None
+        else:
+            return ['lcd']
+
+    def apply_lcd_params(self, label: str, params: list) -> str:
+        """
+        Применяет параметры, введенные на экране LCD
+
+        :param label: заголовок экрана
+        :param params: лист значений полей экрана
+        :return: сообщение о результате
+        """
+        msg = None
+        report('Применение параметров экрана %s' % label)
+        if label == 'Дата и время':
+            dt = datetime.strptime('-'.join(params[0] + params[1]), '%H-%M-%S-%d-%m-%y')
+            msg = self.save_time(date=dt.strftime("%Y-%m-%d"), time=dt.strftime("%T"))
+            print(msg)
+
+        elif label == 'Часовые пояса':
+            # tz = '%+d' % int(params[0][0])
+            # tz_kv = '%+d' % int(params[1][0])
+            # tz_rs = '%+d' % int(params[2][0])
+            tz, tz_kv, tz_rs = ['%+d' % int(p[0]) for p in params]
+            msg = self.save_time_settings(None, tz, tz_kv, tz_rs)
+            print(msg)
+
+        elif label == settings.net['lan1']['label'] or label == settings.net['lan2']['label']:
+            lan = 'lan1' if label == settings.net['lan1']['label'] else 'lan2'
+            print(params)
+            ip, sn, gw, _, (ntp,) = params
+            listen = '1' if ntp == CP_YES else '0'
+            err_msg = self.change_net_cfg(lan=lan,
+                                          ip='.'.join(ip),
+                                          netmask='.'.join(sn),
+                                          gateway='.'.join(gw),
+                                          listen=listen,
+                                          )
+            if err_msg:
+                self.logger.error(err_msg)
+            msg = err_msg
+
+        elif label == 'Синхронизация':
+            sync_src, ext_sync_src, sat_system = [p[0] for p in params]
+            # sync_src = params[0][0]
+            if sync_src != settings.main['sync_src']:
+                msg = self.set_sync_source(sync_src)
+                if msg:
+                    self.logger.error(msg)
+
+            # ext_sync_src = params[1][0]
+            if ext_sync_src != settings.main['ext_sync_src']:
+                report('Выбор источника внешней синхронизации')
+                msg = self.set_ext_sync_source(ext_sync_src)
+                self.logger.error(msg)
+
+            # sat_system = params[2][0]
+            if sat_system != settings.main['sat_system']:
+                source = settings.main['ext_sync_src']
+                report('Настройка системы ГНСС')
+                self.set_sat_system(device='/dev/ttyS1',
+                                    system=sat_system,
+                                    speed=settings.main[source]['speed'],
+                                    reciever=settings.main['reciever'])
+
+        elif label == 'Обслуживание':
+            reset, reboot, poweroff = [p[0] for p in params]
+            # TODO: включить сброс, перезагрузку и выключение
+            if reset:
+                self.logger.error('Перезапуск веб-сервера...')
+                print('РАСКОММЕНТИРОВАТЬ СБРОС!')
+                # reset_webserver_config()
+
+            if reboot:
+                print('РАСКОММЕНТИРОВАТЬ РЕБУТ!')
+                self.logger.error('Перезагрузка...')
+                # run_cmd('reboot')
+
+            if poweroff:
+                print('РАСКОММЕНТИРОВАТЬ ВЫКЛ!')
+                self.logger.error('Выключение...')
+                # run_cmd('poweroff')
+        return msg
 
-    def tz_worker(self):
+    @inbound.handler('version')
+    def unpack_version(self, model, _range, date, mods) -> list:
+        self.logger.error("UNPACKING version: %s %s %s %s",
+                          model.decode().rstrip('\x00'),
+                          _range.decode().rstrip('\x00'),
+                          date.decode().rstrip('\x00'),
+                          mods.decode().rstrip('\x00'))
+        return ['']
+
+    def on_fix(self, fix: dict) -> None:
+        """
+        Обрабатывает решение ГНСС: при первой успешной синхронизации со
+        спутником разрешает раздачу времени по сети
+
+        :param fix: данные решения, результат fix_data()
+        :return: None
+        """
+        if self.gnss_synced is False and fix['status'] > 0:
+            self.gnss_synced = True
+            with NtpConf() as conf:
+                for lan in ('lan1', 'lan2'):
+                    add_listen_ntp(lan,
+                                   listen=settings.net[lan]['listen'],
+                                   ip=settings.net[lan]['ip'],
+                                   sync_src=settings.main['sync_src'],
+                                   gnss_synced=True,
+                                   conf=conf)
+
+    @staticmethod
+    def reset_settings() -> bool:
+        """
+        Сброс к заводским настройкам
+
+        :return: true, false
+        """
+        return settings.reset()
+
+    @staticmethod
+    def time_sources() -> dict:
+        """
+        Запрашивает пиры службы ntp, определяет текущие источники времени и
+        секундной метки, сохраняет их для структуры статуса УПШ
+
+        :return: словарь {'synctime', 'syncpps', 'peers'}
+        """
+        dt = {
+            'synctime': 'Нет данных',
+            'syncpps': 'Нет данных',
+            'peers': {}
+        }
+        # get peers from ntp service
+        peers = ntp_peers()
+        # print(peers)
+        if peers:
+            for refid in peers:
+                if peers[refid]['status_id'] == '*':
+
+                    peers[refid]['status'] = 'источник времени'
+                    dt['synctime'] = peers[refid]['name'].split()[0]
+
+                    if refid == '.GPPS.':
+                        if peers['.NMEA.']['status_id'] != 'x':
+                            peers['.NMEA.']['status'] = 'источник времени'
+                            dt['synctime'] = 'ГНСС'
+                        elif peers['.LCL.']['status_id'] != 'x':
+                            peers['.LCL.']['status'] = 'источник времени'
+                            dt['synctime'] = 'Внутренний'
+                        peers['.GPPS.']['status'] = 'источник секундной метки'
+                        dt['syncpps'] = 'ГНСС'
+
+                    if refid == '.LPPS.':
+                        if peers['.LCL.']['status_id'] != 'x':
+                            peers['.LCL.']['status'] = 'источник времени'
+                            dt['synctime'] = 'Внутренний'
+                        elif peers['.NMEA.']['status_id'] != 'x':
+                            peers['.NMEA.']['status'] = 'источник времени'
+                            dt['synctime'] = 'ГНСС'
+                        peers['.LPPS.']['status'] = 'источник секундной метки'
+                        dt['syncpps'] = 'Внутренний'
+
+                elif peers[refid]['status_id'] == 'o':
+                    if dt['syncpps'] == 'Нет данных':
+                        dt['syncpps'] = peers[refid]['name'].split()[0]
+
+        # save sources of time and pps
+        time_src, pps_src = TIME_SRC_NONE, PPS_SRC_NONE
+        if dt['synctime'] == 'ГНСС':
+            time_src = TIME_SRC_GNSS
+        elif dt['synctime'] == 'Внутренний':
+            time_src = TIME_SRC_INTERNAL
+
+        if dt['syncpps'] == 'ГНСС':
+            pps_src = PPS_SRC_GNSS
+        elif dt['syncpps'] == 'Внутренний':
+            pps_src = PPS_SRC_INTERNAL
+
+        settings.time_src = time_src
+        settings.pps_src = pps_src
+        dt['peers'] = peers
+        return dt
+
+    def tz_worker(self) -> None:
+        """
+        Поток, передает в УПШ структуру времени на границе каждой секунды
+
+        :return: None
+        """
         while True:
-            if not usb.device:
-                sleep(0.25)
-                # usb.event.wait(timeout=0.25)
-                continue
-            # print(strftime("%T", localtime()), run_cmd('timedatectl'))
-            # usb.queue.put('time')
-            # lcd.change_screen(rising=0, falling=0, clamping=0, timers=0x8)
-            # usb.queue.put('lcd')
-            # sleep(1)
-
-            diff = time.time() % 1
-            if diff < 0.1:
-                usb.queue.put('time')
-                # lcd.change_screen(rising=0, falling=0, clamping=0, timers=0x8)
-                # usb.queue.put('lcd')
-                self.get_n_struct = 4
-                usb.queue.put('get')
-            sleep(1 - diff)
-            # usb.event.wait(timeout=1 - diff)
-            # else:
-            #     # print(diff)
-            #     sleep(1 - diff)
-
-            # lcd.change_screen(rising=0, falling=0, clamping=0, timers=0x8)
-            # usb.queue.put('lcd')
-            # self.get_n_struct = 2
-            # usb.queue.put('get')
-            # usb.event.wait(timeout=0.25)
+            self.send_time(self.ticker.wait())
+
+    def send_time(self, boundary: int) -> None:
+        """
+        Передает в УПШ структуру времени на границе секунды. Передача
+        выполняется напрямую, без очереди УПШ
+
+        :param boundary: граница секунды
+        :return: None
+        """
+        if not usb.device:
+            return
+        times = [time.time()]
+        if self.send('time', times):
+            self.ticker.record(boundary)
+            self.timing.add(boundary, *times)
+            if self.timing.count % log_interval == 0:
+                self.logger.error('Передача времени в УПШ: %s', self.timing.format())
+        self.get_n_struct = 4
+        usb.queue.put('get')
+
+    def timing_stats(self) -> dict:
+        """
+        Статистика задержек передачи структуры времени в УПШ
+
+        :return: словарь с перцентилями по этапам, статистикой таймера и очереди УПШ
+        """
+        return dict(time=self.timing.summary(),
+                    ticker=self.ticker.stats(),
+                    queue=usb.queue.stats(),
+                    lcd=usb.frames.stats(),
+                    scheduler=self.scheduler.stats())
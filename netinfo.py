@@ -0,0 +1,159 @@
+import socket
+from os import path, listdir
+from struct import Struct
+
+SYS_CLASS_NET = '/sys/class/net'
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_GETROUTE = 26
+
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_TABLE = 15
+
+RT_TABLE_MAIN = 254
+
+nlmsghdr = Struct('=IHHII')
+ifaddrmsg = Struct('=BBBBI')
+rtmsg = Struct('=BBBBBBBBI')
+rtattr = Struct('=HH')
+u32 = Struct('=I')
+
+
+def read_sysfs(device: str, name: str, default: str = '') -> str:
+    """
+    Читает атрибут сетевого интерфейса из /sys/class/net
+
+    :param device: имя сетевого интерфейса
+    :param name: имя атрибута
+    :param default: значение при ошибке чтения
+    :return: значение атрибута
+    """
+    try:
+        with open(path.join(SYS_CLASS_NET, device, name), 'r') as file:
+            return file.read().strip()
+    except OSError:
+        # speed недоступен для интерфейса без линка
+        return default
+
+
+def read_link(device: str) -> dict:
+    """
+    Читает состояние линка, mac адрес и скорость интерфейса
+
+    :param device: имя сетевого интерфейса
+    :return: словарь с полями status, mac, speed
+    """
+    return dict(status=read_sysfs(device, 'operstate', 'unknown').upper(),
+                mac=read_sysfs(device, 'address', '00:00:00:00:00:00'),
+                speed=read_sysfs(device, 'speed', '0'))
+
+
+def _attributes(data: bytes, offset: int, end: int) -> dict:
+    """
+    Разбирает атрибуты rtattr сообщения netlink
+
+    :return: словарь {тип атрибута: значение в формате bytes}
+    """
+    attrs = {}
+    while offset + rtattr.size <= end:
+        length, kind = rtattr.unpack_from(data, offset)
+        if length < rtattr.size:
+            break
+        attrs.setdefault(kind, data[offset + rtattr.size:offset + length])
+        offset += (length + 3) & ~3
+    return attrs
+
+
+def _dump(sock: socket.socket, msg_type: int, body: bytes, seq: int):
+    """
+    Выполняет dump запрос rtnetlink и возвращает сообщения ответа
+
+    :param sock: netlink сокет
+    :param msg_type: тип запроса
+    :param body: тело запроса
+    :param seq: номер запроса
+    :return: генератор кортежей (тип сообщения, данные, смещение тела, конец сообщения)
+    """
+    sock.send(nlmsghdr.pack(nlmsghdr.size + len(body), msg_type,
+                            NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + body)
+    while True:
+        data = sock.recv(65536)
+        offset = 0
+        while offset + nlmsghdr.size <= len(data):
+            length, kind, _, r_seq, _ = nlmsghdr.unpack_from(data, offset)
+            if length < nlmsghdr.size:
+                return
+            if r_seq == seq:
+                if kind == NLMSG_DONE:
+                    return
+                if kind == NLMSG_ERROR:
+                    raise OSError('Ошибка запроса rtnetlink')
+                yield kind, data, offset + nlmsghdr.size, offset + length
+            offset += (length + 3) & ~3
+
+
+def read_netlink() -> tuple:
+    """
+    Получает IPv4 адреса и маршруты по умолчанию одним netlink сокетом
+
+    :return: кортеж словарей ({индекс: 'адрес/префикс'}, {индекс: шлюз})
+    """
+    addresses, gateways = {}, {}
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+        for kind, data, offset, end in _dump(sock, RTM_GETADDR,
+                                             ifaddrmsg.pack(socket.AF_INET, 0, 0, 0, 0), 1):
+            if kind != RTM_NEWADDR:
+                continue
+            family, prefixlen, _, _, index = ifaddrmsg.unpack_from(data, offset)
+            attrs = _attributes(data, offset + ifaddrmsg.size, end)
+            address = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+            if family == socket.AF_INET and address and index not in addresses:
+                addresses[index] = '%s/%d' % (socket.inet_ntoa(address), prefixlen)
+
+        for kind, data, offset, end in _dump(sock, RTM_GETROUTE,
+                                             rtmsg.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0, 0, 0), 2):
+            if kind != RTM_NEWROUTE:
+                continue
+            family, dst_len, _, _, table, _, _, _, _ = rtmsg.unpack_from(data, offset)
+            attrs = _attributes(data, offset + rtmsg.size, end)
+            if RTA_TABLE in attrs:
+                table = u32.unpack(attrs[RTA_TABLE])[0]
+            if family != socket.AF_INET or dst_len or table != RT_TABLE_MAIN:
+                continue
+            if RTA_OIF in attrs and RTA_GATEWAY in attrs:
+                gateways.setdefault(u32.unpack(attrs[RTA_OIF])[0], socket.inet_ntoa(attrs[RTA_GATEWAY]))
+    return addresses, gateways
+
+
+def interfaces(devices: tuple = None) -> dict:
+    """
+    Читает параметры сетевых интерфейсов без запуска внешних команд
+
+    :param devices: имена интерфейсов, None - все интерфейсы системы
+    :return: словарь {имя: словарь с полями inet4, gateway, status, mac, speed}
+    """
+    if devices is None:
+        devices = tuple(listdir(SYS_CLASS_NET))
+    addresses, gateways = read_netlink()
+
+    result = {}
+    for device in devices:
+        if not path.exists(path.join(SYS_CLASS_NET, device)):
+            continue
+        index = int(read_sysfs(device, 'ifindex', '0'))
+        result[device] = dict(inet4=addresses.get(index),
+                              gateway=gateways.get(index),
+                              **read_link(device))
+    return result
@@ -0,0 +1,222 @@
+import os
+import tempfile
+from threading import Lock, RLock
+
+NTP_CONF = '/etc/ntp.conf'
+
+# метки строк опорных часов ГНСС и секундной метки
+refclock_labels = ('GPS_server', 'GPS_fudge', 'PPS_server', 'PPS_fudge')
+
+# разобранные файлы: {путь: (mtime_ns, размер, кортеж строк)}
+_documents = {}
+_lock = Lock()
+# изменение файла (чтение - изменение - запись) выполняется одним потоком
+_transaction = RLock()
+
+
+def read_lines(path: str) -> tuple:
+    """
+    Читает строки файла, повторно файл читается только при изменении mtime или размера
+
+    :param path: путь к файлу
+    :return: кортеж строк
+    """
+    stat = os.stat(path)
+    with _lock:
+        document = _documents.get(path)
+        if document and document[0] == stat.st_mtime_ns and document[1] == stat.st_size:
+            return document[2]
+    with open(path, 'r') as file:
+        lines = tuple(file.readlines())
+    with _lock:
+        _documents[path] = (stat.st_mtime_ns, stat.st_size, lines)
+    return lines
+
+
+def replace_in_line(line: str, string: str, position: int) -> str:
+    """
+    Замена текста в строке
+
+    :param line: строка
+    :param string: текст для замены
+    :param position: позиция замены
+    :return: новая строка
+    """
+    # remove line if string is None
+    if not string:
+        return ''
+
+    lst = line.split()
+    lst.pop(position)
+    lst.insert(position, string)
+    return ' '.join(lst) + '\n'
+
+
+class NtpConf:
+    """
+    Модель конфигурационного файла ntp.conf. Изменения накапливаются в памяти
+    и записываются одной атомарной операцией в commit(). Изменение из
+    нескольких потоков выполняется в транзакции:
+
+        with NtpConf() as conf:
+            conf.set_tinker_panic('600')
+
+    файл перечитывается после захвата блокировки и записывается при выходе
+    """
+
+    def __init__(self, path: str = NTP_CONF) -> None:
+        """
+        Загружает файл конфигурации
+
+        :param path: путь к файлу
+        """
+        self.path = path
+        self.written = False
+        self.load()
+
+    def load(self) -> None:
+        """
+        Перечитывает файл, накопленные изменения отбрасываются
+
+        :return: None
+        """
+        self.ok = True
+        try:
+            self.original = read_lines(self.path)
+        except OSError:
+            self.ok = False
+            self.original = ()
+        self.lines = list(self.original)
+
+    def __enter__(self):
+        _transaction.acquire()
+        try:
+            self.load()
+        except BaseException:
+            _transaction.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            _transaction.release()
+
+    @property
+    def changed(self) -> bool:
+        """
+        :return: true - если содержимое отличается от файла
+        """
+        return tuple(self.lines) != self.original
+
+    def apply(self, action: str, labels, inserts=None, positions=None) -> bool:
+        """
+        Выполняет действие над первой строкой, содержащей каждую из меток
+
+        :param action: действие (comment, uncomment, remove, replace)
+        :param labels: метки для поиска строк
+        :param inserts: значения для вставки (для replace)
+        :param positions: позиции вставки значений (для replace)
+        :return: 'True' - если действие успешно, 'False' - если нет
+        """
+        if not self.ok:
+            return False
+        pending = list(zip(labels,
+                           inserts or [None] * len(labels),
+                           positions or [None] * len(labels)))
+        try:
+            for n, line in enumerate(self.lines):
+                for item in pending:
+                    label, insert, position = item
+                    if label in line:
+                        if action == 'comment':
+                            if not line.startswith('#'):
+                                line = '#' + line
+                        elif action == 'uncomment':
+                            line = line.strip('# ')
+                        elif action == 'remove':
+                            line = ''
+                        elif action == 'replace':
+                            line = replace_in_line(line, insert, position)
+                        self.lines[n] = line
+                        pending.remove(item)
+                        break
+                if not pending:
+                    break
+        except Exception:
+            return False
+        return True
+
+    def set_listen_address(self, lan: str, ip: str) -> bool:
+        """
+        Устанавливает адрес в строке 'interface listen' сетевого интерфейса
+
+        :param lan: имя сетевого интерфейса
+        :param ip: адрес
+        :return: true, false
+        """
+        return self.apply('replace', [lan], [ip], [2])
+
+    def set_listen_enabled(self, lan: str, enabled: bool) -> bool:
+        """
+        Разрешает или запрещает раздачу времени на сетевом интерфейсе
+
+        :param lan: имя сетевого интерфейса
+        :param enabled: true - разрешить
+        :return: true, false
+        """
+        return self.apply('uncomment' if enabled else 'comment', [lan])
+
+    def set_refclocks(self, enabled: bool) -> bool:
+        """
+        Включает или отключает опорные часы ГНСС и секундной метки
+
+        :param enabled: true - включить
+        :return: true, false
+        """
+        return self.apply('uncomment' if enabled else 'comment', refclock_labels)
+
+    def set_tinker_panic(self, seconds: str) -> bool:
+        """
+        Устанавливает максимальную перестройку времени
+
+        :param seconds: значение в секундах
+        :return: true, false
+        """
+        return self.apply('replace', ['tinker panic'], [seconds], [2])
+
+    def commit(self) -> bool:
+        """
+        Записывает изменения через временный файл и переименование.
+        Если содержимое не изменилось, запись не выполняется
+
+        :return: true - файл записан, false - изменений нет или ошибка записи
+        """
+        if not self.ok or not self.changed:
+            return False
+        tmp_path = None
+        try:
+            # уникальное имя: одновременная запись из другого процесса не
+            # перепишет чужой временный файл
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.',
+                                            prefix='.%s.' % os.path.basename(self.path))
+            with os.fdopen(fd, 'w') as file:
+                file.writelines(self.lines)
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(tmp_path, os.stat(self.path).st_mode & 0o7777)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            self.ok = False
+            return False
+
+        self.original = tuple(self.lines)
+        stat = os.stat(self.path)
+        with _lock:
+            _documents[self.path] = (stat.st_mtime_ns, stat.st_size, self.original)
+        self.written = True
+        return True
@@ -0,0 +1,336 @@
+import socket
+from struct import Struct
+from threading import Thread, Lock
+
+NTP_PORT = 123
+
+# mode 6 (control message), версия протокола 2
+CTL_LI_VN_MODE = (0 << 6) | (2 << 3) | 6
+
+CTL_RESPONSE = 0x80
+CTL_ERROR = 0x40
+CTL_MORE = 0x20
+CTL_OP_MASK = 0x1F
+
+CTL_OP_READSTAT = 1
+CTL_OP_READVAR = 2
+
+CTL_MAX_DATA = 468
+
+# заголовок управляющего пакета: li_vn_mode, r_e_m_op, sequence, status,
+# associd, offset, count
+ctl_header = Struct('!BBHHHHH')
+assoc_entry = Struct('!HH')
+
+# поле выбора (биты 8-10 слова статуса пира) -> символ из вывода "ntpq -p"
+select_codes = (' ', 'x', '.', '-', '+', '#', '*', 'o')
+
+peer_variables = 'srcadr,refid,stratum,offset,jitter'
+
+
+class NtpControlError(Exception):
+    """
+    Ошибка обмена по управляющему протоколу ntp (mode 6)
+    """
+    pass
+
+
+def build_packet(opcode: int,
+                 sequence: int,
+                 associd: int = 0,
+                 data: bytes = b'',
+                 status: int = 0,
+                 flags: int = 0,
+                 offset: int = 0) -> bytes:
+    """
+    Формирует управляющий пакет ntp (mode 6)
+
+    :param opcode: код операции
+    :param sequence: номер последовательности
+    :param associd: id ассоциации (пира)
+    :param data: поле данных
+    :param status: слово статуса
+    :param flags: флаги response/error/more
+    :param offset: смещение данных фрагмента
+    :return: пакет в формате bytes
+    """
+    packet = ctl_header.pack(CTL_LI_VN_MODE, flags | (opcode & CTL_OP_MASK), sequence,
+                             status, associd, offset, len(data)) + data
+    # поле данных выравнивается до 32 бит
+    return packet + b'\x00' * (-len(packet) % 4)
+
+
+def parse_variables(text: str) -> dict:
+    """
+    Разбирает список переменных ответа READVAR: 'refid=LCL, stratum=10, ...'
+
+    :param text: текст ответа
+    :return: словарь переменных
+    """
+    variables = {}
+    for item in text.replace('\r', '').replace('\n', '').split(','):
+        name, sep, value = item.partition('=')
+        name = name.strip()
+        if name:
+            variables[name] = value.strip().strip('"')
+    return variables
+
+
+def format_refid(refid: str) -> str:
+    """
+    Приводит refid к виду из вывода "ntpq -p": 'LCL' -> '.LCL.'
+
+    :param refid: значение переменной refid
+    :return: refid в формате ntpq
+    """
+    if not refid or refid.startswith('.'):
+        return refid
+    octets = refid.split('.')
+    if len(octets) == 4 and all(octet.isdigit() for octet in octets):
+        return refid
+    return '.%s.' % refid
+
+
+class NtpControlClient:
+    """
+    Клиент управляющего протокола ntp (mode 6) поверх постоянного UDP сокета
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = NTP_PORT, timeout: float = 0.5) -> None:
+        """
+        Инициализация клиента
+
+        :param host: адрес службы ntp
+        :param port: порт службы ntp
+        :param timeout: таймаут ответа в секундах
+        """
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sequence = 0
+        self.sock = None
+        self.lock = Lock()
+
+    def connect(self) -> None:
+        """
+        Открывает UDP сокет, если он еще не открыт
+
+        :return: None
+        """
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.address)
+
+    def close(self) -> None:
+        """
+        Закрывает UDP сокет
+
+        :return: None
+        """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def request(self, opcode: int, associd: int = 0, data: bytes = b'') -> tuple:
+        """
+        Выполняет запрос и собирает ответ из фрагментов
+
+        :param opcode: код операции
+        :param associd: id ассоциации
+        :param data: поле данных запроса
+        :return: кортеж (слово статуса, данные ответа)
+        """
+        with self.lock:
+            self.connect()
+            self.sequence = (self.sequence + 1) & 0xFFFF
+            sequence = self.sequence
+            try:
+                self.sock.send(build_packet(opcode, sequence, associd, data))
+                fragments = {}
+                last_offset = None
+                status = 0
+                while True:
+                    response = self.sock.recv(1024)
+                    if len(response) < ctl_header.size:
+                        continue
+                    _, r_e_m_op, r_sequence, status, r_associd, offset, count = \
+                        ctl_header.unpack_from(response)
+                    # ответы на устаревшие запросы пропускаются
+                    if r_sequence != sequence or not r_e_m_op & CTL_RESPONSE \
+                            or r_e_m_op & CTL_OP_MASK != opcode:
+                        continue
+                    if r_e_m_op & CTL_ERROR:
+                        raise NtpControlError('Ошибка ответа ntp: %d' % (status >> 8))
+                    fragments[offset] = response[ctl_header.size:ctl_header.size + count]
+                    if not r_e_m_op & CTL_MORE:
+                        last_offset = offset
+                    if last_offset is not None and self._complete(fragments, last_offset):
+                        break
+            except OSError:
+                # при потере службы ntp сокет пересоздается при следующем запросе
+                self.close()
+                raise
+        return status, b''.join(fragments[offset] for offset in sorted(fragments))
+
+    @staticmethod
+    def _complete(fragments: dict, last_offset: int) -> bool:
+        """
+        Проверяет, что все фрагменты ответа получены
+
+        :param fragments: словарь фрагментов {смещение: данные}
+        :param last_offset: смещение последнего фрагмента
+        :return: true, false
+        """
+        expected = 0
+        for offset in sorted(fragments):
+            if offset != expected:
+                return False
+            expected += len(fragments[offset])
+        return expected > last_offset or last_offset == 0
+
+    def read_status(self) -> list:
+        """
+        Запрос READSTAT: список ассоциаций и их слов статуса
+
+        :return: лист кортежей (id ассоциации, слово статуса)
+        """
+        _, data = self.request(CTL_OP_READSTAT)
+        return [assoc_entry.unpack_from(data, pos)
+                for pos in range(0, len(data) - assoc_entry.size + 1, assoc_entry.size)]
+
+    def read_variables(self, associd: int, names: str = peer_variables) -> dict:
+        """
+        Запрос READVAR для ассоциации
+
+        :param associd: id ассоциации
+        :param names: имена запрашиваемых переменных через запятую
+        :return: словарь переменных
+        """
+        _, data = self.request(CTL_OP_READVAR, associd, names.encode('ascii'))
+        return parse_variables(data.decode('ascii', errors='replace'))
+
+    def peers(self) -> list:
+        """
+        Запрашивает параметры всех пиров
+
+        :return: лист словарей с полями refid, stratum, offset, jitter, status_id
+        """
+        peers = []
+        for associd, peer_status in self.read_status():
+            variables = self.read_variables(associd)
+            peers.append(dict(refid=format_refid(variables.get('refid', '')),
+                              stratum=variables.get('stratum', ''),
+                              offset=variables.get('offset', ''),
+                              jitter=variables.get('jitter', ''),
+                              status_id=select_codes[(peer_status >> 8) & 0x7]))
+        return peers
+
+
+class FakeNtpResponder:
+    """
+    Локальный имитатор службы ntp, отвечающий на запросы READSTAT и READVAR.
+    Используется для проверки и замеров клиента без ntpd
+    """
+
+    def __init__(self, peers: dict = None, host: str = '127.0.0.1', port: int = 0) -> None:
+        """
+        Инициализация имитатора
+
+        :param peers: словарь {id ассоциации: (слово статуса, словарь переменных)}
+        :param host: адрес для приема запросов
+        :param port: порт для приема запросов, 0 - выбирается системой
+        """
+        if peers is None:
+            peers = {
+                1: (0x9614, dict(srcadr='127.127.1.0', refid='LCL', stratum='10',
+                                 offset='0.000', jitter='0.000')),
+                2: (0x9424, dict(srcadr='127.127.20.0', refid='NMEA', stratum='0',
+                                 offset='-0.291', jitter='0.412')),
+                3: (0x9714, dict(srcadr='127.127.22.0', refid='GPPS', stratum='0',
+                                 offset='0.002', jitter='0.004')),
+                4: (0x9114, dict(srcadr='127.127.22.1', refid='LPPS', stratum='0',
+                                 offset='0.015', jitter='0.021')),
+            }
+        self.peers = peers
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+        self.thread = None
+
+    def start(self) -> 'FakeNtpResponder':
+        """
+        Запускает поток обработки запросов
+
+        :return: объект имитатора
+        """
+        self.thread = Thread(name="Thread fake ntpd", target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Останавливает имитатор
+
+        :return: None
+        """
+        self.sock.close()
+
+    def serve(self) -> None:
+        """
+        Цикл обработки запросов
+
+        :return: None
+        """
+        while True:
+            try:
+                request, address = self.sock.recvfrom(1024)
+            except OSError:
+                return
+            if len(request) < ctl_header.size:
+                continue
+            _, r_e_m_op, sequence, _, associd, _, count = ctl_header.unpack_from(request)
+            opcode = r_e_m_op & CTL_OP_MASK
+            if opcode == CTL_OP_READSTAT:
+                data = b''.join(assoc_entry.pack(assoc, status)
+                                for assoc, (status, _) in sorted(self.peers.items()))
+                self.reply(address, opcode, sequence, 0, data)
+            elif opcode == CTL_OP_READVAR and associd in self.peers:
+                names = request[ctl_header.size:ctl_header.size + count].decode('ascii').split(',')
+                status, variables = self.peers[associd]
+                data = ', '.join('%s=%s' % (name, variables[name])
+                                 for name in names if name in variables).encode('ascii')
+                self.reply(address, opcode, sequence, associd, data, status)
+            else:
+                self.sock.sendto(build_packet(opcode, sequence, associd,
+                                              flags=CTL_RESPONSE | CTL_ERROR), address)
+
+    def reply(self, address, opcode: int, sequence: int, associd: int, data: bytes, status: int = 0) -> None:
+        """
+        Отправляет ответ, разбивая данные на фрагменты
+
+        :return: None
+        """
+        offset = 0
+        while True:
+            fragment = data[offset:offset + CTL_MAX_DATA]
+            more = CTL_MORE if offset + CTL_MAX_DATA < len(data) else 0
+            self.sock.sendto(build_packet(opcode, sequence, associd, fragment, status,
+                                          flags=CTL_RESPONSE | more, offset=offset), address)
+            offset += CTL_MAX_DATA
+            if not more:
+                return
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+
+    responder = FakeNtpResponder().start()
+    client = NtpControlClient(*responder.address)
+    print(client.peers())
+
+    count = 1000
+    start = perf_counter()
+    for _ in range(count):
+        client.peers()
+    print('peers(): %.3f мс на запрос' % ((perf_counter() - start) * 1000 / count))
+    responder.stop()
@@ -0,0 +1,162 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+from hashlib import sha1
+from threading import Thread, Condition
+from time import monotonic
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    Записывает файл атомарно: временный файл, fsync, переименование
+
+    :param path: путь к файлу
+    :param data: содержимое файла
+    :return: None
+    """
+    # уникальное временное имя: запись потока отложенного сохранения и
+    # сохранение при завершении процесса не используют один файл
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp создает файл с правами 0600, права прежнего файла сохраняются
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o7777 if os.path.exists(path) else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    # фиксация переименования в каталоге
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class SettingsWriter:
+    """
+    Отложенная запись настроек в файл. Запись выполняется фоновым потоком
+    только при изменении содержимого, серия изменений объединяется в одну запись
+    """
+
+    def __init__(self, path: str, delay: float = 2.0, max_delay: float = 10.0) -> None:
+        """
+        Инициализация
+
+        :param path: путь к файлу настроек
+        :param delay: задержка записи после последнего изменения, с
+        :param max_delay: максимальная задержка записи после первого изменения, с
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.delay = delay
+        self.max_delay = max_delay
+        self.condition = Condition()
+        self.digest = None          # хэш последнего записанного или ожидающего содержимого
+        self.pending = None
+        self.first_change = 0.0
+        self.last_change = 0.0
+        self.thread = None
+        self.counters = dict(saves=0, writes=0, avoided=0, coalesced=0, errors=0)
+        atexit.register(self.flush)
+
+    def save(self, obj: dict) -> bool:
+        """
+        Ставит настройки в очередь на запись, если они изменились
+
+        :param obj: словарь с настройками
+        :return: true - содержимое изменилось и будет записано
+        """
+        data = json.dumps(obj).encode('utf-8')
+        digest = sha1(data).digest()
+        with self.condition:
+            self.counters['saves'] += 1
+            if digest == self.digest:
+                self.counters['avoided'] += 1
+                return False
+            now = monotonic()
+            if self.pending is None:
+                self.first_change = now
+            else:
+                self.counters['coalesced'] += 1
+            self.last_change = now
+            self.pending = data
+            self.digest = digest
+            if self.thread is None:
+                self.thread = Thread(name="Thread settings writer", target=self.worker, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+        return True
+
+    def loaded(self, data: bytes) -> None:
+        """
+        Запоминает содержимое, прочитанное из файла при запуске, чтобы не
+        перезаписывать файл теми же настройками
+
+        :param data: содержимое файла
+        :return: None
+        """
+        with self.condition:
+            self.digest = sha1(data).digest()
+
+    def discard(self) -> None:
+        """
+        Отменяет ожидающую запись (при сбросе настроек)
+
+        :return: None
+        """
+        with self.condition:
+            self.pending = None
+            self.digest = None
+
+    def flush(self) -> None:
+        """
+        Немедленно записывает ожидающие изменения
+
+        :return: None
+        """
+        with self.condition:
+            data, self.pending = self.pending, None
+        if data is not None:
+            self.write(data)
+
+    def write(self, data: bytes) -> None:
+        try:
+            write_atomic(self.path, data)
+            with self.condition:
+                self.counters['writes'] += 1
+        except OSError as err:
+            with self.condition:
+                self.counters['errors'] += 1
+                self.digest = None
+            self.logger.error('Не удалось сохранить настройки!')
+            self.logger.debug(err)
+
+    def stats(self) -> dict:
+        """
+        :return: счетчики сохранений, записей и избежанных записей
+        """
+        with self.condition:
+            return dict(self.counters, pending=self.pending is not None)
+
+    def worker(self) -> None:
+        """
+        Поток отложенной записи
+
+        :return: None
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None)
+                deadline = min(self.last_change + self.delay, self.first_change + self.max_delay)
+                while self.pending is not None and monotonic() < deadline:
+                    self.condition.wait(timeout=deadline - monotonic())
+                    deadline = min(self.last_change + self.delay, self.first_change + self.max_delay)
+            self.flush()
@@ -0,0 +1,157 @@
+from functools import partial
+from re import findall
+from struct import Struct
+
+
+class Message:
+    """
+    Описание структуры протокола УПШ
+    """
+    __slots__ = ('id', 'name', 'struct', 'handler', 'pack')
+
+    def __init__(self, msg_id: int, name: str, fmt: str) -> None:
+        """
+        :param msg_id: id структуры (первое поле пакета)
+        :param name: имя структуры
+        :param fmt: формат struct, включая поле id
+        """
+        self.id = msg_id
+        self.name = name
+        self.struct = Struct(fmt)
+        self.handler = None
+        # pack(*поля без id) -> пакет в формате bytes
+        self.pack = partial(self.struct.pack, msg_id)
+
+    def unpack(self, packet) -> tuple:
+        """
+        Распаковка без копирования буфера, лишние байты пакета игнорируются
+
+        :param packet: пакет (bytes, array, memoryview)
+        :return: поля структуры без id
+        """
+        return self.struct.unpack_from(packet)[1:]
+
+
+class MessageRegistry:
+    """
+    Таблица структур протокола УПШ с доступом по id и по имени
+    """
+
+    def __init__(self) -> None:
+        self.by_id = {}
+        self.by_name = {}
+
+    def add(self, msg_id: int, name: str, fmt: str) -> Message:
+        """
+        Регистрирует структуру
+
+        :param msg_id: id структуры
+        :param name: имя структуры
+        :param fmt: формат struct
+        :return: описание структуры
+        """
+        message = Message(msg_id, name, fmt)
+        self.by_id[msg_id] = message
+        self.by_name[name] = message
+        return message
+
+    def handler(self, name: str):
+        """
+        Декоратор, назначает функцию обработчиком структуры. Для исходящих
+        структур обработчик возвращает кортеж полей, для входящих - принимает поля
+
+        :param name: имя структуры
+        :return: декоратор
+        """
+
+        def decorator(func):
+            self.by_name[name].handler = func
+            return func
+
+        return decorator
+
+    def __getitem__(self, name: str) -> Message:
+        return self.by_name[name]
+
+    def __contains__(self, name) -> bool:
+        return name in self.by_name
+
+    def __iter__(self):
+        return iter(self.by_name.values())
+
+
+# output data struct
+outbound = MessageRegistry()
+outbound.add(0, 'void', '<H')
+outbound.add(1, 'get', '<HH')
+outbound.add(2, 'time', '<HQQQQ')
+outbound.add(3, 'status', '<HBB')
+outbound.add(4, 'gps_mux', '<HB')
+outbound.add(5, 'gps_wdog', '<HLLL')
+outbound.add(6, 'reset', '<HBBB')
+outbound.add(7, 'lcd', '<H488s')
+# страница кадра LCD (номер страницы, 122 байта), передается при mcu['lcd_partial']
+outbound.add(8, 'lcd_page', '<HB122s')
+
+# input data struct
+inbound = MessageRegistry()
+inbound.add(0, 'void', '<H')
+inbound.add(1, 'get', '<HH')
+inbound.add(2, 'pps_info', '<HiiiiQH')
+inbound.add(3, 'buttons', '<HHHHHH')
+inbound.add(4, 'version', '<H16s16s16s2s')
+
+
+def random_fields(message: Message, rnd) -> tuple:
+    """
+    Случайные значения полей структуры во всем допустимом диапазоне
+
+    :param message: описание структуры
+    :param rnd: генератор случайных чисел
+    :return: поля структуры без id
+    """
+    ranges = dict(B=(0, 2 ** 8 - 1), H=(0, 2 ** 16 - 1), L=(0, 2 ** 32 - 1), Q=(0, 2 ** 64 - 1),
+                  i=(-2 ** 31, 2 ** 31 - 1))
+    fields = []
+    for count, code in findall(r'(\d*)([a-zA-Z])', message.struct.format.lstrip('<')):
+        if code == 's':
+            fields.append(bytes(rnd.getrandbits(8) for _ in range(int(count or 1))))
+        else:
+            fields.extend(rnd.randint(*ranges[code]) for _ in range(int(count or 1)))
+    return tuple(fields[1:])
+
+
+if __name__ == "__main__":
+    from array import array
+    from random import Random
+    from struct import pack, unpack
+    from timeit import timeit
+
+    # проверка упаковки и распаковки на случайных значениях
+    rnd = Random(0)
+    for registry in (outbound, inbound):
+        for message in registry:
+            for _ in range(1000):
+                fields = random_fields(message, rnd)
+                packet = message.pack(*fields)
+                assert registry.by_id[packet[0]] is message
+                assert message.unpack(packet) == fields
+                # пакет УПШ читается в буфер 64 байта
+                assert message.unpack(array('B', packet + bytes(64))) == fields
+    print('round-trip: OK')
+
+    loops = 100000
+    print('%-10s %-8s %10s %10s' % ('структура', '', 'pack(fmt)', 'Struct'))
+    for direction, registry in (('out', outbound), ('in', inbound)):
+        for message in registry:
+            fields = random_fields(message, rnd)
+            fmt = message.struct.format
+            if direction == 'out':
+                old = timeit(lambda: pack(fmt, message.id, *fields), number=loops)
+                new = timeit(lambda: message.pack(*fields), number=loops)
+            else:
+                packet = array('B', message.pack(*fields))
+                old = timeit(lambda: (list(packet)[0], unpack(fmt, packet)), number=loops)
+                new = timeit(lambda: registry.by_id[packet[0]].unpack(packet), number=loops)
+            print('%-10s %-8s %8.3f мкс %8.3f мкс' % (message.name, direction,
+                                                    old * 1e6 / loops, new * 1e6 / loops))
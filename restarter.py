@@ -0,0 +1,123 @@
+import logging
+from threading import Thread, Condition
+from time import monotonic
+
+# порядок перезапуска зависимых служб: сеть, затем gpsd, затем ntp
+restart_order = ('systemd-networkd', 'gpsd.socket', 'gpsd', 'ntp')
+
+
+class RestartCoordinator:
+    """
+    Объединяет запросы на перезапуск системных служб и выполняет их
+    в отдельном потоке в порядке зависимостей
+    """
+
+    def __init__(self, restart, window: float = 1.0, max_delay: float = 5.0) -> None:
+        """
+        Инициализация
+
+        :param restart: функция перезапуска службы, принимает имя службы
+        :param window: время ожидания новых запросов после последнего запроса, с
+        :param max_delay: максимальная задержка перезапуска от первого запроса, с
+        """
+        self.logger = logging.getLogger(__name__)
+        self.restart = restart
+        self.window = window
+        self.max_delay = max_delay
+        self.condition = Condition()
+        self.requests = {}      # {служба: число объединенных запросов}
+        self.first_request = 0.0
+        self.last_request = 0.0
+        self.in_progress = []   # службы текущей серии, ожидающие перезапуска
+        self.thread = None
+        self.durations = {}
+
+    def request(self, *services) -> None:
+        """
+        Запрашивает перезапуск служб
+
+        :param services: имена служб
+        :return: None
+        """
+        with self.condition:
+            now = monotonic()
+            if not self.requests:
+                self.first_request = now
+            self.last_request = now
+            for service in services:
+                self.requests[service] = self.requests.get(service, 0) + 1
+            if self.thread is None:
+                self.thread = Thread(name="Thread service restart", target=self.worker, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    def pending(self) -> dict:
+        """
+        :return: словарь {служба: число объединенных запросов}, включая
+        службы выполняемой серии перезапусков
+        """
+        with self.condition:
+            pending = dict(self.in_progress)
+            for service, count in self.requests.items():
+                pending[service] = pending.get(service, 0) + count
+            return pending
+
+    def flush(self, timeout: float = 60) -> bool:
+        """
+        Немедленно выполняет ожидающие перезапуски и ждет их завершения
+
+        :param timeout: максимальное время ожидания, с
+        :return: true - все перезапуски выполнены
+        """
+        with self.condition:
+            self.first_request = self.last_request = monotonic() - self.max_delay
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: not self.requests and not self.in_progress, timeout)
+
+    def stats(self) -> dict:
+        """
+        Статистика перезапусков по службам
+
+        :return: словарь {служба: {'count', 'merged', 'last_s', 'max_s'}}
+        """
+        with self.condition:
+            return {service: dict(item) for service, item in self.durations.items()}
+
+    def _deadline(self) -> float:
+        return min(self.last_request + self.window, self.first_request + self.max_delay)
+
+    def worker(self) -> None:
+        """
+        Поток выполнения перезапусков
+
+        :return: None
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.requests)
+                # ожидание окончания серии запросов
+                while monotonic() < self._deadline():
+                    self.condition.wait(timeout=self._deadline() - monotonic())
+                self.in_progress = sorted(self.requests.items(),
+                                          key=lambda item: restart_order.index(item[0])
+                                          if item[0] in restart_order else len(restart_order))
+                self.requests = {}
+
+            while self.in_progress:
+                service, count = self.in_progress[0]
+                start = monotonic()
+                try:
+                    self.restart(service)
+                except Exception as err:
+                    self.logger.error('Ошибка перезапуска службы %s: %s', service, err)
+                duration = monotonic() - start
+                self.logger.error('Перезапуск службы %s (запросов: %d): %.2f с',
+                                  service, count, duration)
+                with self.condition:
+                    item = self.durations.setdefault(service, dict(count=0, merged=0, last_s=0.0, max_s=0.0))
+                    item['count'] += 1
+                    item['merged'] += count - 1
+                    item['last_s'] = round(duration, 3)
+                    item['max_s'] = max(item['max_s'], item['last_s'])
+                    self.in_progress.pop(0)
+                    self.condition.notify_all()
@@ -0,0 +1,155 @@
+import json
+import logging
+from threading import Lock
+from time import monotonic
+
+
+def sat_key(sat: dict):
+    """
+    Ключ спутника: система ГНСС и номер, для старых версий gpsd - PRN
+
+    :param sat: строка таблицы спутников gpsd
+    :return: ключ
+    """
+    if 'gnssid' in sat and 'svid' in sat:
+        return '%d:%d' % (sat['gnssid'], sat['svid'])
+    return str(sat.get('PRN'))
+
+
+class SatTable:
+    """
+    Таблица спутников с передачей изменений: добавленные, измененные и
+    удаленные строки, с периодической передачей таблицы целиком (ключевой кадр)
+    """
+
+    def __init__(self, keyframe_interval: float = 30.0, window: float = 600.0) -> None:
+        """
+        :param keyframe_interval: период передачи таблицы целиком, с
+        :param window: интервал подсчета и записи в журнал скорости передачи, с
+        """
+        self.logger = logging.getLogger(__name__)
+        self.keyframe_interval = keyframe_interval
+        self.window = window
+        self.lock = Lock()
+        self.rows = {}              # {ключ: строка}
+        self.seq = 0
+        self.last_keyframe = None
+        self.counters = dict(updates=0, keyframes=0, deltas=0, bytes_full=0, bytes_sent=0)
+        self.window_start = monotonic()
+        self.window_full = self.window_sent = 0
+        self.rates = dict(full_bps=0, sent_bps=0)
+
+    def keyframe(self) -> dict:
+        """
+        Таблица целиком, для синхронизации нового клиента
+
+        :return: сообщение {'type': 'full', 'seq', 'rows'}
+        """
+        with self.lock:
+            return dict(type='full', seq=self.seq, rows=list(self.rows.values()))
+
+    def update(self, sat_list: list) -> dict:
+        """
+        Обновляет таблицу по отчету SKY
+
+        :param sat_list: лист спутников отчета
+        :return: сообщение для клиентов: ключевой кадр или изменения
+        {'type': 'delta', 'seq', 'upsert': лист строк, 'remove': лист ключей}
+        """
+        now = monotonic()
+        rows = {sat_key(sat): sat for sat in sat_list}
+        with self.lock:
+            upsert = [sat for key, sat in rows.items() if self.rows.get(key) != sat]
+            remove = [key for key in self.rows if key not in rows]
+            self.rows = rows
+            self.seq += 1
+            self.counters['updates'] += 1
+            if self.last_keyframe is None or now - self.last_keyframe >= self.keyframe_interval:
+                self.last_keyframe = now
+                self.counters['keyframes'] += 1
+                return dict(type='full', seq=self.seq, rows=list(rows.values()))
+            self.counters['deltas'] += 1
+            return dict(type='delta', seq=self.seq, upsert=upsert, remove=remove)
+
+    def account(self, full: int, sent: int) -> None:
+        """
+        Учитывает объем передачи
+
+        :param full: байт при передаче таблицы целиком
+        :param sent: байт передано
+        :return: None
+        """
+        with self.lock:
+            self.counters['bytes_full'] += full
+            self.counters['bytes_sent'] += sent
+            self.window_full += full
+            self.window_sent += sent
+            now = monotonic()
+            if now - self.window_start >= self.window:
+                elapsed = now - self.window_start
+                self.rates = dict(full_bps=round(self.window_full / elapsed),
+                                  sent_bps=round(self.window_sent / elapsed))
+                self.logger.error('Таблица спутников: %d байт/с вместо %d байт/с',
+                                  self.rates['sent_bps'], self.rates['full_bps'])
+                self.window_start = now
+                self.window_full = self.window_sent = 0
+
+    def stats(self) -> dict:
+        """
+        :return: счетчики обновлений и байт, скорость передачи за последний интервал
+        """
+        with self.lock:
+            return dict(self.counters, **self.rates)
+
+
+def apply(table: dict, message: dict) -> dict:
+    """
+    Применяет сообщение к таблице клиента (как это делает веб страница)
+
+    :param table: таблица клиента {ключ: строка}
+    :param message: ключевой кадр или изменения
+    :return: таблица клиента
+    """
+    if message['type'] == 'full':
+        return {sat_key(sat): sat for sat in message['rows']}
+    for key in message['remove']:
+        table.pop(key, None)
+    for sat in message['upsert']:
+        table[sat_key(sat)] = sat
+    return table
+
+
+if __name__ == "__main__":
+    from random import Random
+
+    # 36 спутников GPS и ГЛОНАСС, отчет SKY 1 раз в секунду: уровни сигнала меняются
+    # у части спутников, угол места и азимут меняются медленно, спутники заходят и восходят
+    rnd = Random(0)
+    sats = {n: dict(PRN=n if n < 33 else n + 32, gnssid=0 if n < 33 else 6, svid=n if n < 33 else n - 32,
+                    el=rnd.randrange(5, 90), az=rnd.randrange(360), ss=rnd.randrange(15, 50), used=True)
+            for n in range(1, 45)}
+    visible = set(rnd.sample(sorted(sats), 36))
+    table = SatTable(keyframe_interval=30.0)
+    client = {}
+    seconds = 600
+    sent = full = 0
+    for second in range(seconds):
+        for n in visible:
+            sat = sats[n]
+            if rnd.random() < 0.3:
+                sats[n] = sat = dict(sat, ss=max(0, sat['ss'] + rnd.choice((-1, 1))))
+            if second % 60 == 0:
+                sats[n] = dict(sat, el=sat['el'] + 1, az=(sat['az'] + 1) % 360)
+        if second % 90 == 0:
+            visible.symmetric_difference_update({rnd.choice(sorted(sats))})
+        sat_list = [sats[n] for n in sorted(visible)]
+        # имитация времени для ключевых кадров
+        if second % 30 == 0:
+            table.last_keyframe = None
+        message = table.update(sat_list)
+        client = apply(client, message)
+        assert client == {sat_key(sat): sat for sat in sat_list}
+        full += len(json.dumps(sat_list))
+        sent += len(json.dumps(message))
+    print('полная таблица: %.0f байт/с, изменения: %.0f байт/с (%.1f%%)' % (
+        full / seconds, sent / seconds, sent * 100 / full))
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+from executor import LatencyHistogram
+
+# границы интервалов гистограмм запаздывания и длительности заданий, мс
+lag_bounds = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Job:
+    """
+    Периодическое задание планировщика
+    """
+
+    def __init__(self, name: str, kind: str, func, interval: float = None, offload: bool = False) -> None:
+        """
+        :param name: имя задания
+        :param kind: вид задания, 'every' - периодическое
+        :param func: функция задания
+        :param interval: период, с
+        :param offload: выполнять в пуле потоков (блокирующие вызовы)
+        """
+        self.name = name
+        self.kind = kind
+        self.func = func
+        self.interval = interval
+        self.offload = offload
+        self.state = 'scheduled'    # scheduled, running, cancelled
+        self.due = None             # плановое время запуска (время цикла событий)
+        self.handle = None
+        self.lag = LatencyHistogram(lag_bounds)
+        self.duration = LatencyHistogram(lag_bounds)
+        self.counters = dict(runs=0, errors=0, skipped=0, wakes=0)
+        self.error = None
+
+    def as_dict(self) -> dict:
+        """
+        :return: словарь с состоянием и статистикой задания
+        """
+        return dict(self.counters,
+                    kind=self.kind,
+                    state=self.state,
+                    interval=self.interval,
+                    offload=self.offload,
+                    error=self.error,
+                    lag=self.lag.as_dict(),
+                    duration=self.duration.as_dict())
+
+
+class Scheduler:
+    """
+    Планировщик периодических фоновых заданий в одном потоке с циклом событий
+    asyncio. Задания выполняются по таймерам цикла, блокирующие - в небольшом
+    пуле потоков. Для каждого задания учитывается запаздывание запуска и
+    длительность. Передача времени в УПШ сюда не переносится: запись USB
+    под блокировкой задержала бы цикл, она выполняется в отдельном потоке.
+
+    Вместо отдельного потока на каждое задание (time, control, uptime) -
+    поток цикла и поток пула, на одно задание меньше. Процессорное время
+    при этом больше (демонстрация ниже: около 7 мс против 4 мс за 5 с),
+    выигрыш по переключениям контекста не подтвержден
+    """
+
+    def __init__(self, workers: int = 2, name: str = 'Thread scheduler') -> None:
+        """
+        Инициализация и запуск потока цикла событий
+
+        :param workers: число потоков для блокирующих заданий
+        :param name: имя потока
+        """
+        self.logger = logging.getLogger(__name__)
+        self.lock = Lock()
+        self.jobs = {}          # {имя: задание}
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=workers,
+                                                          thread_name_prefix='Thread offload'))
+        self.thread = Thread(name=name, target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call(self, func, *args) -> None:
+        """
+        Выполняет функцию в потоке цикла событий
+
+        :return: None
+        """
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def add(self, job: Job) -> Job:
+        with self.lock:
+            old = self.jobs.get(job.name)
+            self.jobs[job.name] = job
+        if old is not None:
+            self.call(self.stop, old)
+        return job
+
+    def every(self, name: str, interval: float, func, offload: bool = False, delay: float = 0.0) -> Job:
+        """
+        Периодическое задание func(). Следующий запуск планируется от планового
+        времени предыдущего, пропущенные из-за длительного выполнения запуски
+        не накапливаются
+
+        :param name: имя задания
+        :param interval: период, с
+        :param func: функция без аргументов
+        :param offload: выполнять в пуле потоков
+        :param delay: задержка первого запуска, с
+        :return: задание
+        """
+        job = self.add(Job(name, 'every', func, interval, offload))
+        self.call(lambda: self.schedule(job, self.loop.time() + delay))
+        return job
+
+    def schedule(self, job: Job, when: float) -> None:
+        if job.state == 'cancelled':
+            return
+        job.due = when
+        job.state = 'scheduled'
+        job.handle = self.loop.call_at(when, self.fire, job)
+
+    def fire(self, job: Job) -> None:
+        if job.state == 'cancelled':
+            return
+        job.state = 'running'
+        lag = (self.loop.time() - job.due) * 1000
+        start = time.perf_counter()
+        if not job.offload:
+            error = None
+            try:
+                job.func()
+            except Exception as err:
+                error = err
+            self.done(job, lag, start, error)
+            return
+        future = self.loop.run_in_executor(None, job.func)
+        future.add_done_callback(lambda result: self.done(job, lag, start, result.exception()))
+
+    def done(self, job: Job, lag: float, start: float, error) -> None:
+        self.finish(job, lag, start, error)
+        if job.state == 'cancelled':
+            return
+        now = self.loop.time()
+        due = job.due + job.interval
+        if due < now:
+            with self.lock:
+                job.counters['skipped'] += int((now - due) // job.interval) + 1
+            due = now + job.interval - (now - job.due) % job.interval
+        self.schedule(job, due)
+
+    def finish(self, job: Job, lag: float, start: float, error) -> None:
+        duration = (time.perf_counter() - start) * 1000
+        with self.lock:
+            job.counters['runs'] += 1
+            job.lag.add(max(lag, 0.0))
+            job.duration.add(duration)
+            if error is not None:
+                job.counters['errors'] += 1
+                job.error = str(error)
+        if error is not None:
+            self.logger.error('Ошибка задания %s: %s', job.name, error)
+
+    def wake(self, name: str) -> None:
+        """
+        Запускает периодическое задание немедленно, не дожидаясь периода
+
+        :param name: имя задания
+        :return: None
+        """
+        def wake():
+            job = self.jobs.get(name)
+            if job is None or job.kind != 'every' or job.state != 'scheduled':
+                return
+            job.handle.cancel()
+            with self.lock:
+                job.counters['wakes'] += 1
+            self.schedule(job, self.loop.time())
+        self.call(wake)
+
+    def set_interval(self, name: str, interval: float) -> None:
+        """
+        Изменяет период задания, начиная со следующего запуска
+
+        :param name: имя задания
+        :param interval: период, с
+        :return: None
+        """
+        job = self.jobs.get(name)
+        if job is not None:
+            job.interval = interval
+
+    def cancel(self, name: str) -> None:
+        """
+        Отменяет задание. Выполняемое в пуле задание завершается, но больше не запускается
+
+        :param name: имя задания
+        :return: None
+        """
+        job = self.jobs.get(name)
+        if job is not None:
+            self.call(self.stop, job)
+
+    def stop(self, job: Job) -> None:
+        job.state = 'cancelled'
+        if job.handle is not None:
+            job.handle.cancel()
+
+    def stats(self) -> dict:
+        """
+        :return: статистика по заданиям
+        """
+        with self.lock:
+            return {name: job.as_dict() for name, job in self.jobs.items()}
+
+
+if __name__ == "__main__":
+    import threading
+
+    # задания веб сервера в одном потоке против отдельного потока на каждое
+    # задание: сравниваются число потоков и процессорное время, передача
+    # времени в обоих случаях выполняется отдельным потоком и не измеряется
+    periods = dict(time=0.25, control=3.0, uptime=3600.0)
+    work = lambda: sum(range(2000))
+    seconds = 5
+
+    def measure(label, start):
+        before = threading.active_count()
+        cpu = time.process_time()
+        stop = start()
+        time.sleep(seconds)
+        threads = threading.active_count() - before
+        stop()
+        print('%-10s потоков: %d, процессор: %.1f мс' % (label, threads, (time.process_time() - cpu) * 1000))
+
+    def start_threads():
+        events = []
+        for name, period in periods.items():
+            event = threading.Event()
+            events.append(event)
+
+            def loop(event=event, period=period):
+                while not event.wait(period):
+                    work()
+            threading.Thread(target=loop, daemon=True).start()
+        return lambda: [event.set() for event in events]
+
+    measure('потоки', start_threads)
+    time.sleep(1.5)     # завершение потоков первого замера
+
+    scheduler = None
+
+    def start_scheduler():
+        global scheduler
+        scheduler = Scheduler()
+        for name, period in periods.items():
+            scheduler.every(name, period, work, offload=name == 'uptime')
+        return lambda: [scheduler.cancel(name) for name in list(scheduler.jobs)]
+
+    measure('asyncio', start_scheduler)
+    time.sleep(0.1)
+    for name, stats in scheduler.stats().items():
+        print('%-8s %-9s запусков: %3d, запаздывание avg %.3f мс, max %.3f мс' % (
+            name, stats['state'], stats['runs'], stats['lag']['avg_ms'], stats['lag']['max_ms']))
+    assert scheduler.stats()['time']['runs'] >= seconds * 4 - 1
+    assert all(stats['state'] == 'cancelled' for stats in scheduler.stats().values())
@@ -0,0 +1,200 @@
+import json
+import mmap
+import os
+from struct import Struct
+from time import sleep
+
+SEGMENT_PATH = '/dev/shm/ntp-station-state'
+SEGMENT_SIZE = 256 * 1024
+
+# заголовок сегмента: счетчик seqlock (нечетный - идет запись), длина данных.
+# Счетчик читается и записывается одним 8-байтным словом через memoryview:
+# Struct.pack_into сначала обнуляет поле, читатель увидел бы счетчик 0
+segment_header = Struct('<QI')
+length_field = Struct('<I')
+
+
+class StateUnavailable(Exception):
+    """
+    Сегмент состояния не создан или не согласован
+    """
+    pass
+
+
+class SharedState:
+    """
+    Сегмент разделяемой памяти с состоянием процесса УПШ. Один процесс
+    записывает состояние (JSON), остальные читают без блокировок: запись
+    обрамляется увеличением счетчика seqlock, читатель повторяет чтение,
+    если счетчик изменился или нечетен. Чтение неизмененного состояния не
+    копирует и не декодирует данные сегмента
+    """
+
+    def __init__(self, path: str = SEGMENT_PATH, size: int = SEGMENT_SIZE, writer: bool = False) -> None:
+        """
+        Инициализация
+
+        :param path: файл сегмента (tmpfs)
+        :param size: размер сегмента, байт
+        :param writer: True - процесс записывает состояние, сегмент создается
+        """
+        self.path = path
+        self.writer = writer
+        if writer:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, size)
+                self.map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            self.words = memoryview(self.map).cast('Q')
+            self.sequence = self.words[0] & ~1
+        else:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError as err:
+                raise StateUnavailable('Нет сегмента состояния %s: %s' % (path, err))
+            try:
+                self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+            self.words = memoryview(self.map).cast('Q')
+        self.size = len(self.map)
+        self.cached = (None, None)      # (счетчик, состояние)
+        self.counters = dict(published=0, reads=0, decoded=0, retries=0)
+
+    def publish(self, state: dict) -> int:
+        """
+        Записывает состояние в сегмент
+
+        :param state: словарь состояния
+        :return: счетчик seqlock после записи
+        """
+        data = json.dumps(state, ensure_ascii=False, separators=(',', ':'), default=str).encode()
+        if segment_header.size + len(data) > self.size:
+            raise ValueError('Состояние %d байт не помещается в сегмент %d байт' % (len(data), self.size))
+        # нечетный счетчик, затем длина и данные, затем четный счетчик:
+        # читатель, увидевший один и тот же четный счетчик до и после
+        # чтения, прочитал целую запись
+        sequence = self.sequence + 1
+        self.words[0] = sequence
+        length_field.pack_into(self.map, 8, len(data))
+        self.map[segment_header.size:segment_header.size + len(data)] = data
+        self.words[0] = sequence + 1
+        self.sequence = sequence + 1
+        self.counters['published'] += 1
+        return self.sequence
+
+    def version(self) -> int:
+        """
+        :return: текущий счетчик seqlock (без чтения данных)
+        """
+        return self.words[0]
+
+    def read(self, retries: int = 1000) -> tuple:
+        """
+        Согласованное чтение состояния
+
+        :param retries: число попыток при одновременной записи
+        :return: кортеж (счетчик seqlock, словарь состояния)
+        """
+        self.counters['reads'] += 1
+        for attempt in range(retries):
+            sequence = self.words[0]
+            if sequence == self.cached[0]:
+                return self.cached
+            length = length_field.unpack_from(self.map, 8)[0]
+            if sequence & 1 or length > self.size - segment_header.size:
+                self.counters['retries'] += 1
+                if attempt > 10:
+                    sleep(0)
+                continue
+            data = self.map[segment_header.size:segment_header.size + length]
+            if self.words[0] != sequence:
+                self.counters['retries'] += 1
+                continue
+            if sequence == 0:
+                raise StateUnavailable('Состояние еще не записано')
+            self.counters['decoded'] += 1
+            self.cached = (sequence, json.loads(data))
+            return self.cached
+        raise StateUnavailable('Сегмент состояния постоянно изменяется')
+
+    def stats(self) -> dict:
+        return dict(self.counters, sequence=self.version(), size=self.size)
+
+    def close(self) -> None:
+        self.words.release()
+        self.map.close()
+
+
+def jitter_probe(period: float, count: int, state_path: str = None) -> list:
+    """
+    Имитация передачи структуры времени: пробуждение по абсолютным моментам
+    с периодом period, при заданном state_path - запись состояния в сегмент
+
+    :param period: период, с
+    :param count: число пробуждений
+    :param state_path: файл сегмента
+    :return: лист отклонений пробуждения, мс
+    """
+    from time import monotonic
+    state = SharedState(state_path, size=64 * 1024, writer=True) if state_path else None
+    jitter = []
+    deadline = monotonic() + period
+    for n in range(count):
+        delay = deadline - monotonic()
+        if delay > 0:
+            sleep(delay)
+        jitter.append((monotonic() - deadline) * 1000)
+        if state is not None:
+            state.publish(dict(tick=n, gpsd_data=dict(time='12:00:%02d' % (n % 60), status=1)))
+        deadline += period
+    return jitter
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    from multiprocessing import Pool, Process
+    from threading import Thread
+    from timing import percentile
+
+    path = os.path.join(tempfile.gettempdir(), 'ntp-station-state-test')
+
+    # согласованность: читатель в другом процессе видит только целые записи
+    def writer(count):
+        state = SharedState(path, size=64 * 1024, writer=True)
+        for n in range(count):
+            state.publish(dict(n=n, payload='x' * (n % 5000), check=n * 7))
+
+    SharedState(path, size=64 * 1024, writer=True).publish(dict(n=-1, payload='', check=-7))
+    reader = SharedState(path)
+    process = Process(target=writer, args=(20000,))
+    process.start()
+    seen = 0
+    while process.is_alive() or seen < 19999:
+        _, state = reader.read()
+        assert state['check'] == state['n'] * 7 and len(state['payload']) == max(state['n'], 0) % 5000, state
+        seen = state['n']
+    process.join()
+    print('согласованность: OK', reader.stats())
+
+    # джиттер передачи времени при нагрузке веб сервера (отрисовка шаблонов
+    # удерживает GIL): в одном процессе и в отдельном процессе УПШ
+    def render():
+        while True:
+            ''.join('<tr><td>%d</td><td>%s</td></tr>' % (n, 'x' * 40) for n in range(2000))
+
+    period, count = 0.02, int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    for n in range(3):
+        Thread(target=render, daemon=True).start()
+    results = {}
+    results['совмещенный'] = jitter_probe(period, count)
+    with Pool(1) as pool:
+        results['раздельный'] = pool.apply(jitter_probe, (period, count, path))
+    for label, jitter in results.items():
+        ordered = sorted(jitter)
+        print('%-12s джиттер, мс: p50 %.3f, p99 %.3f, max %.3f' % (
+            label, percentile(ordered, 50), percentile(ordered, 99), ordered[-1]))
+    os.unlink(path)
@@ -0,0 +1,181 @@
+from threading import Lock
+from linuxtools import ImmutableDict
+
+
+def freeze(value):
+    """
+    Преобразует значение в неизменяемое: dict -> ImmutableDict, list -> tuple
+
+    :param value: значение
+    :return: неизменяемое значение
+    """
+    if isinstance(value, ImmutableDict):
+        return value
+    if isinstance(value, dict):
+        return ImmutableDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def merge(current, changes: dict) -> ImmutableDict:
+    """
+    Создает новую версию словаря с изменениями, вложенные словари
+    объединяются рекурсивно, неизмененные значения используются повторно
+
+    :param current: текущий словарь
+    :param changes: изменения
+    :return: новый неизменяемый словарь
+    """
+    result = dict(current or {})
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge(result[key], value)
+        else:
+            result[key] = freeze(value)
+    return ImmutableDict(result)
+
+
+class SettingsStore:
+    """
+    Хранилище настроек с неизменяемыми снимками, атомарными версионными
+    обновлениями и подпиской на изменения
+    """
+
+    def __init__(self, **sections) -> None:
+        """
+        Инициализация
+
+        :param sections: начальные значения разделов настроек
+        """
+        self.lock = Lock()
+        self.version = 0
+        self.sections = {name: freeze(value) for name, value in sections.items()}
+        self.subscribers = []
+
+    def get(self, section: str) -> ImmutableDict:
+        """
+        Текущий снимок раздела. Снимок не изменяется, копирование не требуется
+
+        :param section: имя раздела
+        :return: неизменяемый словарь
+        """
+        return self.sections[section]
+
+    def snapshot(self) -> tuple:
+        """
+        Согласованный снимок всех разделов
+
+        :return: кортеж (версия, словарь разделов)
+        """
+        with self.lock:
+            return self.version, dict(self.sections)
+
+    def update(self, section: str, changes: dict) -> int:
+        """
+        Атомарно применяет изменения к разделу
+
+        :param section: имя раздела
+        :param changes: изменения, вложенные словари объединяются
+        :return: версия хранилища после изменения
+        """
+        with self.lock:
+            old = self.sections.get(section)
+            notify = self._commit(section, old, merge(old, changes))
+        return self._notify(*notify)
+
+    def replace(self, section: str, value: dict) -> int:
+        """
+        Атомарно заменяет раздел целиком
+
+        :param section: имя раздела
+        :param value: новое значение раздела
+        :return: версия хранилища после изменения
+        """
+        with self.lock:
+            notify = self._commit(section, self.sections.get(section), freeze(value))
+        return self._notify(*notify)
+
+    def _commit(self, section: str, old, new) -> tuple:
+        if old == new:
+            return self.version, ()
+        self.sections[section] = new
+        self.version += 1
+        subscribers = [callback for callback, sections in self.subscribers
+                       if not sections or section in sections]
+        return self.version, subscribers, section, old, new
+
+    @staticmethod
+    def _notify(version: int, subscribers, section: str = None, old=None, new=None) -> int:
+        # обработчики вызываются без блокировки, чтобы они могли читать и изменять хранилище
+        for callback in subscribers:
+            callback(section, old, new, version)
+        return version
+
+    def subscribe(self, callback, *sections):
+        """
+        Подписывает обработчик на изменения разделов.
+        Обработчик вызывается в потоке, выполнившем изменение:
+        callback(раздел, старое значение, новое значение, версия)
+
+        :param callback: обработчик
+        :param sections: имена разделов, без имен - все разделы
+        :return: обработчик
+        """
+        with self.lock:
+            self.subscribers.append((callback, frozenset(sections)))
+        return callback
+
+    def unsubscribe(self, callback) -> None:
+        """
+        Отменяет подписку обработчика
+
+        :param callback: обработчик
+        :return: None
+        """
+        with self.lock:
+            self.subscribers = [item for item in self.subscribers if item[0] is not callback]
+
+
+if __name__ == "__main__":
+    from copy import deepcopy
+    from threading import Thread
+    from time import perf_counter
+    from linuxtools import default_settings
+
+    # нагрузочная проверка: параллельные обновления не теряются, версии монотонны
+    store = SettingsStore(counters={}, main=default_settings['main'])
+    seen = []
+    store.subscribe(lambda section, old, new, version: seen.append(version), 'counters')
+    threads, count = 8, 5000
+
+    def writer(n):
+        for i in range(count):
+            store.update('counters', {'t%d' % n: i + 1})
+            assert store.get('counters')['t%d' % n] >= i + 1
+
+    workers = [Thread(target=writer, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(store.get('counters')['t%d' % n] == count for n in range(threads))
+    assert store.version == threads * count and len(seen) == threads * count
+    print('stress: %d обновлений, версия %d' % (threads * count, store.version))
+
+    # чтение снимка против deepcopy
+    main = dict(default_settings['main'])
+    loops = 20000
+    start = perf_counter()
+    for _ in range(loops):
+        deepcopy(main)
+    copy_us = (perf_counter() - start) * 1e6 / loops
+    start = perf_counter()
+    for _ in range(loops):
+        store.get('main')
+    get_us = (perf_counter() - start) * 1e6 / loops
+    start = perf_counter()
+    for n in range(loops):
+        store.update('main', {'tz': '%+d' % (n % 12)})
+    update_us = (perf_counter() - start) * 1e6 / loops
+    print('deepcopy(main): %.2f мкс, снимок: %.3f мкс, обновление: %.2f мкс' % (copy_us, get_us, update_us))
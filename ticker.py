@@ -0,0 +1,196 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import time
+from threading import Lock
+from executor import LatencyHistogram
+
+CLOCK_REALTIME = 0
+TIMER_ABSTIME = 1
+TFD_CLOEXEC = 0o2000000
+TFD_TIMER_ABSTIME = 1
+TFD_TIMER_CANCEL_ON_SET = 2
+
+# границы интервалов гистограммы отклонения от границы секунды, мс
+boundary_bounds = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+class itimerspec(ctypes.Structure):
+    _fields_ = [('it_interval', timespec), ('it_value', timespec)]
+
+
+def load_libc():
+    """
+    Загружает libc для вызовов timerfd и clock_nanosleep
+
+    :return: библиотека или None, если libc недоступна
+    """
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+
+
+libc = load_libc()
+
+
+class SecondTicker:
+    """
+    Пробуждение потока на границах секунд CLOCK_REALTIME.
+    Используется timerfd (учитывает перевод часов), при отсутствии -
+    clock_nanosleep с абсолютным временем, при отсутствии libc - sleep
+    """
+
+    def __init__(self, mode: str = None) -> None:
+        """
+        Инициализация
+
+        :param mode: 'timerfd', 'nanosleep' или 'sleep', None - лучший доступный
+        """
+        self.lock = Lock()
+        self.fd = None
+        self.next = None            # следующая граница секунды для nanosleep и sleep
+        self.histogram = LatencyHistogram(boundary_bounds)
+        self.wakeups = LatencyHistogram(boundary_bounds)
+        self.counters = dict(ticks=0, missed=0, steps=0)
+        self.mode = mode or ('timerfd' if hasattr(libc, 'timerfd_create') else
+                             'nanosleep' if hasattr(libc, 'clock_nanosleep') else 'sleep')
+        if self.mode == 'timerfd':
+            self.fd = libc.timerfd_create(CLOCK_REALTIME, TFD_CLOEXEC)
+            if self.fd < 0:
+                self.fd = None
+                self.mode = 'nanosleep'
+            else:
+                self.arm()
+
+    def arm(self) -> None:
+        """
+        Запускает периодический таймер timerfd от ближайшей границы секунды
+
+        :return: None
+        """
+        spec = itimerspec(timespec(1, 0), timespec(int(time.time()) + 1, 0))
+        if libc.timerfd_settime(self.fd, TFD_TIMER_ABSTIME | TFD_TIMER_CANCEL_ON_SET,
+                                ctypes.byref(spec), None) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def wait(self) -> int:
+        """
+        Ожидает следующую границу секунды
+
+        :return: граница секунды (время UNIX), на которой проснулся поток
+        """
+        if self.mode == 'timerfd':
+            missed = self.wait_timerfd()
+        else:
+            missed = self.wait_sleep()
+        return self.tick(missed)
+
+    def tick(self, missed: int) -> int:
+        """
+        Учитывает пробуждение на границе секунды
+
+        :param missed: число пропущенных границ
+        :return: граница секунды
+        """
+        now = time.time()
+        boundary = int(now)
+        with self.lock:
+            self.counters['ticks'] += 1
+            self.counters['missed'] += missed
+            self.wakeups.add((now - boundary) * 1000)
+        return boundary
+
+    def wait_timerfd(self) -> int:
+        while True:
+            try:
+                expirations = int.from_bytes(os.read(self.fd, 8), 'little')
+                return expirations - 1
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno != errno.ECANCELED:
+                    raise
+            # часы переведены: таймер перезапускается от новой границы секунды
+            with self.lock:
+                self.counters['steps'] += 1
+            self.arm()
+
+    def wait_sleep(self) -> int:
+        now = time.time()
+        if self.next is None or not now - 1 < self.next <= now + 1:
+            # первый запуск или перевод часов
+            if self.next is not None:
+                with self.lock:
+                    self.counters['steps'] += 1
+            self.next = int(now) + 1
+        if self.mode == 'nanosleep':
+            target = timespec(self.next, 0)
+            while libc.clock_nanosleep(CLOCK_REALTIME, TIMER_ABSTIME, ctypes.byref(target), None) == errno.EINTR:
+                pass
+        else:
+            while now < self.next:
+                time.sleep(self.next - now)
+                now = time.time()
+        now = time.time()
+        missed = max(int(now) - self.next, 0)
+        self.next = int(now) + 1
+        return missed
+
+    def record(self, boundary: int) -> float:
+        """
+        Сохраняет отклонение момента передачи от границы секунды
+
+        :param boundary: граница секунды, возвращенная wait()
+        :return: отклонение, мс
+        """
+        ms = (time.time() - boundary) * 1000
+        with self.lock:
+            self.histogram.add(ms)
+        return ms
+
+    def stats(self) -> dict:
+        """
+        :return: режим, счетчики, гистограммы пробуждения и передачи
+        """
+        with self.lock:
+            return dict(self.counters,
+                        mode=self.mode,
+                        wakeup=self.wakeups.as_dict(),
+                        write=self.histogram.as_dict())
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+if __name__ == "__main__":
+    import sys
+    from threading import Thread
+
+    # нагрузка на GIL, имитирующая отрисовку страниц
+    def busy():
+        while True:
+            sum(range(10000))
+
+    if 'busy' in sys.argv:
+        for _ in range(2):
+            Thread(target=busy, daemon=True).start()
+
+    seconds = 5
+    for mode in ('timerfd', 'nanosleep', 'sleep'):
+        ticker = SecondTicker(mode)
+        for _ in range(seconds):
+            ticker.record(ticker.wait())
+        stats = ticker.stats()
+        print(mode, 'ticks:', stats['ticks'], 'missed:', stats['missed'], 'steps:', stats['steps'])
+        print('  wakeup:', stats['wakeup'])
+        print('  write: ', stats['write'])
+        ticker.close()
@@ -0,0 +1,116 @@
+from array import array
+from math import ceil
+from threading import Lock
+
+# этапы передачи пакета: отсчеты, между которыми измеряется задержка
+stages = (
+    ('wake', 'boundary', 'enqueued'),       # граница секунды -> пробуждение потока
+    ('queue', 'enqueued', 'dequeued'),      # ожидание устройства УПШ
+    ('write', 'dequeued', 'written'),       # формирование пакета и запись в УПШ
+    ('total', 'boundary', 'written'),       # граница секунды -> пакет передан
+)
+points = ('boundary', 'enqueued', 'dequeued', 'written')
+
+# число пакетов между сводками в журнале (10 минут для структуры времени)
+log_interval = 600
+
+
+def percentile(ordered, p: float) -> float:
+    """
+    Перцентиль отсортированной последовательности (ближайший ранг)
+
+    :param ordered: отсортированная последовательность
+    :param p: перцентиль, 0-100
+    :return: значение перцентиля
+    """
+    if not ordered:
+        return 0.0
+    return ordered[max(0, ceil(p / 100 * len(ordered)) - 1)]
+
+
+class TimingRing:
+    """
+    Кольцевой буфер фиксированного размера с отсчетами времени передачи пакетов
+    """
+
+    def __init__(self, size: int = 3600) -> None:
+        """
+        Инициализация
+
+        :param size: число хранимых пакетов
+        """
+        self.size = size
+        self.lock = Lock()
+        self.columns = {point: array('d', bytes(8 * size)) for point in points}
+        self.index = 0
+        self.count = 0
+
+    def add(self, boundary: float, enqueued: float, dequeued: float, written: float) -> None:
+        """
+        Сохраняет отсчеты времени пакета, время UNIX в секундах
+
+        :param boundary: граница секунды
+        :param enqueued: постановка пакета на передачу
+        :param dequeued: начало передачи
+        :param written: завершение записи в УПШ
+        :return: None
+        """
+        with self.lock:
+            i = self.index
+            self.columns['boundary'][i] = boundary
+            self.columns['enqueued'][i] = enqueued
+            self.columns['dequeued'][i] = dequeued
+            self.columns['written'][i] = written
+            self.index = (i + 1) % self.size
+            self.count += 1
+
+    def delays(self, stage: str) -> list:
+        """
+        Задержки этапа по сохраненным пакетам
+
+        :param stage: имя этапа из stages
+        :return: лист задержек, мс
+        """
+        start, end = next((start, end) for name, start, end in stages if name == stage)
+        with self.lock:
+            n = min(self.count, self.size)
+            return [(b - a) * 1000 for a, b in zip(self.columns[start][:n], self.columns[end][:n])]
+
+    def summary(self) -> dict:
+        """
+        p50/p99/max задержек по этапам
+
+        :return: словарь {этап: {'p50', 'p99', 'max'}} в мс и число пакетов
+        """
+        result = dict(count=self.count)
+        for stage, _, _ in stages:
+            ordered = sorted(self.delays(stage))
+            result[stage] = dict(p50=round(percentile(ordered, 50), 3),
+                                 p99=round(percentile(ordered, 99), 3),
+                                 max=round(ordered[-1], 3) if ordered else 0.0)
+        return result
+
+    def format(self) -> str:
+        """
+        :return: строка со сводкой для журнала
+        """
+        summary = self.summary()
+        return 'пакетов: %d; ' % summary['count'] + '; '.join(
+            '%s p50 %.3f p99 %.3f max %.3f мс' % (stage, summary[stage]['p50'],
+                                                 summary[stage]['p99'], summary[stage]['max'])
+            for stage, _, _ in stages)
+
+
+if __name__ == "__main__":
+    from random import Random
+
+    rnd = Random(0)
+    ring = TimingRing(size=100)
+    for n in range(250):
+        boundary = 1700000000.0 + n
+        enqueued = boundary + rnd.uniform(0, 0.002)
+        dequeued = enqueued + rnd.uniform(0, 0.0005)
+        ring.add(boundary, enqueued, dequeued, dequeued + rnd.uniform(0.0001, 0.001))
+    assert len(ring.delays('total')) == 100
+    assert percentile([1, 2, 3, 4], 50) == 2 and percentile(list(range(1, 101)), 99) == 99
+    print(ring.format())
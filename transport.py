@@ -0,0 +1,410 @@
+import logging
+import os
+from collections import deque
+from threading import Condition
+from time import monotonic, sleep
+from protocol import outbound, inbound
+
+VENDOR_ID = 0x0483
+PRODUCT_ID = 0x572B
+EP_IN = 0x81
+EP_OUT = 0x01
+# таймаут чтения потока приема, мс: поток просыпается без пакетов раз в период
+READ_TIMEOUT = 1000
+
+
+class TransportError(Exception):
+    """
+    Ошибка обмена с УПШ
+    """
+    pass
+
+
+class TransportTimeout(TransportError):
+    """
+    Истекло время ожидания пакета
+    """
+    pass
+
+
+class DeviceLost(TransportError):
+    """
+    Устройство УПШ отключено
+    """
+    pass
+
+
+class Backoff:
+    """
+    Экспоненциально растущая задержка повторных попыток
+    """
+
+    def __init__(self, initial: float = 0.1, maximum: float = 10.0, sleep=sleep) -> None:
+        """
+        :param initial: первая задержка, с
+        :param maximum: максимальная задержка, с
+        :param sleep: функция задержки
+        """
+        self.sleep = sleep
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = initial
+        self.attempts = 0
+
+    def wait(self) -> float:
+        """
+        Выполняет задержку и увеличивает следующую вдвое
+
+        :return: выполненная задержка, с
+        """
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.maximum)
+        self.attempts += 1
+        self.sleep(delay)
+        return delay
+
+    def reset(self) -> None:
+        self.delay = self.initial
+        self.attempts = 0
+
+
+class Transport:
+    """
+    Интерфейс канала обмена пакетами с УПШ
+    """
+    name = None
+
+    def open(self) -> bool:
+        """
+        Выполняет поиск и конфигурацию устройства
+
+        :return: true - устройство готово к работе
+        """
+        raise NotImplementedError
+
+    def read(self, size: int = 64, timeout: int = None) -> bytes:
+        """
+        Принимает пакет
+
+        :param size: максимальный размер пакета
+        :param timeout: время ожидания в мс, None - без ограничения
+        :return: пакет
+        """
+        raise NotImplementedError
+
+    def write(self, packet: bytes) -> int:
+        """
+        Передает пакет
+
+        :param packet: пакет
+        :return: число переданных байт
+        """
+        raise NotImplementedError
+
+    def recover(self, endpoint: int) -> bool:
+        """
+        Восстанавливает конечную точку после ошибки обмена
+
+        :param endpoint: адрес конечной точки
+        :return: false - устройство потеряно, требуется повторное открытие
+        """
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class PyUsbTransport(Transport):
+    """
+    Обмен с УПШ через pyusb
+    """
+    name = 'pyusb'
+
+    def __init__(self, vendor: int = VENDOR_ID, product: int = PRODUCT_ID) -> None:
+        import usb as usblib
+        self.usblib = usblib
+        self.logger = logging.getLogger(__name__)
+        self.vendor = vendor
+        self.product = product
+        self.device = None
+
+    def open(self) -> bool:
+        usblib = self.usblib
+        self.device = usblib.core.find(idVendor=self.vendor,
+                                       idProduct=self.product,
+                                       )
+        if not self.device:
+            self.logger.error("Устройство USB не обнаружено")
+            return False
+        self.logger.debug(self.device)
+
+        driver_list = []
+        try:
+            for interface in (0, 1, 2):
+                if self.device.is_kernel_driver_active(interface=interface):
+                    self.device.detach_kernel_driver(interface=interface)
+                    driver_list.append(interface)
+                    self.logger.debug("Деактивация USB интерфейса %s", str(interface))
+        except usblib.core.USBError as err:
+            self.logger.debug("Ошибка деактивации: %s", str(err))
+
+        try:
+            self.device.set_configuration()
+        except usblib.core.USBError as err:
+            self.logger.error("Ошибка конфигурации USB: %s", str(err))
+            self.close()
+            return False
+
+        try:
+            for interface in driver_list:
+                self.device.attach_kernel_driver(interface=interface)
+                self.logger.debug("Активация USB интерфейса %s", str(interface))
+        except usblib.core.USBError as err:
+            self.logger.debug("Ошибка конфигурации USB: %s", str(err))
+        return True
+
+    def error(self, err) -> TransportError:
+        """
+        Преобразует исключение pyusb в исключение транспорта
+
+        :param err: исключение pyusb
+        :return: исключение транспорта
+        """
+        if isinstance(err, self.usblib.core.USBTimeoutError):
+            return TransportTimeout(str(err))
+        if '[Errno 19] No such device' in str(err):
+            return DeviceLost(str(err))
+        return TransportError(str(err))
+
+    def read(self, size: int = 64, timeout: int = None) -> bytes:
+        try:
+            # timeout 0 - ожидание без ограничения, поток спит в libusb до прихода пакета
+            return self.device.read(endpoint=EP_IN, size_or_buffer=size,
+                                    timeout=0 if timeout is None else timeout)
+        except self.usblib.core.USBError as err:
+            raise self.error(err) from err
+
+    def write(self, packet: bytes) -> int:
+        try:
+            return self.device.write(EP_OUT, packet)
+        except self.usblib.core.USBError as err:
+            raise self.error(err) from err
+
+    def recover(self, endpoint: int) -> bool:
+        usblib = self.usblib
+        index = 0 if endpoint == EP_IN else 1
+        try:
+            status = usblib.control.get_status(self.device, self.device[0][0, 0][index])
+            if status:
+                usblib.control.clear_feature(self.device, 0, recipient=endpoint)
+                return True
+        except Exception as err:
+            self.logger.error("Ошибка clear_feature USB: %s", str(err))
+            return True
+        return False
+
+    def close(self) -> None:
+        if self.device is not None:
+            self.usblib.util.dispose_resources(self.device)  # release usb device
+            self.device = None
+
+
+def zero_fields(message) -> tuple:
+    """
+    :param message: описание структуры протокола
+    :return: нулевые значения полей структуры без id
+    """
+    return message.unpack(bytes(message.struct.size))
+
+
+class FakeMcuTransport(Transport):
+    """
+    Имитация УПШ в процессе: отвечает на 'get' запрошенной структурой,
+    периодически передает pps_info и нажатия кнопок, принимает кадры LCD
+    """
+    name = 'fake'
+
+    def __init__(self, pps_period: float = 1.0, buttons_period: float = 0.5, buttons: tuple = (1, 2, 4, 8),
+                 version: tuple = (b'TS-FAKE', b'1.0', b'2024-01-01', b'00')) -> None:
+        """
+        Инициализация
+
+        :param pps_period: период передачи pps_info, с, 0 - не передавать
+        :param buttons_period: период нажатий кнопок, с, 0 - не нажимать
+        :param buttons: маски кнопок, нажимаемых по кругу
+        :param version: поля структуры version
+        """
+        self.pps_period = pps_period
+        self.buttons_period = buttons_period
+        self.buttons = buttons
+        self.version = version
+        self.condition = Condition()
+        self.packets = deque()
+        self.opened = False
+        self.next_pps = self.next_button = 0.0
+        self.presses = 0
+        self.frame = None
+        self.received = {}          # {имя структуры: число принятых пакетов}
+
+    def open(self) -> bool:
+        with self.condition:
+            now = monotonic()
+            self.next_pps = now + self.pps_period
+            self.next_button = now + self.buttons_period
+            self.opened = True
+            # после подключения УПШ запрашивает настройки сторожевого таймера
+            self.emit('get', outbound['gps_wdog'].id)
+        return True
+
+    def emit(self, name: str, *fields) -> None:
+        """
+        Ставит пакет УПШ в очередь на чтение
+
+        :param name: имя входящей структуры
+        :param fields: поля структуры
+        :return: None
+        """
+        with self.condition:
+            self.packets.append(inbound[name].pack(*fields))
+            self.condition.notify()
+
+    def inbound_fields(self, name: str) -> tuple:
+        if name == 'version':
+            return self.version
+        if name == 'pps_info':
+            return 1, 1, self.presses % 7 - 3, 0, 0, 2048
+        return zero_fields(inbound[name])
+
+    def schedule(self, now: float) -> float:
+        """
+        Формирует пакеты, срок которых наступил
+
+        :param now: текущее время monotonic
+        :return: время следующего события
+        """
+        if self.pps_period and now >= self.next_pps:
+            self.next_pps = max(self.next_pps + self.pps_period, now)
+            self.packets.append(inbound['pps_info'].pack(*self.inbound_fields('pps_info')))
+        if self.buttons_period and now >= self.next_button:
+            self.next_button = max(self.next_button + self.buttons_period, now)
+            mask = self.buttons[self.presses % len(self.buttons)]
+            self.presses += 1
+            # rising, falling, pressed, clamping, timers
+            self.packets.append(inbound['buttons'].pack(mask, 0, mask, 0, 0))
+            self.packets.append(inbound['buttons'].pack(0, mask, 0, 0, 0))
+        deadlines = [deadline for period, deadline in ((self.pps_period, self.next_pps),
+                                                        (self.buttons_period, self.next_button)) if period]
+        return min(deadlines) if deadlines else None
+
+    def read(self, size: int = 64, timeout: int = None) -> bytes:
+        end = None if timeout is None else monotonic() + timeout / 1000
+        with self.condition:
+            while True:
+                if not self.opened:
+                    raise DeviceLost('[Errno 19] No such device')
+                now = monotonic()
+                next_event = self.schedule(now)
+                if self.packets:
+                    return self.packets.popleft()[:size]
+                if end is not None and now >= end:
+                    raise TransportTimeout('timeout')
+                wait = [t - now for t in (next_event, end) if t is not None]
+                self.condition.wait(min(wait) if wait else None)
+
+    def write(self, packet: bytes) -> int:
+        with self.condition:
+            if not self.opened:
+                raise DeviceLost('[Errno 19] No such device')
+            message = outbound.by_id.get(packet[0])
+            if message is None:
+                raise TransportError('unknown struct %d' % packet[0])
+            self.received[message.name] = self.received.get(message.name, 0) + 1
+            if message.name == 'lcd':
+                self.frame = message.unpack(packet)[0]
+            elif message.name == 'lcd_page' and self.frame is not None:
+                index, data = message.unpack(packet)
+                self.frame = self.frame[:index * len(data)] + data + self.frame[(index + 1) * len(data):]
+            elif message.name == 'get':
+                requested = inbound.by_id.get(message.unpack(packet)[0])
+                if requested is not None:
+                    self.packets.append(requested.pack(*self.inbound_fields(requested.name)))
+                    self.condition.notify()
+            return len(packet)
+
+    def close(self) -> None:
+        with self.condition:
+            self.opened = False
+            self.condition.notify_all()
+
+
+transports = {transport.name: transport for transport in (PyUsbTransport, FakeMcuTransport)}
+
+
+def make_transport(name: str = None) -> Transport:
+    """
+    Создает канал обмена с УПШ. Переменная окружения USB_TRANSPORT
+    имеет приоритет над аргументом, по умолчанию 'pyusb'
+
+    :param name: 'pyusb' или 'fake'
+    :return: канал обмена
+    """
+    name = os.environ.get('USB_TRANSPORT') or name or 'pyusb'
+    if name not in transports:
+        raise ValueError('Неизвестный канал обмена УПШ: %s' % name)
+    return transports[name]()
+
+
+if __name__ == "__main__":
+    from threading import Thread
+    from time import perf_counter
+
+    # тракт хоста: поток чтения распаковывает пакеты и отвечает на 'get',
+    # основной поток измеряет задержку запроса version и скорость передачи кадров LCD
+    mcu = FakeMcuTransport(pps_period=0.01, buttons_period=0.02)
+    mcu.open()
+    answers = Condition()
+    versions = []
+    counts = {}
+
+    def reader():
+        while True:
+            try:
+                packet = mcu.read(64, timeout=None)
+            except DeviceLost:
+                return
+            message = inbound.by_id[packet[0]]
+            counts[message.name] = counts.get(message.name, 0) + 1
+            fields = message.unpack(packet)
+            if message.name == 'get':
+                requested = outbound.by_id[fields[0]]
+                mcu.write(requested.pack(*zero_fields(requested)))
+            elif message.name == 'version':
+                with answers:
+                    versions.append(perf_counter())
+                    answers.notify()
+
+    thread = Thread(target=reader, daemon=True)
+    thread.start()
+
+    loops = 2000
+    latencies = []
+    get = outbound['get']
+    for _ in range(loops):
+        with answers:
+            start = perf_counter()
+            mcu.write(get.pack(inbound['version'].id))
+            answers.wait_for(lambda: len(versions) > len(latencies))
+            latencies.append((versions[-1] - start) * 1e6)
+    latencies.sort()
+    print('get -> version: p50 %.1f мкс, p99 %.1f мкс' % (latencies[loops // 2], latencies[loops * 99 // 100]))
+
+    frame = outbound['lcd'].pack(bytes(range(244)) * 2)
+    start = perf_counter()
+    for _ in range(loops * 5):
+        mcu.write(frame)
+    elapsed = perf_counter() - start
+    print('lcd: %.0f кадров/с, %.1f МБ/с' % (loops * 5 / elapsed, loops * 5 * len(frame) / elapsed / 1e6))
+    sleep(0.1)
+    mcu.close()
+    thread.join()
+    print('принято хостом:', counts, 'принято УПШ:', mcu.received)
@@ -0,0 +1,121 @@
+import heapq
+from threading import Condition
+from time import monotonic
+
+# допустимая задержка отправки структур УПШ после постановки в очередь, с.
+# структура с ближайшим сроком отправляется первой
+send_deadlines = {
+    'time': 0.05,
+    'reset': 0.1,
+    'status': 0.2,
+    'gps_mux': 0.2,
+    'lcd': 0.3,
+    'gps_wdog': 0.5,
+    'get': 1.0,
+}
+default_deadline = 1.0
+
+
+class UsbScheduler:
+    """
+    Очередь исходящих структур УПШ: повторные запросы одной структуры
+    объединяются, отправка выполняется в порядке сроков (EDF)
+    """
+
+    def __init__(self, maxsize: int = 32, deadlines: dict = None) -> None:
+        """
+        Инициализация очереди
+
+        :param maxsize: максимальное число ожидающих структур
+        :param deadlines: словарь {имя структуры: допустимая задержка, с}
+        """
+        self.maxsize = maxsize
+        self.deadlines = send_deadlines if deadlines is None else deadlines
+        self.condition = Condition()
+        self.heap = []
+        self.pending = {}   # {имя структуры: (порядковый номер, время постановки)}
+        self.sequence = 0
+        self.counters = dict(put=0, sent=0, coalesced=0, dropped=0)
+        self.waits = {}
+
+    def put(self, name: str) -> None:
+        """
+        Ставит структуру в очередь. Если структура уже ожидает отправки,
+        запрос объединяется с ожидающим: данные формируются при отправке
+
+        :param name: имя структуры
+        :return: None
+        """
+        if not name:
+            return
+        with self.condition:
+            self.counters['put'] += 1
+            if name in self.pending:
+                self.counters['coalesced'] += 1
+                return
+            now = monotonic()
+            deadline = now + self.deadlines.get(name, default_deadline)
+            if len(self.pending) >= self.maxsize:
+                # вытесняется структура с самым поздним сроком
+                latest = max(self.heap)
+                self.counters['dropped'] += 1
+                if latest[0] <= deadline:
+                    return
+                self.heap.remove(latest)
+                heapq.heapify(self.heap)
+                del self.pending[latest[2]]
+            self.sequence += 1
+            heapq.heappush(self.heap, (deadline, self.sequence, name))
+            self.pending[name] = (self.sequence, now)
+            self.condition.notify()
+
+    def get(self, timeout: float = None):
+        """
+        Извлекает структуру с ближайшим сроком отправки
+
+        :param timeout: время ожидания, None - без ограничения
+        :return: имя структуры или None по таймауту
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.heap, timeout):
+                return None
+            deadline, _, name = heapq.heappop(self.heap)
+            _, enqueued = self.pending.pop(name)
+            now = monotonic()
+            wait = self.waits.setdefault(name, dict(count=0, total=0.0, max=0.0, late=0))
+            wait['count'] += 1
+            wait['total'] += now - enqueued
+            wait['max'] = max(wait['max'], now - enqueued)
+            wait['late'] += now > deadline
+            self.counters['sent'] += 1
+            return name
+
+    def task_done(self) -> None:
+        """
+        Совместимость с интерфейсом queue.Queue
+
+        :return: None
+        """
+        pass
+
+    def qsize(self) -> int:
+        """
+        :return: число ожидающих структур
+        """
+        with self.condition:
+            return len(self.heap)
+
+    def stats(self) -> dict:
+        """
+        Глубина очереди, счетчики и время ожидания отправки по структурам
+
+        :return: словарь со статистикой
+        """
+        with self.condition:
+            return dict(self.counters,
+                        depth=len(self.heap),
+                        waits={name: dict(count=wait['count'],
+                                          avg_ms=round(wait['total'] * 1000 / wait['count'], 3),
+                                          max_ms=round(wait['max'] * 1000, 3),
+                                          late=wait['late'])
+                               for name, wait in self.waits.items()})